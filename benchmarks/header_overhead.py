@@ -0,0 +1,135 @@
+"""Micro-benchmark for the per-file overhead of deriving the archive location and the frame values from a FITS
+header, i.e. everything Frame.ingest does with the header before any pixel I/O.
+
+Both are measured with the current code and, as baseline, with the implementation it replaced: a FilenameFormatter
+that is created for every file and searches its format for placeholders on every call, and dates parsed by astropy's
+Time.
+
+Usage:
+    python benchmarks/header_overhead.py [-n NUMBER]
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import re
+import sys
+import timeit
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pyobs_archive.settings')
+
+import django  # noqa: E402
+from astropy.io import fits  # noqa: E402
+from astropy.time import Time  # noqa: E402
+
+django.setup()
+
+# logging would take longer than the code being measured
+logging.disable(logging.INFO)
+
+from django.conf import settings  # noqa: E402
+
+from pyobs_archive.api import models  # noqa: E402
+from pyobs_archive.api.models import Frame  # noqa: E402
+from pyobs_archive.api.utils import FilenameFormatter  # noqa: E402
+
+# formats with all kinds of placeholders
+PATH_FORMATTER = '{SITEID}/{TELID}/{DATE-OBS|date:}/'
+FILENAME_FORMATTER = '{SITEID}{TELID}-{INSTRUME|lower}-{DATE-OBS|date:}-{DATE-OBS|time:}-{EXPNUM|string:04d}' \
+                     '{FILTER|filter}'
+
+
+class LegacyFormatter(FilenameFormatter):
+    """FilenameFormatter as it was before formats were compiled, as baseline."""
+
+    def __call__(self, hdr: fits.Header) -> str:
+        if self.format is None:
+            return None
+        output = self.format
+        placeholders = re.findall(r'\{[\w\d_-]+(?:\|[\w\d_-]+\:?(?:[\w\d_-]+)*)?\}', self.format)
+        if len(placeholders) == 0:
+            return self.format
+        for ph in placeholders:
+            output = output.replace(ph, self._format_placeholder(ph, hdr))
+        return output
+
+    def _format_placeholder(self, placeholder: str, hdr: fits.Header) -> str:
+        key = placeholder[1:-1]
+        method = None
+        params = []
+        if '|' in key:
+            key, method = key.split('|')
+        if method is not None and ':' in method:
+            method, *params = method.split(':')
+        if method is None:
+            return self._value(hdr, key)
+        return self.funcs[method](hdr, key, *params)
+
+    def _format_time(self, hdr: fits.Header, key: str, delimiter: str = '-') -> str:
+        fmt = '%H' + delimiter + '%M' + delimiter + '%S'
+        return Time(self._value(hdr, key)).datetime.strftime(fmt)
+
+    def _format_date(self, hdr: fits.Header, key: str, delimiter: str = '-') -> str:
+        fmt = '%Y' + delimiter + '%m' + delimiter + '%d'
+        return Time(self._value(hdr, key)).datetime.strftime(fmt)
+
+
+@contextlib.contextmanager
+def legacy():
+    """Run Frame with the baseline implementation: a new formatter for every file and dates parsed by Time."""
+    with mock.patch.object(models, 'get_formatter', LegacyFormatter), \
+            mock.patch.object(models, 'parse_date', lambda value: Time(value).to_datetime()):
+        yield
+
+
+def header() -> fits.Header:
+    hdr = fits.Header()
+    for key, value in [('DATE-OBS', '2024-01-15T21:34:56.789'), ('DAY-OBS', '2024-01-15'), ('NAXIS1', 2048),
+                       ('NAXIS2', 2048), ('XBINNING', 1), ('YBINNING', 1), ('FNAME', 'frame'), ('SITEID', 'iag'),
+                       ('TELID', 't50'), ('INSTRUME', 'SBIG6'), ('IMAGETYP', 'object'), ('OBJECT', 'M31'),
+                       ('EXPTIME', 30.), ('FILTER', 'V'), ('EXPNUM', 12), ('TEL-RA', 10.68), ('TEL-DEC', 41.27)]:
+        hdr[key] = value
+    return hdr
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=2000, help='Number of calls per measurement')
+    args = parser.parse_args()
+
+    settings.ARCHIVE_ROOT = '/tmp/'
+    settings.PATH_FORMATTER = PATH_FORMATTER
+    settings.FILENAME_FORMATTER = FILENAME_FORMATTER
+    hdr = header()
+
+    # both implementations must give the same results
+    def results():
+        frame = Frame()
+        frame.add_fits_header(hdr)
+        return Frame.archive_location(hdr), frame.DATE_OBS
+    with legacy():
+        before = results()
+    if before != results():
+        raise RuntimeError('Baseline and current implementation differ.')
+
+    # measure best of five runs for baseline and current implementation
+    benchmarks = {
+        'archive_location': lambda: Frame.archive_location(hdr),
+        'add_fits_header': lambda: Frame().add_fits_header(hdr),
+    }
+    totals = [0., 0.]
+    print('%-20s %12s %12s %8s' % ('', 'before', 'after', 'speedup'))
+    for name, func in benchmarks.items():
+        with legacy():
+            before = min(timeit.repeat(func, number=args.number, repeat=5)) / args.number
+        after = min(timeit.repeat(func, number=args.number, repeat=5)) / args.number
+        totals = [totals[0] + before, totals[1] + after]
+        print('%-20s %9.1f us %9.1f us %7.1fx' % (name, before * 1e6, after * 1e6, before / after))
+    print('%-20s %9.1f us %9.1f us %7.1fx' % ('total', totals[0] * 1e6, totals[1] * 1e6, totals[0] / totals[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,343 @@
+"""Benchmark for the throughput of ingesting frames, with separate timings for each stage of Frame.ingest.
+
+Synthetic frames (see synthetic.py) are ingested into a fresh database and a temporary archive, for every combination
+of image size, compression tile shape and number of parallel processes. Each process runs the same steps as
+Frame.ingest for a file, but times them separately:
+
+    validate      checking the SCI header without reading any data
+    open          opening the file and reading all headers
+    header        parsing the header into a Frame
+    checksum      checksums of data and headers
+    compress      tile compression into a scratch file, in memory if possible
+    write         copying the compressed file into the archive with fsync, and renaming it
+    previews      rendering previews into the thumbnail cache
+    save          looking up and writing the frame in the database
+    link_related  linking related frames
+
+Results are printed as a table and can be written to a JSON file, which can be compared with a later run.
+
+Usage:
+    python benchmarks/ingest_throughput.py [-s SIZE ...] [-t TILE ...] [-p PROCESSES ...] [-n NUMBER]
+        [--database {sqlite,postgres}] [-o OUTPUT] [--compare OLD_OUTPUT]
+
+With --database postgres, the SQL_* environment variables are used as in the settings, and a database "<name>_bench"
+is created and dropped afterwards, so the user needs to be allowed to create databases.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pyobs_archive.settings')
+
+import astropy  # noqa: E402
+import django  # noqa: E402
+import numpy as np  # noqa: E402
+from astropy.io import fits  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+
+from pyobs_archive.api import thumbnails  # noqa: E402
+from pyobs_archive.api.compress import COMPRESSORS, checksums  # noqa: E402
+from pyobs_archive.api.models import Frame, Facet, PendingLink  # noqa: E402
+
+from synthetic import generate  # noqa: E402
+
+# stages in the order they run
+STAGES = ['validate', 'open', 'header', 'checksum', 'compress', 'write', 'previews', 'save', 'link_related']
+
+
+def database(engine: str, workdir: str) -> dict:
+    """Get configuration of database to run benchmark against.
+
+    Args:
+        engine: Either sqlite or postgres.
+        workdir: Working directory for SQLite database.
+
+    Returns:
+        Entry for DATABASES setting.
+    """
+    if engine == 'sqlite':
+        # WAL and immediate transactions, so that parallel writers wait for each other instead of failing
+        filename = os.path.join(workdir, 'benchmark.sqlite3')
+        return {'ENGINE': 'django.db.backends.sqlite3', 'NAME': filename, 'TEST': {'NAME': filename},
+                'OPTIONS': {'timeout': 60, 'transaction_mode': 'IMMEDIATE', 'init_command': 'PRAGMA journal_mode=WAL;'}}
+    else:
+        name = os.environ.get('SQL_DATABASE', 'pyobs_archive')
+        return {'ENGINE': 'django.db.backends.postgresql', 'NAME': name, 'TEST': {'NAME': name + '_bench'},
+                'USER': os.environ.get('SQL_USER', 'user'), 'PASSWORD': os.environ.get('SQL_PASSWORD', 'password'),
+                'HOST': os.environ.get('SQL_HOST', 'localhost'), 'PORT': os.environ.get('SQL_PORT', '5432')}
+
+
+def configure(overrides: dict):
+    """Apply settings, also used as initializer of worker processes.
+
+    Args:
+        overrides: Dict with settings.
+    """
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    logging.disable(logging.INFO)
+
+
+def ingest(filename: str) -> dict:
+    """Ingest a file like Frame.ingest, but time each stage.
+
+    Args:
+        filename: Name of file to ingest.
+
+    Returns:
+        Dict with sizes of original and compressed file and seconds spent in each stage, or with an error.
+    """
+    times = {}
+    last = time.perf_counter()
+
+    def lap(stage):
+        nonlocal last
+        now = time.perf_counter()
+        times[stage] = times.get(stage, 0.) + now - last
+        last = now
+
+    try:
+        path, name, file_path = Frame.validate(filename)
+        lap('validate')
+
+        with fits.open(filename) as fits_file:
+            len(fits_file)
+            lap('open')
+
+            # header
+            header = fits_file['SCI'].header
+            header['FNAME'] = name
+            img = Frame(basename=name, path=path)
+            img.add_fits_header(header)
+            lap('header')
+
+            img.checksum, img.header_checksum = checksums(fits_file)
+            lap('checksum')
+
+            # compress into scratch file and copy it into archive, so that both can be timed on their own
+            with tempfile.TemporaryFile(dir=settings.BENCHMARK_SCRATCH) as scratch:
+                COMPRESSORS[settings.COMPRESSOR](fits_file, scratch)
+                lap('compress')
+                scratch.seek(0)
+                os.makedirs(file_path, exist_ok=True)
+                target = os.path.join(file_path, name + '.fits.fz')
+                tmp = os.path.join(file_path, '.%s.fits.fz.tmp' % name)
+                with open(tmp, 'wb') as fh:
+                    shutil.copyfileobj(scratch, fh, 1 << 20)
+                    fh.flush()
+                    os.fsync(fh.fileno())
+                img.filesize = os.path.getsize(tmp)
+                lap('write')
+
+            thumbnails.replace(path, name, fits_file['SCI'])
+            lap('previews')
+
+        # database
+        img.id = Frame.objects.filter(basename=name).values_list('id', flat=True).first()
+        img.save()
+        lap('save')
+        img.link_related(header)
+        lap('link_related')
+
+        # move into place
+        os.replace(tmp, target)
+        lap('write')
+        return {'bytes': os.path.getsize(filename), 'compressed': img.filesize, 'stages': times}
+
+    except Exception as e:
+        return {'error': '%s: %s' % (filename, e)}
+
+
+def summarize(values: list) -> dict:
+    """Statistics of timings of a stage in seconds."""
+    values = np.array(values)
+    return {'mean': float(np.mean(values)), 'median': float(np.median(values)),
+            'p95': float(np.percentile(values, 95)), 'total': float(np.sum(values))}
+
+
+def run(filenames: list, processes: int, overrides: dict) -> dict:
+    """Ingest files into an empty archive and measure throughput.
+
+    Args:
+        filenames: Files to ingest.
+        processes: Number of parallel processes.
+        overrides: Settings for worker processes.
+
+    Returns:
+        Dict with results.
+    """
+
+    # start from scratch
+    Frame.objects.all().delete()
+    PendingLink.objects.all().delete()
+    Facet.objects.all().delete()
+    shutil.rmtree(settings.ARCHIVE_ROOT, ignore_errors=True)
+    os.makedirs(settings.ARCHIVE_ROOT)
+
+    # ingest, workers shouldn't inherit any open database connections
+    start = time.perf_counter()
+    if processes == 1:
+        results = list(map(ingest, filenames))
+    else:
+        connections.close_all()
+        with multiprocessing.Pool(processes, initializer=configure, initargs=(overrides,)) as pool:
+            results = list(pool.imap_unordered(ingest, filenames))
+    seconds = time.perf_counter() - start
+
+    # summarize
+    done = [r for r in results if 'error' not in r]
+    size = sum(r['bytes'] for r in done)
+    return {
+        'frames': len(done),
+        'errors': [r['error'] for r in results if 'error' in r],
+        'seconds': seconds,
+        'frames_per_second': len(done) / seconds,
+        'mb_per_second': size / 1024**2 / seconds,
+        'compression_ratio': size / max(sum(r['compressed'] for r in done), 1),
+        'stages': {s: summarize([r['stages'][s] for r in done]) for s in STAGES} if done else {}
+    }
+
+
+def metadata(engine: str) -> dict:
+    """Describe environment of benchmark."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT sqlite_version()' if engine == 'sqlite' else 'SHOW server_version')
+        db_version = cursor.fetchone()[0]
+    return {'time': datetime.datetime.now(datetime.timezone.utc).isoformat(), 'commit': commit,
+            'host': platform.node(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'astropy': astropy.__version__,
+            'django': django.get_version(), 'database': '%s %s' % (engine, db_version),
+            'compressor': settings.COMPRESSOR}
+
+
+def print_table(runs: list):
+    print('%6s %9s %4s %8s %8s %6s | %s' % ('size', 'tile', 'proc', 'frames/s', 'MB/s', 'ratio',
+                                            ' '.join('%12s' % s for s in STAGES)))
+    for r in runs:
+        stages = ' '.join('%10.1fms' % (r['stages'][s]['median'] * 1e3) if r['stages'] else '%12s' % '-'
+                          for s in STAGES)
+        print('%6d %9s %4d %8.2f %8.1f %6.2f | %s' % (r['size'], r['tile'], r['processes'], r['frames_per_second'],
+                                                      r['mb_per_second'], r['compression_ratio'], stages))
+        for error in r['errors']:
+            print('  error: %s' % error)
+
+
+def compare(runs: list, filename: str, threshold: float) -> bool:
+    """Compare runs with those of an earlier benchmark.
+
+    Args:
+        runs: Results of this benchmark.
+        filename: JSON file of earlier benchmark.
+        threshold: Relative loss in throughput that counts as regression.
+
+    Returns:
+        Whether any throughput regressed.
+    """
+    with open(filename) as f:
+        old = {(r['size'], r['tile'], r['processes']): r for r in json.load(f)['runs']}
+
+    print('\nCompared to %s (median per stage):' % filename)
+    regressed = False
+    for r in runs:
+        o = old.get((r['size'], r['tile'], r['processes']))
+        if o is None or not r['stages'] or not o['stages']:
+            continue
+        change = r['frames_per_second'] / o['frames_per_second'] - 1
+        flag = ''
+        if change < -threshold:
+            flag, regressed = '  REGRESSION', True
+        stages = ' '.join('%+11.0f%%' % ((r['stages'][s]['median'] / o['stages'][s]['median'] - 1) * 100)
+                          if s in o['stages'] and o['stages'][s]['median'] > 0 else '%12s' % '-' for s in STAGES)
+        print('%6d %9s %4d %+7.0f%% %8s %6s | %s%s' % (r['size'], r['tile'], r['processes'], change * 100, '', '',
+                                                       stages, flag))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1024, 2048], help='Widths and heights of images')
+    parser.add_argument('-t', '--tiles', type=str, nargs='+', default=['row'],
+                        help='Compression tile shapes like "512,512", "row" for one row per tile')
+    parser.add_argument('-p', '--processes', type=int, nargs='+', default=[1, os.cpu_count()],
+                        help='Numbers of parallel processes')
+    parser.add_argument('-n', '--number', type=int, default=20, help='Number of frames per run')
+    parser.add_argument('--database', choices=['sqlite', 'postgres'], default='sqlite', help='Database to use')
+    parser.add_argument('--compressor', choices=list(COMPRESSORS.keys()), default=None,
+                        help='Compressor, defaults to the COMPRESSOR setting, or astropy if fpack is missing')
+    parser.add_argument('--workdir', type=str, default=None,
+                        help='Directory for frames, archive and SQLite database, frames are reused if it exists')
+    parser.add_argument('--scratch', type=str, default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                        help='Directory for compressed data before writing it to the archive')
+    parser.add_argument('-o', '--output', type=str, default=None, help='JSON file to write results to')
+    parser.add_argument('--compare', type=str, default=None, help='JSON file of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Relative loss in frames/s that fails the comparison')
+    args = parser.parse_args()
+
+    # settings
+    workdir = args.workdir or tempfile.mkdtemp(prefix='ingest-benchmark-')
+    compressor = args.compressor or settings.COMPRESSOR
+    if compressor == 'fpack' and not os.path.exists(settings.FPACK_BINARY):
+        print('fpack not found at %s, using astropy.' % settings.FPACK_BINARY)
+        compressor = 'astropy'
+    overrides = {'DATABASES': {'default': database(args.database, workdir)},
+                 'ARCHIVE_ROOT': os.path.join(workdir, 'archive'), 'PATH_FORMATTER': '{SITEID}/{DAY-OBS}/',
+                 'FILENAME_FORMATTER': None, 'COMPRESSOR': compressor, 'THUMBNAIL_ROOT': None,
+                 'BENCHMARK_SCRATCH': args.scratch}
+    configure(overrides)
+
+    # create database
+    creation = connection.creation
+    db_name = creation.create_test_db(verbosity=0, autoclobber=True)
+    overrides['DATABASES']['default']['NAME'] = db_name
+    try:
+        meta = metadata(args.database)
+        runs = []
+        for size in args.sizes:
+            filenames = generate(os.path.join(workdir, 'frames', str(size)), args.number, size)
+            for tile in args.tiles:
+                overrides['COMPRESSION_TILE'] = None if tile == 'row' else tile
+                configure(overrides)
+                for processes in args.processes:
+                    print('Ingesting %d frames of %dx%d with tiles %s in %d process(es)...'
+                          % (len(filenames), size, size, tile, processes))
+                    runs.append({'size': size, 'tile': tile, 'processes': processes,
+                                 **run(filenames, processes, overrides)})
+    finally:
+        creation.destroy_test_db(db_name, verbosity=0)
+
+    # output
+    print()
+    print_table(runs)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'runs': runs}, f, indent=2)
+        print('\nWrote results to %s.' % args.output)
+    if args.compare and compare(runs, args.compare, args.threshold):
+        sys.exit(1)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
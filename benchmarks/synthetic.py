@@ -0,0 +1,145 @@
+"""Generator for synthetic frames that look like the ones written by pyobs cameras and pipelines.
+
+Each frame has an empty primary HDU, a SCI image with sky background, read noise and stars, and a CAT table with the
+detected stars, and its header has all keywords Frame.add_fits_header expects. Every other frame is a reduced one
+(RLEVEL=1), which references its raw frame and a bias that doesn't exist, so link_related has both complete and pending
+links to create.
+
+Usage:
+    python benchmarks/synthetic.py OUTDIR [-n NUMBER] [-s SIZE]
+"""
+
+import argparse
+import datetime
+import os
+
+import numpy as np
+from astropy.io import fits
+
+
+def header(index: int, reduced: bool = False) -> fits.Header:
+    """Create header of SCI HDU for a synthetic frame.
+
+    Args:
+        index: Number of frame, which determines its name and time.
+        reduced: Whether to create a reduced frame that references its raw frame.
+
+    Returns:
+        FITS header.
+    """
+    date_obs = datetime.datetime(2024, 1, 15, 19) + datetime.timedelta(seconds=40 * (index // 2))
+    raw = 'iag50-cam1-20240115-%04d-e00' % (index // 2)
+
+    hdr = fits.Header()
+    for key, value in [('DATE-OBS', date_obs.isoformat(timespec='milliseconds')), ('DAY-OBS', '2024-01-15'),
+                       ('SITEID', 'iag'), ('TELID', 'iag50'), ('INSTRUME', 'cam1'), ('IMAGETYP', 'object'),
+                       ('OBJECT', 'M%d' % (index // 20 + 1)), ('EXPTIME', 30.), ('FILTER', 'V'),
+                       ('XBINNING', 1), ('YBINNING', 1), ('XORGSUBF', 0), ('YORGSUBF', 0),
+                       ('TEL-RA', 10.68 + index * 1e-3), ('TEL-DEC', 41.27), ('TEL-ALT', 60.), ('TEL-AZ', 180.),
+                       ('TEL-FOCU', 42.), ('SUNALT', -30.), ('SUNDIST', 120.), ('MOONALT', -10.), ('MOONFRAC', .3),
+                       ('MOONDIST', 90.), ('REQNUM', str(1000 + index // 20)), ('OBSNUM', str(index // 2)),
+                       ('RLEVEL', 1 if reduced else 0), ('FNAME', raw[:-3] + ('e91' if reduced else 'e00'))]:
+        hdr[key] = value
+
+    # reduced frames reference their calibrations
+    if reduced:
+        hdr['L1RAW'] = raw
+        hdr['L1BIAS'] = 'iag50-cam1-20240115-bias-e91'
+
+    # some more keywords, as real cameras write many of them
+    for i in range(50):
+        hdr['HIERARCH PYOBS EXTRA%02d' % i] = (i * 1.5, 'Filler keyword')
+    return hdr
+
+
+def image(size: int, rng: np.random.Generator, stars: int = 200):
+    """Create image with sky background, noise and Gaussian stars, like a 16 bit camera.
+
+    Args:
+        size: Width and height of image.
+        rng: Random number generator.
+        stars: Number of stars.
+
+    Returns:
+        Tuple of image and table of stars with x, y and flux.
+    """
+
+    # sky with gradient and read noise
+    y, x = np.mgrid[0:size, 0:size]
+    data = 1000. + 0.05 * x + rng.normal(0., 10., (size, size))
+
+    # stars, each only drawn in a small box around it
+    sx, sy = rng.uniform(10, size - 10, stars), rng.uniform(10, size - 10, stars)
+    flux = rng.lognormal(9., 1., stars)
+    for px, py, f in zip(sx, sy, flux):
+        x0, y0 = int(px) - 8, int(py) - 8
+        bx, by = x[y0:y0 + 17, x0:x0 + 17], y[y0:y0 + 17, x0:x0 + 17]
+        data[y0:y0 + 17, x0:x0 + 17] += f / (2 * np.pi * 2.**2) * np.exp(-((bx - px)**2 + (by - py)**2) / (2 * 2.**2))
+
+    # unsigned 16 bit, with photon noise
+    data = np.clip(rng.poisson(np.clip(data, 0, None)), 0, 65535).astype(np.uint16)
+    return data, (sx, sy, flux)
+
+
+def write_frame(filename: str, index: int, size: int, seed: int = 0) -> int:
+    """Write a synthetic frame.
+
+    Args:
+        filename: Name of file to write.
+        index: Number of frame, every odd one is a reduced frame.
+        size: Width and height of image.
+        seed: Seed for random numbers.
+
+    Returns:
+        Size of written file in bytes.
+    """
+    rng = np.random.default_rng(seed + index)
+    data, (sx, sy, flux) = image(size, rng)
+
+    # SCI and CAT HDUs
+    sci = fits.ImageHDU(data, header=header(index, reduced=index % 2 == 1), name='SCI')
+    cat = fits.BinTableHDU.from_columns([fits.Column(name='x', format='E', array=sx),
+                                         fits.Column(name='y', format='E', array=sy),
+                                         fits.Column(name='flux', format='E', array=flux),
+                                         fits.Column(name='ra', format='D', array=10.68 + (sx - size / 2) * 1e-4),
+                                         fits.Column(name='dec', format='D', array=41.27 + (sy - size / 2) * 1e-4)],
+                                        name='CAT')
+    fits.HDUList([fits.PrimaryHDU(), sci, cat]).writeto(filename, overwrite=True)
+    return os.path.getsize(filename)
+
+
+def generate(directory: str, number: int, size: int, seed: int = 0) -> list:
+    """Write synthetic frames into a directory, unless they exist already.
+
+    Args:
+        directory: Directory to write into.
+        number: Number of frames.
+        size: Width and height of images.
+        seed: Seed for random numbers.
+
+    Returns:
+        List of filenames.
+    """
+    os.makedirs(directory, exist_ok=True)
+    filenames = []
+    for i in range(number):
+        filename = os.path.join(directory, 'frame-%d-%05d.fits' % (size, i))
+        if not os.path.exists(filename):
+            write_frame(filename, i, size, seed)
+        filenames.append(filename)
+    return filenames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('outdir', type=str, help='Directory to write frames to')
+    parser.add_argument('-n', '--number', type=int, default=10, help='Number of frames')
+    parser.add_argument('-s', '--size', type=int, default=2048, help='Width and height of images')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for random numbers')
+    args = parser.parse_args()
+    for filename in generate(args.outdir, args.number, args.size, args.seed):
+        print(filename)
+
+
+if __name__ == '__main__':
+    main()
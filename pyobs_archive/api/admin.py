@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Frame
+from .models import Frame, IngestJob, Upload
 
 
 @admin.register(Frame)
@@ -7,3 +7,16 @@ class FrameAdmin(admin.ModelAdmin):
     list_display = ('basename', 'SITEID', 'TELID', 'INSTRUME', 'IMAGETYP', 'RLEVEL', 'DATE_OBS')
     list_filter = ('SITEID', 'TELID', 'INSTRUME', 'IMAGETYP', 'RLEVEL')
     search_fields = ('basename', 'OBJECT', 'REQNUM', 'OBSNUM')
+
+
+@admin.register(IngestJob)
+class IngestJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'filename', 'status', 'basename', 'created', 'finished')
+    list_filter = ('status',)
+    search_fields = ('filename', 'basename')
+
+
+@admin.register(Upload)
+class UploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'filename', 'size', 'created', 'updated')
+    search_fields = ('filename',)
@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class QueryConfig(AppConfig):
     name = 'pyobs_archive.api'
+
+    def ready(self):
+        from pyobs_archive.api.search import install_after_migrate
+
+        post_migrate.connect(install_after_migrate, sender=self)
@@ -0,0 +1,188 @@
+import functools
+import hashlib
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+log = logging.getLogger(__name__)
+
+# key of the generation counter, which changes whenever frames are added, changed or deleted
+GENERATION_KEY = 'pyobs_archive:generation'
+
+# scopes of cached responses, those for single frames only depend on the version of that frame
+LIST_SCOPES = ['frames', 'aggregate']
+FRAME_SCOPES = ['frame', 'related']
+
+
+def generation() -> int:
+    """Returns the current generation of the archive.
+
+    All cached values derived from the list of frames have the generation in their key, so bumping it
+    invalidates all of them at once.
+
+    Returns:
+        Current generation.
+    """
+
+    # get it
+    gen = cache.get(GENERATION_KEY)
+    if gen is not None:
+        return gen
+
+    # not set (yet or anymore), so start at current time, so that we never go back to a previous generation,
+    # whose values might still be in the cache
+    cache.add(GENERATION_KEY, int(time.time() * 1000), timeout=None)
+    return cache.get(GENERATION_KEY)
+
+
+def bump_generation():
+    """Invalidates all cached values derived from the list of frames."""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        # key doesn't exist, so initialize it
+        generation()
+
+
+def frame_version(frame_id: int) -> int:
+    """Returns the current version of a single frame, which changes whenever the frame or its related frames
+    change.
+
+    Args:
+        frame_id: ID of frame.
+
+    Returns:
+        Current version.
+    """
+    key = 'pyobs_archive:frame:%d' % frame_id
+    version = cache.get(key)
+    if version is None:
+        # see generation()
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_frames(frame_ids):
+    """Invalidates all cached values for the given frames.
+
+    Args:
+        frame_ids: IDs of frames.
+    """
+    for frame_id in frame_ids:
+        try:
+            cache.incr('pyobs_archive:frame:%d' % frame_id)
+        except ValueError:
+            pass
+
+
+def make_key(prefix: str, params, version: int = None) -> str:
+    """Create a cache key from a JSON-serializable set of parameters.
+
+    Args:
+        prefix: Prefix for key.
+        params: Parameters to build key from.
+        version: Version to use in key, defaults to current generation.
+
+    Returns:
+        Cache key.
+    """
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+    return 'pyobs_archive:%s:%d:%s' % (prefix, generation() if version is None else version, digest)
+
+
+def _count_stat(scope: str, stat: str):
+    key = 'pyobs_archive:stats:%s:%s' % (scope, stat)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def cache_stats() -> dict:
+    """Returns hit/miss statistics of the response cache.
+
+    Returns:
+        Dict with hits and misses for each scope.
+    """
+    stats = {}
+    for scope in LIST_SCOPES + FRAME_SCOPES:
+        stats[scope] = {s: cache.get('pyobs_archive:stats:%s:%s' % (scope, s), 0) for s in ('hits', 'misses')}
+    return stats
+
+
+def _request_params(request, **kwargs):
+    return sorted(request.GET.lists())
+
+
+def cached_response(scope: str, params=_request_params):
+    """Decorator for caching the response of a view, must be applied after authentication.
+
+    Responses in LIST_SCOPES are invalidated on every change in the archive, those in FRAME_SCOPES only when the
+    frame given as frame_id to the view changes.
+
+    Args:
+        scope: Name of scope for cache keys and statistics.
+        params: Function that returns normalized parameters from the request and the view's keyword arguments.
+
+    Returns:
+        Decorator.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # build key from parameters and permissions of user
+            key_params = {'params': params(request, **kwargs), 'staff': request.user.is_staff, 'args': kwargs}
+            version = frame_version(kwargs['frame_id']) if scope in FRAME_SCOPES else None
+            key = make_key('response:' + scope, key_params, version)
+
+            # in cache?
+            cached = cache.get(key)
+            if cached is not None:
+                _count_stat(scope, 'hits')
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            # call view and store response
+            _count_stat(scope, 'misses')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                cache.set(key, (response.content, response['Content-Type']), timeout=settings.RESPONSE_CACHE_TIMEOUT)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def cached_count(data, filters: dict) -> int:
+    """Count frames in a QuerySet, using the cache if possible.
+
+    Args:
+        data: Filtered QuerySet to count.
+        filters: Normalized filters that have been applied to data.
+
+    Returns:
+        Number of frames.
+    """
+
+    # in cache?
+    key = make_key('count', filters)
+    count = cache.get(key)
+    if count is not None:
+        return count
+
+    # count and store
+    count = data.count()
+    cache.set(key, count, timeout=settings.COUNT_CACHE_TIMEOUT)
+    return count
+
+
+__all__ = ['generation', 'bump_generation', 'frame_version', 'bump_frames', 'make_key', 'cached_count',
+           'cached_response', 'cache_stats']
@@ -0,0 +1,303 @@
+"""Tile compression of FITS files for storing them in the archive.
+
+Files are compressed into a temporary file in their target directory, which is only renamed to its final name after
+compression succeeded, so that a file in the archive is never incomplete. The fpack subprocess gets the file streamed
+through a pipe and writes directly to the temporary file, so its memory doesn't grow with the size of the image.
+CompImageHDU, on the other hand, compresses the whole image at once, which takes about three times its uncompressed
+size in memory, whatever the shape of the tiles, so fpack should be used for large frames. If only the headers of a
+file have changed, they are written into a copy of the stored file, whose compressed data is copied as is.
+"""
+
+import contextlib
+import hashlib
+import logging
+import os
+import re
+import secrets
+import subprocess
+import tempfile
+
+from astropy.io import fits
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+
+def _tile_shape():
+    """Get shape of compression tiles from the COMPRESSION_TILE setting, e.g. "512,512".
+
+    Returns:
+        Tuple with size of tile along each FITS axis or None for the default of one row per tile.
+    """
+    tile = getattr(settings, 'COMPRESSION_TILE', None)
+    return tuple(int(t) for t in tile.split(',')) if tile else None
+
+
+def _fpack(hdul: fits.HDUList, fh):
+    """Compress with fpack, fed through a pipe.
+
+    Args:
+        hdul: FITS file to compress.
+        fh: File to write compressed data to.
+    """
+    binary = getattr(settings, 'FPACK_BINARY', '/usr/bin/fpack')
+    tile = _tile_shape()
+    args = [binary] + (['-t', ','.join(str(t) for t in tile)] if tile else []) + ['-S', '-']
+
+    # stderr goes to a file, since a full pipe would block fpack while we're still writing to it
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            proc = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=fh, stderr=stderr)
+        except OSError as e:
+            raise ValueError('Could not run fpack: %s' % e)
+
+        # write file into pipe
+        try:
+            hdul.writeto(proc.stdin)
+        except BrokenPipeError:
+            # fpack died, the return code tells us
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        # check result
+        if proc.wait() != 0:
+            stderr.seek(0)
+            raise ValueError('Could not fpack file: %s' % stderr.read().decode(errors='replace').strip())
+
+
+def _astropy(hdul: fits.HDUList, fh):
+    """Compress in-process with CompImageHDU, using Rice compression like fpack.
+
+    The image is loaded and compressed as a whole, so this needs about three times its uncompressed size in memory.
+
+    Args:
+        hdul: FITS file to compress.
+        fh: File to write compressed data to.
+    """
+
+    # tile shape is given along FITS axes, but numpy wants it the other way round
+    tile = _tile_shape()
+    tile_shape = tuple(reversed(tile)) if tile else None
+
+    # compress all image HDUs with data, leave the others as they are
+    compressed = fits.HDUList()
+    for i, hdu in enumerate(hdul):
+        if isinstance(hdu, (fits.PrimaryHDU, fits.ImageHDU)) and hdu.header.get('NAXIS', 0) > 0:
+            # like fpack, keep an empty primary HDU
+            if i == 0:
+                compressed.append(fits.PrimaryHDU())
+            compressed.append(fits.CompImageHDU(data=hdu.data, header=hdu.header, compression_type='RICE_1',
+                                                tile_shape=tile_shape))
+        else:
+            compressed.append(hdu)
+
+    # write it
+    compressed.writeto(fh)
+
+
+# available compressors
+COMPRESSORS = {'fpack': _fpack, 'astropy': _astropy}
+
+
+def _create_tmp(filename: str) -> str:
+    """Create a new temporary file next to the given filename, hidden and with the permissions a normal open() would
+    give it.
+
+    Args:
+        filename: Final name of file.
+
+    Returns:
+        Name of temporary file.
+    """
+    directory, name = os.path.split(filename)
+    tmp = os.path.join(directory, '.%s.%s.tmp' % (name, secrets.token_hex(4)))
+    os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+    return tmp
+
+
+def compress(hdul: fits.HDUList, filename: str, compressor: str = None) -> str:
+    """Tile-compress a FITS file into a temporary file next to the given filename.
+
+    The caller is responsible for renaming the temporary file to its final name or removing it.
+
+    Args:
+        hdul: FITS file to compress.
+        filename: Final name of compressed file.
+        compressor: One of COMPRESSORS, defaults to the COMPRESSOR setting.
+
+    Returns:
+        Name of temporary file.
+
+    Raises:
+        ValueError: If compression failed.
+    """
+
+    # get compressor
+    compressor = compressor or getattr(settings, 'COMPRESSOR', 'fpack')
+    if compressor not in COMPRESSORS:
+        raise ValueError('Unknown compressor: %s' % compressor)
+
+    # create temporary file
+    tmp = _create_tmp(filename)
+
+    try:
+        # compress
+        log.info('Compressing file with %s...', compressor)
+        with open(tmp, 'wb') as fh:
+            COMPRESSORS[compressor](hdul, fh)
+            fh.flush()
+            os.fsync(fh.fileno())
+        log.info('Compressed file into %d bytes.', os.path.getsize(tmp))
+        return tmp
+
+    except BaseException:
+        # clean up
+        os.remove(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def replacing(tmp: str, filename: str):
+    """Context manager that renames a temporary file to the given filename, when the with block exits without an
+    error, and removes it otherwise.
+
+    Args:
+        tmp: Name of temporary file.
+        filename: Final name of file.
+
+    Yields:
+        Name of temporary file.
+    """
+    try:
+        # let caller finish, e.g. write to the database, and move file into place
+        yield tmp
+        os.replace(tmp, filename)
+
+    except BaseException:
+        # clean up
+        os.remove(tmp)
+        raise
+
+
+def compressed_file(hdul: fits.HDUList, filename: str, compressor: str = None):
+    """Context manager that tile-compresses a FITS file into a temporary file in the target directory, and renames
+    it to the given filename, when the with block exits without an error.
+
+    Args:
+        hdul: FITS file to compress.
+        filename: Final name of compressed file.
+        compressor: One of COMPRESSORS, defaults to the COMPRESSOR setting.
+
+    Raises:
+        ValueError: If compression failed.
+    """
+    return replacing(compress(hdul, filename, compressor), filename)
+
+
+def checksums(hdul: fits.HDUList) -> tuple:
+    """Calculate checksums of the data and of the headers of a FITS file.
+
+    The data is read as raw bytes from the file, so nothing is decoded or loaded into memory at once.
+
+    Args:
+        hdul: FITS file opened from disk.
+
+    Returns:
+        Tuple of SHA-256 hex digests of the data and of the headers of all HDUs.
+    """
+    data, headers = hashlib.sha256(), hashlib.sha256()
+
+    # len() makes sure that all HDUs have been read
+    for i in range(len(hdul)):
+        headers.update(hdul[i].header.tostring().encode())
+
+        # include size of data, so that data can't be moved between HDUs unnoticed
+        info = hdul.fileinfo(i)
+        size = info['datSpan']
+        data.update(b'%d:' % size)
+        info['file'].seek(info['datLoc'])
+        while size > 0:
+            chunk = info['file'].read(min(size, 1 << 20))
+            if not chunk:
+                break
+            data.update(chunk)
+            size -= len(chunk)
+
+    return data.hexdigest(), headers.hexdigest()
+
+
+# keywords of tile-compressed HDUs that describe the binary table and the compression, taken from the stored file
+_COMPRESSION_KEYWORDS = re.compile(r'^(XTENSION|BITPIX|NAXIS\d*|PCOUNT|GCOUNT|TFIELDS|T(TYPE|FORM|DIM|SCAL|ZERO)\d+|'
+                                   r'THEAP|Z(IMAGE|TENSION|SIMPLE|EXTEND|BLOCKED|BITPIX|NAXIS\d*|PCOUNT|GCOUNT|'
+                                   r'TILE\d+|CMPTYPE|NAME\d+|VAL\d+|QUANTIZ|DITHER0|DATASUM))$')
+
+# structural keywords of image HDUs, which are described by the ones above in a compressed HDU
+_STRUCTURE_KEYWORDS = re.compile(r'^(SIMPLE|XTENSION|BITPIX|NAXIS\d*|EXTEND|PCOUNT|GCOUNT|BLOCKED|CHECKSUM|DATASUM)$')
+
+# scaling of image data, which astropy removes from the header of the new file once it has read its data, so they are
+# taken from the stored file, whose data is identical
+_SCALING_KEYWORDS = re.compile(r'^(BZERO|BSCALE|BLANK)$')
+
+
+def update_headers(hdul: fits.HDUList, filename: str):
+    """Write the headers of a FITS file into a stored compressed file with identical data, without recompressing it.
+
+    Args:
+        hdul: FITS file with new headers.
+        filename: Name of stored compressed file.
+
+    Returns:
+        Name of temporary file with new headers next to the stored one, see replacing(), or None, if the layouts of
+        both files don't match and the file must be compressed again.
+    """
+
+    # open without decompressing, so that we can copy the compressed data as is
+    with fits.open(filename, disable_image_compression=True) as stored:
+        hdus = list(stored)
+
+        # an image in the primary HDU has been moved to the first extension with an empty primary HDU
+        if len(hdus) == len(hdul) + 1 and hdus[1].header.get('ZSIMPLE', False):
+            hdus = hdus[1:]
+        if len(hdus) != len(hdul):
+            return None
+
+        # replace headers
+        for new, old in zip(hdul, hdus):
+            if old.header.get('ZIMAGE', False):
+                # keep structure and compression, take everything else from the new image
+                header = fits.Header([c for c in old.header.cards if _COMPRESSION_KEYWORDS.match(c.keyword)
+                                      or _SCALING_KEYWORDS.match(c.keyword)])
+                header.extend([c for c in new.header.cards if not _STRUCTURE_KEYWORDS.match(c.keyword)
+                               and not _SCALING_KEYWORDS.match(c.keyword)])
+                if 'EXTNAME' not in header and 'EXTNAME' in old.header:
+                    header['EXTNAME'] = old.header['EXTNAME']
+                old.header = header
+            elif new.header.get('XTENSION') == old.header.get('XTENSION') and \
+                    new.header.get('NAXIS') == old.header.get('NAXIS'):
+                # uncompressed HDU
+                header = new.header.copy()
+                for key in [k for k in header if _SCALING_KEYWORDS.match(k)]:
+                    del header[key]
+                header.extend([c for c in old.header.cards if _SCALING_KEYWORDS.match(c.keyword)])
+                old.header = header
+            else:
+                return None
+
+        # write to temporary file
+        tmp = _create_tmp(filename)
+        try:
+            with open(tmp, 'wb') as fh:
+                stored.writeto(fh)
+                fh.flush()
+                os.fsync(fh.fileno())
+            return tmp
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+__all__ = ['COMPRESSORS', 'compress', 'compressed_file', 'replacing', 'checksums', 'update_headers']
@@ -0,0 +1,242 @@
+import csv
+import datetime
+import io
+import json
+import math
+
+import numpy as np
+from astropy.io import fits
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import ParseError
+
+from pyobs_archive.api.models import Frame
+
+# internal columns that are not exported
+EXCLUDED_FIELDS = ['path', 'vec_x', 'vec_y', 'vec_z', 'htm']
+
+# FITS formats for the internal types of fields, strings get their max_length appended
+FITS_FORMATS = {'BigAutoField': 'K', 'BigIntegerField': 'K', 'IntegerField': 'K', 'FloatField': 'D',
+                'CharField': 'A', 'DateTimeField': 'A24', 'DateField': 'A10'}
+
+# content types and file extensions for all formats
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'fits': ('image/fits', 'fits'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+# encoder of the JSON API, whose format for dates and times is used in all export formats
+_encoder = DjangoJSONEncoder()
+
+
+class _Echo:
+    # pseudo buffer for csv.writer, which just returns the written line
+    def write(self, value):
+        return value
+
+
+def export_fields():
+    """Returns the fields of Frame that are exported to columnar formats."""
+    return [f for f in Frame._meta.concrete_fields if f.name not in EXCLUDED_FIELDS]
+
+
+def format_date(value) -> str:
+    """Formats a date or time the same way as the JSON API, i.e. ISO 8601 with milliseconds and Z for UTC.
+
+    Args:
+        value: Date, datetime or time.
+
+    Returns:
+        Formatted string.
+    """
+    return _encoder.default(value)
+
+
+def ndjson_lines(data):
+    """Yields one JSON document per frame.
+
+    Args:
+        data: QuerySet of frames.
+    """
+    for info in Frame.iter_infos(data):
+        yield json.dumps(info, cls=DjangoJSONEncoder) + '\n'
+
+
+def csv_lines(data):
+    """Yields CSV lines, starting with a header.
+
+    Args:
+        data: QuerySet of frames.
+    """
+    writer = csv.writer(_Echo())
+    columns = None
+    for info in Frame.iter_infos(data):
+        # header
+        if columns is None:
+            columns = list(info.keys())
+            yield writer.writerow(columns)
+
+        # list of related frames separated by spaces
+        info['related_frames'] = ' '.join(str(i) for i in info['related_frames'])
+        yield writer.writerow([format_date(info[c]) if isinstance(info[c], (datetime.date, datetime.time)) else info[c]
+                               for c in columns])
+
+
+def _chunks(data, names, chunk_size):
+    rows = data.values_list(*names).iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _fits_value(field, value):
+    # FITS tables have no NULLs, so use NaN and empty strings
+    internal = field.get_internal_type()
+    if internal == 'FloatField':
+        return math.nan if value is None else value
+    elif internal in ('IntegerField', 'BigIntegerField', 'BigAutoField'):
+        return 0 if value is None else value
+    elif internal in ('DateTimeField', 'DateField'):
+        return b'' if value is None else format_date(value).encode()
+    else:
+        return b'' if value is None else value.encode('ascii', errors='replace')
+
+
+def fits_blocks(data, chunk_size=10000):
+    """Yields a FITS file with a binary table of all frames, built in chunks.
+
+    The number of rows has to be written to the header before any data, so the frames are counted first. If this
+    number changes while exporting, the table is truncated or padded with empty rows to keep the file valid.
+
+    Args:
+        data: QuerySet of frames.
+        chunk_size: Number of rows to fetch and write at once.
+    """
+
+    # define columns
+    fields = export_fields()
+    formats = []
+    for field in fields:
+        fmt = FITS_FORMATS[field.get_internal_type()]
+        formats.append(fmt + str(field.max_length) if fmt == 'A' else fmt)
+    columns = fits.ColDefs([fits.Column(name=f.name, format=fmt) for f, fmt in zip(fields, formats)])
+
+    # headers
+    nrows = data.count()
+    table = fits.BinTableHDU.from_columns(columns, nrows=0)
+    table.header['NAXIS2'] = nrows
+    yield fits.PrimaryHDU().header.tostring().encode()
+    yield table.header.tostring().encode()
+
+    # data, big-endian as required by FITS
+    dtype = np.dtype([(f.name, '>i8' if fmt == 'K' else '>f8' if fmt == 'D' else 'S' + fmt[1:])
+                      for f, fmt in zip(fields, formats)])
+    written = 0
+    for chunk in _chunks(data, [f.name for f in fields], chunk_size):
+        chunk = chunk[:nrows - written]
+        if not chunk:
+            break
+        rows = [tuple(_fits_value(f, v) for f, v in zip(fields, row)) for row in chunk]
+        yield np.array(rows, dtype=dtype).tobytes()
+        written += len(rows)
+
+    # pad missing rows and block
+    if written < nrows:
+        yield np.zeros(nrows - written, dtype=dtype).tobytes()
+    size = nrows * dtype.itemsize
+    if size % 2880 > 0:
+        yield b'\0' * (2880 - size % 2880)
+
+
+class _Drain(io.RawIOBase):
+    # write-only stream that keeps track of its position, but only keeps data until it is taken
+    def __init__(self):
+        super().__init__()
+        self._buffer = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buffer.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._buffer)
+        self._buffer = []
+        return data
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        return pyarrow
+    except ImportError:
+        raise ParseError('Export to Parquet/Arrow requires pyarrow to be installed.')
+
+
+def arrow_blocks(data, fmt, chunk_size=10000):
+    """Yields a Parquet file or an Arrow IPC stream with all frames, built in chunks.
+
+    Args:
+        data: QuerySet of frames.
+        fmt: Either "parquet" or "arrow".
+        chunk_size: Number of rows to fetch and write at once, each is written as a row group or record batch.
+    """
+    pa = _pyarrow()
+
+    # define schema, with times at the precision of the JSON API
+    types = {'BigAutoField': pa.int64(), 'BigIntegerField': pa.int64(), 'IntegerField': pa.int64(),
+             'FloatField': pa.float64(), 'CharField': pa.string(), 'DateTimeField': pa.timestamp('ms', tz='UTC'),
+             'DateField': pa.date32()}
+    fields = export_fields()
+    schema = pa.schema([pa.field(f.name, types[f.get_internal_type()], nullable=f.null) for f in fields])
+
+    # write batches and yield output after each of them
+    sink = _Drain()
+    writer = pa.parquet.ParquetWriter(sink, schema) if fmt == 'parquet' else pa.ipc.new_stream(sink, schema)
+    for chunk in _chunks(data, [f.name for f in fields], chunk_size):
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def export(data, fmt):
+    """Returns a generator that yields all frames in the given format.
+
+    Args:
+        data: QuerySet of frames.
+        fmt: One of FORMATS.
+
+    Returns:
+        Generator for content of a StreamingHttpResponse.
+    """
+    if fmt == 'ndjson':
+        return ndjson_lines(data)
+    elif fmt == 'csv':
+        return csv_lines(data)
+    elif fmt == 'fits':
+        return fits_blocks(data)
+    else:
+        # fail early, if pyarrow is missing
+        _pyarrow()
+        return arrow_blocks(data, fmt)
+
+
+__all__ = ['FORMATS', 'export_fields', 'export', 'format_date']
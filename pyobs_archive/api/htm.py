@@ -0,0 +1,166 @@
+"""Hierarchical Triangular Mesh (HTM) for indexing positions on the sky.
+
+The sphere is divided into the eight triangles of an octahedron, and each triangle is recursively divided into four
+smaller ones by connecting the midpoints of its edges. A triangle (trixel) at level L has an ID with 3 + 2 * L bits,
+and all trixels at a deeper level inside it form a contiguous range of IDs. Thus, a cone search can be written as a
+small number of range conditions on an indexed integer column.
+"""
+
+import math
+from typing import List, Tuple
+
+# level of IDs stored in the database, trixels have a size of about 0.3 arcsec
+DEPTH = 20
+
+Vector = Tuple[float, float, float]
+
+# corners of the octahedron
+_V = [(0., 0., 1.), (1., 0., 0.), (0., 1., 0.), (-1., 0., 0.), (0., -1., 0.), (0., 0., -1.)]
+
+# root trixels with their IDs, vertices in counter-clockwise order as seen from outside
+_ROOTS = [
+    (8, (_V[1], _V[5], _V[2])),
+    (9, (_V[2], _V[5], _V[3])),
+    (10, (_V[3], _V[5], _V[4])),
+    (11, (_V[4], _V[5], _V[1])),
+    (12, (_V[1], _V[0], _V[4])),
+    (13, (_V[4], _V[0], _V[3])),
+    (14, (_V[3], _V[0], _V[2])),
+    (15, (_V[2], _V[0], _V[1])),
+]
+
+
+def vector(ra: float, dec: float) -> Vector:
+    """Converts RA/Dec to a unit vector.
+
+    Args:
+        ra: Right ascension in degrees.
+        dec: Declination in degrees.
+
+    Returns:
+        Unit vector.
+    """
+    ra, dec = math.radians(ra), math.radians(dec)
+    return math.cos(dec) * math.cos(ra), math.cos(dec) * math.sin(ra), math.sin(dec)
+
+
+def _dot(a: Vector, b: Vector) -> float:
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _cross(a: Vector, b: Vector) -> Vector:
+    return a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]
+
+
+def _normalize(a: Vector) -> Vector:
+    n = math.sqrt(_dot(a, a))
+    return a[0] / n, a[1] / n, a[2] / n
+
+
+def _midpoint(a: Vector, b: Vector) -> Vector:
+    return _normalize((a[0] + b[0], a[1] + b[1], a[2] + b[2]))
+
+
+def _children(v0: Vector, v1: Vector, v2: Vector) -> List[Tuple[Vector, Vector, Vector]]:
+    w0, w1, w2 = _midpoint(v1, v2), _midpoint(v0, v2), _midpoint(v0, v1)
+    return [(v0, w2, w1), (v1, w0, w2), (v2, w1, w0), (w0, w1, w2)]
+
+
+def _contains(v0: Vector, v1: Vector, v2: Vector, p: Vector, eps: float = 1e-15) -> bool:
+    return (_dot(_cross(v0, v1), p) >= -eps and _dot(_cross(v1, v2), p) >= -eps
+            and _dot(_cross(v2, v0), p) >= -eps)
+
+
+def lookup(ra: float, dec: float, depth: int = DEPTH) -> int:
+    """Returns the ID of the trixel containing the given position.
+
+    Args:
+        ra: Right ascension in degrees.
+        dec: Declination in degrees.
+        depth: Level of trixel.
+
+    Returns:
+        Trixel ID.
+    """
+    p = vector(ra, dec)
+
+    # find root
+    for htm_id, (v0, v1, v2) in _ROOTS:
+        if _contains(v0, v1, v2, p):
+            break
+    else:
+        raise ValueError('Could not find root trixel for position.')
+
+    # descend
+    for _ in range(depth):
+        for i, (c0, c1, c2) in enumerate(_children(v0, v1, v2)):
+            if _contains(c0, c1, c2, p):
+                htm_id, v0, v1, v2 = htm_id * 4 + i, c0, c1, c2
+                break
+        else:
+            # may only happen due to rounding, so use centre trixel
+            htm_id, (v0, v1, v2) = htm_id * 4 + 3, _children(v0, v1, v2)[3]
+    return htm_id
+
+
+def cover(ra: float, dec: float, radius: float, depth: int = DEPTH) -> List[Tuple[int, int]]:
+    """Returns ranges of trixel IDs that cover a cone on the sky.
+
+    The ranges may contain trixels that only partially overlap with the cone, so results need to be checked for their
+    actual distance.
+
+    Args:
+        ra: Right ascension of centre of cone in degrees.
+        dec: Declination of centre of cone in degrees.
+        radius: Radius of cone in degrees, must be below 90.
+        depth: Level of trixel IDs to return ranges for.
+
+    Returns:
+        Sorted list of inclusive (first, last) ranges of trixel IDs at the given level.
+    """
+    if not 0 < radius < 90:
+        raise ValueError('Radius must be between 0 and 90 degrees.')
+    centre = vector(ra, dec)
+    cos_radius = math.cos(math.radians(radius))
+
+    # don't go deeper than trixels a little smaller than the cone, which would only produce more ranges
+    max_level = min(depth, max(3, math.ceil(math.log2(90. / radius)) + 2))
+
+    # collect trixels recursively
+    trixels = []
+
+    def visit(htm_id, v0, v1, v2, level):
+        # all corners inside? since the cone is convex, the whole trixel is
+        inside = [_dot(centre, v) >= cos_radius for v in (v0, v1, v2)]
+        if all(inside):
+            trixels.append((htm_id, level))
+            return
+
+        # if no corner is inside, check bounding circle of trixel
+        if not any(inside):
+            b = _normalize((v0[0] + v1[0] + v2[0], v0[1] + v1[1] + v2[1], v0[2] + v1[2] + v2[2]))
+            cos_b = min(_dot(b, v) for v in (v0, v1, v2))
+            if math.acos(max(-1., min(1., _dot(centre, b)))) > math.acos(cos_radius) + math.acos(cos_b):
+                return
+
+        # partially covered, go deeper or take it
+        if level == max_level:
+            trixels.append((htm_id, level))
+        else:
+            for i, (c0, c1, c2) in enumerate(_children(v0, v1, v2)):
+                visit(htm_id * 4 + i, c0, c1, c2, level + 1)
+
+    for root_id, (r0, r1, r2) in _ROOTS:
+        visit(root_id, r0, r1, r2, 0)
+
+    # convert to ranges at requested depth and merge them
+    ranges = []
+    for first, last in sorted((i << 2 * (depth - level), ((i + 1) << 2 * (depth - level)) - 1) for i, level in trixels):
+        if ranges and first <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(last, ranges[-1][1]))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+__all__ = ['DEPTH', 'vector', 'lookup', 'cover']
@@ -0,0 +1,223 @@
+"""Bulk ingest of many files at once.
+
+Reading the headers and compressing the files, which is where the time goes, runs in a pool of worker processes.
+The main process writes the frames of each batch to the database in a single transaction with bulk queries, and only
+then moves the compressed files into place. Since bulk queries bypass the signals of the models, facets and caches
+are updated explicitly.
+"""
+
+import collections
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+import signal
+import time
+
+import django
+from astropy.io import fits
+from django.db import connections, transaction
+
+from pyobs_archive.api import thumbnails
+from pyobs_archive.api.cache import bump_generation, bump_frames
+from pyobs_archive.api.compress import compress, checksums
+from pyobs_archive.api.models import Frame, Facet, PendingLink
+
+log = logging.getLogger(__name__)
+
+# fields written for every frame
+FIELDS = [f.name for f in Frame._meta.concrete_fields if not f.primary_key]
+
+
+def prepare(filename: str) -> dict:
+    """Read a file, compress it into a temporary file at its location in the archive and render its previews.
+
+    Runs in a worker process, so it must not access the database.
+
+    Args:
+        filename: Name of file to ingest.
+
+    Returns:
+        Dict with filename and either an error or the basename, the values for all FIELDS, basenames of related
+        frames, the temporary and the final filename and the size of the original file.
+    """
+    tmp = None
+    try:
+        # reject bad files before reading any data
+        path, name, file_path = Frame.validate(filename)
+
+        with fits.open(filename) as fits_file:
+            # set new filename in header
+            header = fits_file['SCI'].header
+            header['FNAME'] = name
+
+            # parse header
+            frame = Frame(basename=name, path=path)
+            frame.add_fits_header(header)
+            frame.checksum, frame.header_checksum = checksums(fits_file)
+
+            # compress
+            os.makedirs(file_path, exist_ok=True)
+            target = os.path.join(file_path, name + '.fits.fz')
+            tmp = compress(fits_file, target)
+            frame.filesize = os.path.getsize(tmp)
+
+            # previews, written before the frame is stored, like the file itself
+            thumbnails.replace(path, name, fits_file['SCI'])
+
+        return {'filename': filename, 'name': name, 'values': {k: getattr(frame, k) for k in FIELDS},
+                'related': Frame.related_basenames(header), 'tmp': tmp, 'target': target,
+                'size': os.path.getsize(filename)}
+
+    except Exception as e:
+        log.exception('Could not prepare %s.', filename)
+
+        # remove compressed file, which would otherwise be left in the archive
+        if tmp is not None:
+            try:
+                os.remove(tmp)
+            except FileNotFoundError:
+                pass
+        return {'filename': filename, 'error': str(e)}
+
+
+def store(batch: list) -> list:
+    """Write a batch of prepared files to the database in a single transaction and move them into place.
+
+    Args:
+        batch: List of dicts returned by prepare().
+
+    Returns:
+        List of stored frames.
+    """
+
+    # if a file appears twice, the last one wins
+    prepared = {}
+    for p in batch:
+        if p['name'] in prepared:
+            os.remove(prepared[p['name']]['tmp'])
+        prepared[p['name']] = p
+
+    try:
+        with transaction.atomic():
+            # find existing frames and update or create them, keeping track of the changes in facets
+            existing = Frame.objects.in_bulk(list(prepared.keys()), field_name='basename')
+            created, updated = [], []
+            facets = collections.Counter()
+            for name, p in prepared.items():
+                frame = existing.get(name)
+                if frame is None:
+                    frame = Frame()
+                    created.append(frame)
+                else:
+                    facets[tuple(Facet.values_of(frame).values())] -= 1
+                    updated.append(frame)
+                    if frame.path != p['values']['path']:
+                        thumbnails.remove(frame.path, name)
+                for k, v in p['values'].items():
+                    setattr(frame, k, v)
+                facets[tuple(Facet.values_of(frame).values())] += 1
+
+            # write frames
+            Frame.objects.bulk_create(created, batch_size=500)
+            Frame.objects.bulk_update(updated, FIELDS, batch_size=500)
+
+            # update facets
+            for values, delta in facets.items():
+                if delta != 0:
+                    Facet.change(dict(zip(Facet.FIELDS, values)), delta)
+
+            # replace related frames and complete pending links to new frames
+            frames = {f.basename: f for f in created + updated}
+            Frame.set_related({frames[name].id: p['related'] for name, p in prepared.items()})
+            PendingLink.resolve({name: f.id for name, f in frames.items()})
+
+    except BaseException:
+        # remove compressed files and previews
+        for p in prepared.values():
+            os.remove(p['tmp'])
+            thumbnails.remove(p['values']['path'], p['name'])
+        raise
+
+    # move files into place
+    for p in prepared.values():
+        os.replace(p['tmp'], p['target'])
+
+    # invalidate caches for changed frames and those related to them
+    ids = [f.id for f in frames.values()]
+    bump_generation()
+    bump_frames(ids + list(Frame.objects.filter(related__in=ids).values_list('id', flat=True)))
+    return list(frames.values())
+
+
+def bulk_ingest(filenames, processes: int = None, batch_size: int = 500, report=None) -> dict:
+    """Ingest many files, compressing them on a pool of processes and writing them to the database in batches.
+
+    Args:
+        filenames: Iterable of names of files to ingest.
+        processes: Number of worker processes, defaults to number of CPUs. With 1, everything runs in this process.
+        batch_size: Number of frames to write to the database in a single transaction.
+        report: Optional function that is called with the statistics after each batch.
+
+    Returns:
+        Dict with number of ingested frames, total size of ingested files in bytes, elapsed time in seconds and a
+        list of (filename, error) tuples.
+    """
+    stats = {'frames': 0, 'bytes': 0, 'seconds': 0., 'errors': []}
+    start = time.time()
+
+    def flush(batch):
+        # store batch and report
+        if batch:
+            stats['frames'] += len(store(batch))
+            stats['bytes'] += sum(p['size'] for p in batch)
+        stats['seconds'] = time.time() - start
+        if report is not None:
+            report(stats)
+
+    def run(results):
+        # collect results into batches
+        batch = []
+        for p in results:
+            if 'error' in p:
+                stats['errors'].append((p['filename'], p['error']))
+                continue
+            batch.append(p)
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        flush(batch)
+
+    # run in this process or in a pool
+    processes = processes or os.cpu_count()
+    if processes == 1:
+        run(map(prepare, filenames))
+    else:
+        with create_pool(processes) as pool:
+            run(pool.imap_unordered(prepare, filenames))
+
+    return stats
+
+
+def _init_worker():
+    # Ctrl+C is sent to the whole process group, but only the main process should handle it and shut down the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()
+
+
+def create_pool(processes: int = None) -> multiprocessing.pool.Pool:
+    """Create a pool of worker processes for running prepare().
+
+    Args:
+        processes: Number of processes, defaults to number of CPUs.
+
+    Returns:
+        Process pool.
+    """
+
+    # workers shouldn't inherit any open database connections
+    connections.close_all()
+    return multiprocessing.Pool(processes or os.cpu_count(), initializer=_init_worker)
+
+
+__all__ = ['prepare', 'store', 'bulk_ingest', 'create_pool']
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from pyobs_archive.api.models import Facet
+
+
+class Command(BaseCommand):
+    help = 'Rebuild facet table from frames'
+
+    def handle(self, *args, **options):
+        Facet.rebuild()
+        print('Rebuilt %d facets.' % Facet.objects.count())
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 
+from pyobs_archive.api.ingest import bulk_ingest
 from pyobs_archive.api.models import Frame
 
 
@@ -8,7 +9,31 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('files', type=str, nargs='+', help='Names of files to ingest')
+        parser.add_argument('--bulk', action='store_true',
+                            help='Compress on a pool of processes and write to database in batches')
+        parser.add_argument('-p', '--processes', type=int, default=None,
+                            help='Number of processes for bulk mode, defaults to number of CPUs')
+        parser.add_argument('-b', '--batch-size', type=int, default=500,
+                            help='Number of frames per database transaction in bulk mode')
 
-    def handle(self, *args, files: list = None, **options):
-        for filename in files:
-            Frame.ingest(filename)
+    def handle(self, *args, files: list = None, bulk: bool = False, processes: int = None, batch_size: int = 500,
+               **options):
+        # serial?
+        if not bulk:
+            for filename in files:
+                Frame.ingest(filename)
+            return
+
+        # bulk ingest with progress
+        stats = bulk_ingest(files, processes=processes, batch_size=batch_size, report=self._report)
+
+        # errors
+        for filename, error in stats['errors']:
+            self.stderr.write('%s: %s' % (filename, error))
+        self.stdout.write('Ingested %d of %d files.' % (stats['frames'], len(files)))
+
+    def _report(self, stats):
+        seconds = max(stats['seconds'], 1e-6)
+        self.stdout.write('%d frames, %.1f MB in %.1fs: %.1f frames/s, %.1f MB/s, %d errors'
+                          % (stats['frames'], stats['bytes'] / 1024**2, stats['seconds'], stats['frames'] / seconds,
+                             stats['bytes'] / 1024**2 / seconds, len(stats['errors'])))
@@ -0,0 +1,47 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from pyobs_archive.api.watch import DirectoryWatcher, IngestDaemon
+
+
+class Command(BaseCommand):
+    help = 'Watch directories and ingest new files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directories', type=str, nargs='+', help='Directories to watch')
+        parser.add_argument('--pattern', type=str, default='*.fits', help='Pattern for names of files to ingest')
+        parser.add_argument('--settle', type=float, default=5.,
+                            help='Seconds a file must not change before it is ingested')
+        parser.add_argument('--interval', type=float, default=2., help='Seconds between scans when polling')
+        parser.add_argument('--poll', action='store_true', help='Poll directories instead of using inotify')
+        parser.add_argument('-p', '--processes', type=int, default=None,
+                            help='Number of worker processes, defaults to number of CPUs')
+        parser.add_argument('-b', '--batch-size', type=int, default=100,
+                            help='Maximum number of frames per database transaction')
+        parser.add_argument('--max-pending', type=int, default=None,
+                            help='Maximum number of files in progress, defaults to twice the number of processes')
+        parser.add_argument('--move-to', type=str, default=None,
+                            help='Move ingested files to this directory instead of deleting them')
+        parser.add_argument('--failed-dir', type=str, default=None,
+                            help='Move files that could not be ingested to this directory')
+        parser.add_argument('--shutdown-timeout', type=float, default=60.,
+                            help='Seconds to wait for files being processed on shutdown')
+
+    def handle(self, *args, directories: list = None, pattern: str = '*.fits', settle: float = 5.,
+               interval: float = 2., poll: bool = False, processes: int = None, batch_size: int = 100,
+               max_pending: int = None, move_to: str = None, failed_dir: str = None, shutdown_timeout: float = 60.,
+               **options):
+        # create watcher and daemon
+        watcher = DirectoryWatcher(directories, pattern=pattern, settle=settle, interval=interval, inotify=not poll)
+        daemon = IngestDaemon(watcher, processes=processes, batch_size=batch_size, max_pending=max_pending,
+                              move_to=move_to, failed_dir=failed_dir, shutdown_timeout=shutdown_timeout)
+
+        # stop gracefully on SIGTERM and SIGINT
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, lambda *_: daemon.stop())
+
+        # run it
+        self.stdout.write('Watching %s %s...' % (', '.join(directories),
+                                                  'with inotify' if watcher.uses_inotify else 'by polling'))
+        daemon.run()
@@ -0,0 +1,18 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from pyobs_archive.api.worker import start_workers
+
+
+class Command(BaseCommand):
+    help = 'Run workers for ingesting queued uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of worker threads')
+
+    def handle(self, *args, workers: int = None, **options):
+        # start workers and wait for them, which is forever
+        self.stdout.write('Starting %d ingest worker(s)...' % workers)
+        for thread in start_workers(workers):
+            thread.join()
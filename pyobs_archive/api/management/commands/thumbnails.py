@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from pyobs_archive.api import thumbnails
+from pyobs_archive.api.ingest import create_pool
+from pyobs_archive.api.models import Frame
+
+
+class Command(BaseCommand):
+    help = 'Render missing previews of frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-p', '--processes', type=int, default=None,
+                            help='Number of processes, defaults to number of CPUs')
+
+    def handle(self, *args, processes: int = None, **options):
+        # frames, without accessing the database in the workers
+        frames = [(f.path, f.basename, f.filename) for f in Frame.objects.only('path', 'basename').iterator()]
+
+        # render in this process or in a pool
+        if processes == 1:
+            self._run(map(thumbnails.backfill, frames), len(frames))
+        else:
+            with create_pool(processes) as pool:
+                self._run(pool.imap_unordered(thumbnails.backfill, frames, chunksize=8), len(frames))
+
+        # cache might have grown too big
+        thumbnails.evict()
+
+    def _run(self, results, count):
+        rendered = 0
+        for i, (basename, result) in enumerate(results, 1):
+            if isinstance(result, str):
+                self.stderr.write('%s: %s' % (basename, result))
+            else:
+                rendered += result
+            if i % 100 == 0 or i == count:
+                self.stdout.write('%d of %d frames, %d previews rendered' % (i, count, rendered))
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:51
+
+from django.db import migrations, models
+from django.db.models import Count
+
+FIELDS = ['SITEID', 'TELID', 'INSTRUME', 'IMAGETYP', 'FILTER', 'XBINNING', 'YBINNING', 'RLEVEL', 'night']
+
+
+def build_facets(apps, schema_editor):
+    Frame = apps.get_model('api', 'Frame')
+    Facet = apps.get_model('api', 'Facet')
+    rows = Frame.objects.values(*FIELDS).annotate(count=Count('id')).order_by()
+    Facet.objects.bulk_create([Facet(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_alter_frame_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Facet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('SITEID', models.CharField(max_length=10, verbose_name='Site of observation')),
+                ('TELID', models.CharField(max_length=5, verbose_name='Telescope used for observation')),
+                ('INSTRUME', models.CharField(max_length=5, verbose_name='Instrument used for observation')),
+                ('IMAGETYP', models.CharField(max_length=15, verbose_name='Type of image')),
+                ('FILTER', models.CharField(default=None, max_length=20, null=True, verbose_name='Filter used')),
+                ('XBINNING', models.IntegerField(verbose_name='Binning of image in X direction')),
+                ('YBINNING', models.IntegerField(verbose_name='Binning of image in Y direction')),
+                ('RLEVEL', models.IntegerField(verbose_name='Reduction level')),
+                ('night', models.DateField(db_index=True, verbose_name='Night of observation')),
+                ('count', models.IntegerField(default=0, verbose_name='Number of frames')),
+            ],
+        ),
+        migrations.RunPython(build_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:53
+
+from django.db import migrations, models
+
+from pyobs_archive.api.htm import lookup
+
+
+def index_positions(apps, schema_editor):
+    Frame = apps.get_model('api', 'Frame')
+    frames = Frame.objects.filter(TEL_RA__isnull=False, TEL_DEC__isnull=False).only('id', 'TEL_RA', 'TEL_DEC')
+    batch = []
+    for frame in frames.iterator(chunk_size=2000):
+        frame.htm = lookup(frame.TEL_RA, frame.TEL_DEC)
+        batch.append(frame)
+        if len(batch) >= 2000:
+            Frame.objects.bulk_update(batch, ['htm'])
+            batch = []
+    Frame.objects.bulk_update(batch, ['htm'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_facet'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frame',
+            name='htm',
+            field=models.BigIntegerField(db_index=True, default=None, null=True, verbose_name='HTM trixel ID of telescope orientation'),
+        ),
+        migrations.AlterField(
+            model_name='frame',
+            name='vec_x',
+            field=models.FloatField(null=True, verbose_name='Telescope orientation as vector, x component'),
+        ),
+        migrations.AlterField(
+            model_name='frame',
+            name='vec_y',
+            field=models.FloatField(null=True, verbose_name='Telescope orientation as vector, y component'),
+        ),
+        migrations.AlterField(
+            model_name='frame',
+            name='vec_z',
+            field=models.FloatField(null=True, verbose_name='Telescope orientation as vector, z component'),
+        ),
+        migrations.RunPython(index_positions, migrations.RunPython.noop),
+    ]
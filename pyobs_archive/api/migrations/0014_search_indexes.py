@@ -0,0 +1,18 @@
+from django.db import migrations
+
+from pyobs_archive.api.search import install
+
+
+def install_search_indexes(apps, schema_editor):
+    install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_frame_htm'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_indexes, migrations.RunPython.noop),
+    ]
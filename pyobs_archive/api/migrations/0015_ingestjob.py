@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255, verbose_name='Name of uploaded file')),
+                ('spool', models.CharField(max_length=255, verbose_name='Path of spooled file')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10, verbose_name='Status of job')),
+                ('error', models.TextField(default=None, null=True, verbose_name='Error message, if failed')),
+                ('basename', models.CharField(default=None, max_length=50, null=True, verbose_name='Name of ingested frame')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Time job was created')),
+                ('started', models.DateTimeField(default=None, null=True, verbose_name='Time job was started')),
+                ('finished', models.DateTimeField(default=None, null=True, verbose_name='Time job was finished')),
+            ],
+        ),
+    ]
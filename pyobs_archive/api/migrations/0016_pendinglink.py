@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_ingestjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('basename', models.CharField(db_index=True, max_length=50, verbose_name='Name of related frame')),
+                ('frame', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_links', to='api.frame')),
+            ],
+            options={
+                'unique_together': {('frame', 'basename')},
+            },
+        ),
+    ]
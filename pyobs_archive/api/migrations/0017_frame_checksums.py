@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_pendinglink'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frame',
+            name='checksum',
+            field=models.CharField(default=None, max_length=64, null=True, verbose_name='SHA-256 of data of all HDUs'),
+        ),
+        migrations.AddField(
+            model_name='frame',
+            name='filesize',
+            field=models.BigIntegerField(default=None, null=True, verbose_name='Size of compressed file in bytes'),
+        ),
+        migrations.AddField(
+            model_name='frame',
+            name='header_checksum',
+            field=models.CharField(default=None, max_length=64, null=True, verbose_name='SHA-256 of headers of all HDUs'),
+        ),
+    ]
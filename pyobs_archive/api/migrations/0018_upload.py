@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 19:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_frame_checksums'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Upload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255, verbose_name='Name of uploaded file')),
+                ('spool', models.CharField(max_length=255, verbose_name='Path of spooled file')),
+                ('size', models.BigIntegerField(verbose_name='Size of file in bytes')),
+                ('checksum', models.CharField(default=None, max_length=64, null=True, verbose_name='SHA-256 of file for verification')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Time upload was initiated')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='Time last chunk was received')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UploadChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('offset', models.BigIntegerField(verbose_name='Offset of chunk in file')),
+                ('size', models.BigIntegerField(verbose_name='Size of chunk in bytes')),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='api.upload')),
+            ],
+            options={
+                'unique_together': {('upload', 'offset')},
+            },
+        ),
+    ]
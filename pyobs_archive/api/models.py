@@ -1,17 +1,24 @@
-import math
+import datetime
+import hashlib
+import itertools
 import logging
-import subprocess
+import uuid
 from urllib.parse import urljoin
 import os
-import io
 from astropy.io import fits
-from astropy.time import Time
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
-from django.utils.timezone import make_aware
+from django.core.exceptions import ValidationError
+from django.db.models import Count, F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils.timezone import make_aware, now
 
-from pyobs_archive.api.utils import FilenameFormatter
+from pyobs_archive.api import htm as htm_index, thumbnails
+from pyobs_archive.api.cache import bump_generation, bump_frames
+from pyobs_archive.api.compress import compressed_file, replacing, checksums, update_headers
+from pyobs_archive.api.utils import FilenameFormatter, get_formatter, parse_date, read_header
 
 log = logging.getLogger(__name__)
 
@@ -30,9 +37,10 @@ class Frame(models.Model):
     OBJECT = models.CharField('Name of Object', max_length=50, null=True, default=None, db_index=True)
     TEL_RA = models.FloatField('Telescope Right Ascension', null=True)
     TEL_DEC = models.FloatField('Telescope Declination', null=True)
-    vec_x = models.FloatField('Telescope orientation as vector, x component', null=True, db_index=True)
-    vec_y = models.FloatField('Telescope orientation as vector, y component', null=True, db_index=True)
-    vec_z = models.FloatField('Telescope orientation as vector, z component', null=True, db_index=True)
+    vec_x = models.FloatField('Telescope orientation as vector, x component', null=True)
+    vec_y = models.FloatField('Telescope orientation as vector, y component', null=True)
+    vec_z = models.FloatField('Telescope orientation as vector, z component', null=True)
+    htm = models.BigIntegerField('HTM trixel ID of telescope orientation', null=True, default=None, db_index=True)
     TEL_ALT = models.FloatField('Altitude of telescope at start of exposure', null=True, default=None)
     TEL_AZ = models.FloatField('Azimuth of telescope at start of exposure', null=True, default=None)
     TEL_FOCU = models.FloatField('Focus of telescope', null=True, default=None)
@@ -53,6 +61,9 @@ class Frame(models.Model):
     related = models.ManyToManyField("self", symmetrical=False)
     REQNUM = models.CharField('Unique number for request', max_length=30, null=True, default=None)
     OBSNUM = models.CharField('Observation number (per-night)', max_length=30, null=True, default=None)
+    checksum = models.CharField('SHA-256 of data of all HDUs', max_length=64, null=True, default=None)
+    header_checksum = models.CharField('SHA-256 of headers of all HDUs', max_length=64, null=True, default=None)
+    filesize = models.BigIntegerField('Size of compressed file in bytes', null=True, default=None)
 
     def __str__(self):
         return self.basename
@@ -66,7 +77,7 @@ class Frame(models.Model):
 
         # dates
         if 'DATE-OBS' in header:
-            self.DATE_OBS = make_aware(Time(header['DATE-OBS']).to_datetime())
+            self.DATE_OBS = make_aware(parse_date(header['DATE-OBS']))
         else:
             raise ValueError('Could not find DATE-OBS in FITS header.')
         self.night = header['DAY-OBS']
@@ -94,13 +105,10 @@ class Frame(models.Model):
         # add filename
         self.basename = header['FNAME']
 
-        # position vector
+        # position vector and spatial index
         if self.TEL_RA is not None and self.TEL_DEC is not None:
-            ra = math.radians(self.TEL_RA)
-            dec = math.radians(self.TEL_DEC)
-            self.vec_x = math.cos(dec) * math.cos(ra)
-            self.vec_y = math.cos(dec) * math.sin(ra)
-            self.vec_z = math.sin(dec)
+            self.vec_x, self.vec_y, self.vec_z = htm_index.vector(self.TEL_RA, self.TEL_DEC)
+            self.htm = htm_index.lookup(self.TEL_RA, self.TEL_DEC)
 
         # reduction level
         self.RLEVEL = header['RLEVEL'] if 'RLEVEL' in header else 0
@@ -121,81 +129,231 @@ class Frame(models.Model):
             # set it
             setattr(self, attr, header[keyword])
 
-    def get_info(self):
+    # fields copied verbatim into the info dict of a frame, see get_info()
+    INFO_FIELDS = ['id', 'basename', 'SITEID', 'TELID', 'INSTRUME', 'RLEVEL', 'DATE_OBS', 'FILTER', 'OBJECT',
+                   'EXPTIME', 'REQNUM', 'OBSNUM']
+
+    # all keys of an info dict, in their order
+    INFO_KEYS = INFO_FIELDS + ['OBSTYPE', 'binning', 'related_frames', 'url']
+
+    # columns required for keys that are not copied verbatim
+    INFO_COLUMNS = {'OBJECT': ['OBJECT', 'IMAGETYP'], 'FILTER': ['FILTER', 'IMAGETYP'], 'OBSTYPE': ['IMAGETYP'],
+                    'binning': ['XBINNING', 'YBINNING'], 'related_frames': [], 'url': []}
+
+    @staticmethod
+    def info_columns(fields=None):
+        """Get the columns that need to be fetched for building info dicts.
+
+        Args:
+            fields: Keys from INFO_KEYS to include in info dicts, defaults to all.
+
+        Returns:
+            List of column names, always including the id.
+        """
+        columns = ['id']
+        for key in Frame.INFO_KEYS if fields is None else fields:
+            for column in Frame.INFO_COLUMNS.get(key, [key]):
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+    def get_info(self, fields=None):
+        # get values and related frames, if requested
+        values = {k: getattr(self, k) for k in Frame.info_columns(fields)}
+        related = [f.id for f in self.related.all()] if fields is None or 'related_frames' in fields else None
+
+        # build info
+        return Frame._build_info(values, related, fields)
+
+    @staticmethod
+    def get_infos(data, fields=None):
+        """Get info for a list of frames with two queries in total, instead of one per frame.
+
+        Args:
+            data: QuerySet of frames to serialize.
+            fields: Keys from INFO_KEYS to include in info dicts, defaults to all.
+
+        Returns:
+            List of info dicts in the same format as returned by get_info().
+        """
+
+        # fetch only the required columns, no model instances
+        rows = list(data.values(*Frame.info_columns(fields)))
+
+        # fetch related frames for all rows at once, if requested
+        related = {}
+        if fields is None or 'related_frames' in fields:
+            related = Frame.related_ids([row['id'] for row in rows])
+
+        # build infos
+        return [Frame._build_info(row, related.get(row['id'], []), fields) for row in rows]
+
+    @staticmethod
+    def iter_infos(data, chunk_size=2000):
+        """Iterate infos for a list of frames of arbitrary length, with constant memory.
+
+        Args:
+            data: QuerySet of frames to serialize.
+            chunk_size: Number of frames to fetch at once.
+
+        Yields:
+            Info dicts in the same format as returned by get_info().
+        """
+        rows = data.values(*Frame.info_columns()).iterator(chunk_size=chunk_size)
+        for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+            related = Frame.related_ids([row['id'] for row in chunk])
+            for row in chunk:
+                yield Frame._build_info(row, related.get(row['id'], []))
+
+    @staticmethod
+    def related_ids(ids):
+        """Get IDs of related frames for a list of frames in a single query.
+
+        Args:
+            ids: IDs of frames to fetch related frames for.
+
+        Returns:
+            Dict mapping frame ID to list of related frame IDs.
+        """
+        related = {}
+        links = Frame.related.through.objects.filter(from_frame_id__in=ids).order_by('id')
+        for from_id, to_id in links.values_list('from_frame_id', 'to_frame_id'):
+            related.setdefault(from_id, []).append(to_id)
+        return related
+
+    @staticmethod
+    def _build_info(values, related, fields=None):
+        """Build info dict for a frame.
+
+        Args:
+            values: Dict with the columns from info_columns().
+            related: IDs of related frames.
+            fields: Keys from INFO_KEYS to include, defaults to all. The order of keys is always that of INFO_KEYS.
+
+        Returns:
+            Info dict for frame.
+        """
+
+        # all fields?
+        if fields is None:
+            fields = Frame.INFO_KEYS
+
         # init info and copy some fields
-        info = {k: getattr(self, k) for k in ['id', 'basename', 'SITEID', 'TELID', 'INSTRUME', 'RLEVEL',
-                                              'DATE_OBS', 'FILTER', 'OBJECT', 'EXPTIME',
-                                              'REQNUM', 'OBSNUM']}
+        info = {k: values[k] for k in Frame.INFO_FIELDS if k in fields}
 
         # add obstype
-        info['OBSTYPE'] = self.IMAGETYP
+        if 'OBSTYPE' in fields:
+            info['OBSTYPE'] = values['IMAGETYP']
 
         # add binning
-        info['binning'] = '%dx%d' % (self.XBINNING, self.YBINNING)
+        if 'binning' in fields:
+            info['binning'] = '%dx%d' % (values['XBINNING'], values['YBINNING'])
 
         # remove OBJECT and FILTER for BIAS and DARKs
-        if self.IMAGETYP in ['bias', 'dark']:
-            info['OBJECT'] = None
-            info['FILTER'] = None
+        if values.get('IMAGETYP') in ['bias', 'dark']:
+            for k in ['OBJECT', 'FILTER']:
+                if k in info:
+                    info[k] = None
 
         # add related frames
-        info['related_frames'] = [f.id for f in self.related.all()]
+        if 'related_frames' in fields:
+            info['related_frames'] = related
 
         # add url
-        info['url'] = 'frames/%d/download/' % self.id
+        if 'url' in fields:
+            info['url'] = 'frames/%d/download/' % values['id']
 
         # finished
         return info
 
-    def link_related(self, header):
-        """Link related images.
+    @staticmethod
+    def related_basenames(header):
+        """Get basenames of related images from a FITS header.
 
         Args:
             header (Header): FITS header to take data from.
-        """
 
-        # collect filenames
+        Returns:
+            List of basenames.
+        """
         basenames = []
         for key, value in header.items():
             if key.startswith('L1AVG') or key in ['L1BIAS', 'L1DARK', 'L1FLAT', 'L1RAW']:
                 basenames.append(value)
+        return basenames
 
-        # link frames
-        frames = []
-        for name in basenames:
-            try:
-                f = Frame.objects.get(basename=name)
-                frames.append(f)
-            except Frame.DoesNotExist:
-                log.error('Could not set related frames, %s not found.', name)
-        self.related.set(frames)
+    def link_related(self, header):
+        """Link related images.
+
+        Args:
+            header (Header): FITS header to take data from.
+        """
+        Frame.set_related({self.id: Frame.related_basenames(header)})
+        PendingLink.resolve({self.basename: self.id})
 
     @staticmethod
-    def ingest(filename):
-        # create path and filename formatter
+    def set_related(related):
+        """Replace related frames of many frames at once.
+
+        Related frames that don't exist yet are stored as PendingLink and linked as soon as they are ingested.
+
+        Args:
+            related: Dict mapping frame IDs to basenames of their related frames.
+        """
+
+        # resolve all names at once
+        names = {n for basenames in related.values() for n in basenames}
+        known = dict(Frame.objects.filter(basename__in=names).values_list('basename', 'id'))
+
+        # replace links and pending links
+        through = Frame.related.through
+        through.objects.filter(from_frame_id__in=related.keys()).delete()
+        PendingLink.objects.filter(frame_id__in=related.keys()).delete()
+        links, pending = [], []
+        for frame_id, basenames in related.items():
+            for name in dict.fromkeys(basenames):
+                if name in known:
+                    links.append(through(from_frame_id=frame_id, to_frame_id=known[name]))
+                else:
+                    log.info('Related frame %s not found yet, linking it later.', name)
+                    pending.append(PendingLink(frame_id=frame_id, basename=name))
+        through.objects.bulk_create(links, batch_size=500)
+        PendingLink.objects.bulk_create(pending, batch_size=500)
+
+        # bulk queries don't send m2m_changed
+        bump_frames(related.keys())
+
+    @staticmethod
+    def archive_location(header):
+        """Get location of a new file in the archive from its FITS header.
+
+        Args:
+            header (Header): FITS header of SCI extension.
+
+        Returns:
+            Tuple of path relative to ARCHIVE_ROOT, basename and absolute directory.
+
+        Raises:
+            ValueError: If no valid location could be determined.
+        """
+
+        # get path and filename formatter, compiled once per format
         if hasattr(settings, 'PATH_FORMATTER') and settings.PATH_FORMATTER is not None:
-            path_fmt = FilenameFormatter(settings.PATH_FORMATTER)
+            path_fmt = get_formatter(settings.PATH_FORMATTER)
         else:
             raise ValueError('No path formatter configured.')
         filename_fmt = None
         if hasattr(settings, 'FILENAME_FORMATTER') and settings.FILENAME_FORMATTER is not None:
-            filename_fmt = FilenameFormatter(settings.FILENAME_FORMATTER)
-
-        # get archive root
-        root = settings.ARCHIVE_ROOT
-
-        # open file
-        log.info('Opening new file to ingest...')
-        fits_file = fits.open(filename)
+            filename_fmt = get_formatter(settings.FILENAME_FORMATTER)
 
         # get path for archive
-        path = path_fmt(fits_file['SCI'].header)
+        path = path_fmt(header)
 
         # get filename for archive
         if isinstance(filename_fmt, FilenameFormatter):
-            name = filename_fmt(fits_file['SCI'].header)
+            name = filename_fmt(header)
         else:
-            tmp = os.path.basename(fits_file['SCI'].header['FNAME'])
+            tmp = os.path.basename(header['FNAME'])
             name = tmp[:tmp.find('.')] if '.' in tmp else tmp
         log.info('Formatted filename to %s.', name)
 
@@ -204,59 +362,125 @@ class Frame(models.Model):
         # separator hiding in a header value)
         if not name or os.path.basename(name) != name or name in ('.', '..'):
             raise ValueError('Invalid filename derived from FITS header: %r' % name)
-        archive_root = os.path.realpath(root)
+        archive_root = os.path.realpath(settings.ARCHIVE_ROOT)
         file_path = os.path.realpath(os.path.join(archive_root, path))
         if os.path.commonpath([archive_root, file_path]) != archive_root:
             raise ValueError('Formatted path escapes ARCHIVE_ROOT: %r' % path)
 
-        # create new filename and set it in header
-        out_filename = name + '.fits.fz'
-        fits_file['SCI'].header['FNAME'] = name
+        # finished
+        return path, name, file_path
 
-        # find or create image
-        img = Frame.objects.filter(basename=name).first() or Frame(basename=name)
+    @staticmethod
+    def validate(filename):
+        """Check whether a file can be ingested, using only its SCI header, so that no data is read.
+
+        Args:
+            filename: Name of file.
+
+        Returns:
+            Tuple of path relative to ARCHIVE_ROOT, basename and absolute directory, see archive_location().
+
+        Raises:
+            ValueError: If file can't be ingested.
+        """
+
+        # get location and parse header like ingest() does
+        header = read_header(filename, 'SCI')
+        try:
+            path, name, file_path = Frame.archive_location(header)
+            header['FNAME'] = name
+            frame = Frame(basename=name, path=path)
+            frame.add_fits_header(header)
+        except (KeyError, TypeError) as e:
+            raise ValueError('Invalid FITS header, missing or invalid keyword %s.' % e)
+
+        # check values like the database would
+        for field in Frame._meta.concrete_fields:
+            value = getattr(frame, field.attname)
+            if field.primary_key:
+                continue
+            if value is None:
+                if not field.null and not field.has_default():
+                    raise ValueError('Missing value for %s in FITS header.' % field.name)
+                continue
+            try:
+                field.run_validators(field.to_python(value))
+            except ValidationError as e:
+                raise ValueError('Invalid value for %s in FITS header: %s' % (field.name, ' '.join(e.messages)))
+
+        # all good
+        return path, name, file_path
+
+    @staticmethod
+    def ingest(filename):
+        # reject bad files before reading any data
+        path, name, file_path = Frame.validate(filename)
+
+        # open file, image data is memory-mapped
+        log.info('Opening new file to ingest...')
+        with fits.open(filename) as fits_file:
+            # create new filename and set it in header
+            out_filename = name + '.fits.fz'
+            fits_file['SCI'].header['FNAME'] = name
+
+            # hashing is much cheaper than compressing, so find out first whether anything has changed at all
+            checksum, header_checksum = checksums(fits_file)
+            img = Frame.objects.filter(basename=name).first()
+            if img is not None and img.checksum == checksum and img.path == path and img.has_stored_file():
+                # nothing changed?
+                if img.header_checksum == header_checksum:
+                    log.info('Image %s is unchanged, skipping.', name)
+                    return img.basename
+
+                # only headers changed, so copy compressed data from stored file
+                tmp = update_headers(fits_file, img.filename)
+                if tmp is not None:
+                    log.info('Only headers of %s changed, updating them...', name)
+                    with replacing(tmp, img.filename):
+                        img._store(fits_file['SCI'].header, path, checksum, header_checksum, os.path.getsize(tmp))
+                    thumbnails.replace(path, name, fits_file['SCI'])
+                    return img.basename
+
+            # previews of an old version are outdated
+            if img is not None:
+                thumbnails.remove(img.path, img.basename)
+
+            # create path if necessary
+            if not os.path.exists(file_path):
+                os.makedirs(file_path)
+
+            # compress file next to its final location, which is moved there after writing to the database
+            with compressed_file(fits_file, os.path.join(file_path, out_filename)) as tmp:
+                img = img or Frame(basename=name)
+                img._store(fits_file['SCI'].header, path, checksum, header_checksum, os.path.getsize(tmp))
+            thumbnails.replace(path, name, fits_file['SCI'])
+
+        # all good
+        log.info('Stored image as %s...', out_filename)
+        return img.basename
+
+    def _store(self, header, path, checksum, header_checksum, filesize):
+        """Write frame to database.
+
+        Args:
+            header: Header of SCI HDU.
+            path: Path of file in archive.
+            checksum: Checksum of data.
+            header_checksum: Checksum of headers.
+            filesize: Size of compressed file.
+        """
 
         # set headers
-        img.path = path
-        img.add_fits_header(fits_file['SCI'].header)
+        self.path = path
+        self.add_fits_header(header)
+        self.checksum, self.header_checksum, self.filesize = checksum, header_checksum, filesize
 
         # write to database
         log.info('Writing to database...')
-        img.save()
+        self.save()
 
         # link related
-        img.link_related(fits_file['SCI'].header)
-
-        # create path if necessary
-        if not os.path.exists(file_path):
-            os.makedirs(file_path)
-
-        # write FITS file to byte stream and close
-        with io.BytesIO() as bio:
-            log.info('Writing file to buffer...')
-            fits_file.writeto(bio)
-            fits_file.close()
-            buffer = bytes(bio.getbuffer())
-            log.info(f"Wrote {len(buffer)} bytes.")
-
-        # pipe data into fpack
-        log.info('Fpacking file...')
-        proc = subprocess.Popen(['/usr/bin/fpack', '-S', '-'],
-                                stdin=subprocess.PIPE, stderr=subprocess.PIPE,
-                                stdout=subprocess.PIPE)
-        data, _ = proc.communicate(buffer)
-        log.info(f"Packed file into {len(data)} bytes.")
-
-        # write file
-        with open(os.path.join(file_path, out_filename), 'wb') as f:
-            f.write(data)
-
-        # all good store it
-        if proc.returncode == 0:
-            log.info('Stored image as %s...', out_filename)
-            return img.basename
-        else:
-            raise ValueError('Could not fpack file %s.' % filename)
+        self.link_related(header)
 
     @property
     def filename(self):
@@ -268,6 +492,13 @@ class Frame(models.Model):
         if os.path.exists(self.filename):
             os.remove(self.filename)
 
+    def has_stored_file(self) -> bool:
+        # does the stored file exist and has the expected size?
+        try:
+            return self.filesize is not None and os.path.getsize(self.filename) == self.filesize
+        except OSError:
+            return False
+
     def check_file(self) -> bool:
         # get filename
         filename = self.filename
@@ -288,3 +519,413 @@ class Frame(models.Model):
 
         # all good
         return True
+
+
+class Facet(models.Model):
+    """Number of frames for a combination of the values that can be selected in the frontend."""
+    SITEID = models.CharField('Site of observation', max_length=10)
+    TELID = models.CharField('Telescope used for observation', max_length=5)
+    INSTRUME = models.CharField('Instrument used for observation', max_length=5)
+    IMAGETYP = models.CharField('Type of image', max_length=15)
+    FILTER = models.CharField('Filter used', max_length=20, null=True, default=None)
+    XBINNING = models.IntegerField('Binning of image in X direction')
+    YBINNING = models.IntegerField('Binning of image in Y direction')
+    RLEVEL = models.IntegerField('Reduction level')
+    night = models.DateField('Night of observation', db_index=True)
+    count = models.IntegerField('Number of frames', default=0)
+
+    # fields of Frame that are summarized
+    FIELDS = ['SITEID', 'TELID', 'INSTRUME', 'IMAGETYP', 'FILTER', 'XBINNING', 'YBINNING', 'RLEVEL', 'night']
+
+    @staticmethod
+    def change(values, delta):
+        """Change number of frames for a combination of values.
+
+        Args:
+            values: Dict with values for all FIELDS.
+            delta: Number of frames to add or, if negative, remove.
+        """
+
+        # find row, may not exist yet
+        pk = Facet.objects.filter(**values).values_list('pk', flat=True).first()
+        if pk is None:
+            if delta > 0:
+                Facet.objects.create(count=delta, **values)
+            return
+
+        # update count and remove empty rows
+        Facet.objects.filter(pk=pk).update(count=F('count') + delta)
+        if delta < 0:
+            Facet.objects.filter(pk=pk, count__lte=0).delete()
+
+    @staticmethod
+    def values_of(frame):
+        """Get values for all FIELDS from a frame.
+
+        Args:
+            frame: Frame to take values from.
+
+        Returns:
+            Dict with values, converted to the types of the database, e.g. a date for night instead of a string.
+        """
+        return {k: Frame._meta.get_field(k).to_python(getattr(frame, k)) for k in Facet.FIELDS}
+
+    @staticmethod
+    def rebuild():
+        """Rebuild whole table from frames."""
+        Facet.objects.all().delete()
+        Facet.objects.bulk_create([Facet(**row) for row in Frame.objects.values(*Facet.FIELDS)
+                                  .annotate(count=Count('id')).order_by()], batch_size=1000)
+
+
+class PendingLink(models.Model):
+    """A link from a frame to a related frame that has not been ingested yet."""
+    frame = models.ForeignKey(Frame, on_delete=models.CASCADE, related_name='pending_links')
+    basename = models.CharField('Name of related frame', max_length=50, db_index=True)
+
+    class Meta:
+        unique_together = ('frame', 'basename')
+
+    @staticmethod
+    def resolve(frames):
+        """Complete pending links to newly ingested frames.
+
+        Args:
+            frames: Dict mapping basenames of new frames to their IDs.
+        """
+
+        # find pending links
+        pending = list(PendingLink.objects.filter(basename__in=frames.keys()).values_list('id', 'frame_id', 'basename'))
+        if not pending:
+            return
+
+        # create links and remove pending ones
+        through = Frame.related.through
+        through.objects.bulk_create([through(from_frame_id=frame_id, to_frame_id=frames[basename])
+                                     for _, frame_id, basename in pending], batch_size=500, ignore_conflicts=True)
+        PendingLink.objects.filter(id__in=[p[0] for p in pending]).delete()
+        log.info('Completed %d pending link(s) to related frames.', len(pending))
+
+        # bulk queries don't send m2m_changed
+        bump_frames({p[1] for p in pending})
+
+
+class IngestJob(models.Model):
+    """An uploaded file that is queued for being ingested by a worker."""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    filename = models.CharField('Name of uploaded file', max_length=255)
+    spool = models.CharField('Path of spooled file', max_length=255)
+    status = models.CharField('Status of job', max_length=10, choices=STATUS, default=QUEUED, db_index=True)
+    error = models.TextField('Error message, if failed', null=True, default=None)
+    basename = models.CharField('Name of ingested frame', max_length=50, null=True, default=None)
+    created = models.DateTimeField('Time job was created', auto_now_add=True)
+    started = models.DateTimeField('Time job was started', null=True, default=None)
+    finished = models.DateTimeField('Time job was finished', null=True, default=None)
+
+    def __str__(self):
+        return '%d: %s' % (self.id, self.filename)
+
+    @staticmethod
+    def enqueue(upload):
+        """Spool an uploaded file to disk and queue it for ingest.
+
+        Args:
+            upload: UploadedFile from request.
+
+        Returns:
+            New job.
+        """
+
+        # write file to spool directory in chunks
+        os.makedirs(settings.INGEST_SPOOL, exist_ok=True)
+        spool = os.path.join(settings.INGEST_SPOOL, uuid.uuid4().hex + '.fits')
+        with open(spool, 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+
+        # reject bad files right away instead of queueing them
+        try:
+            Frame.validate(spool)
+        except ValueError:
+            os.remove(spool)
+            raise
+
+        # create job
+        return IngestJob.objects.create(filename=os.path.basename(upload.name), spool=spool)
+
+    @staticmethod
+    def claim():
+        """Claim the oldest queued job for running it.
+
+        Jobs that have been running for longer than INGEST_JOB_TIMEOUT seconds are assumed to belong to a worker that
+        died, and are queued again.
+
+        Returns:
+            Claimed job or None, if queue is empty.
+        """
+
+        # requeue stale jobs
+        stale = now() - datetime.timedelta(seconds=settings.INGEST_JOB_TIMEOUT)
+        IngestJob.objects.filter(status=IngestJob.RUNNING, started__lt=stale).update(status=IngestJob.QUEUED)
+
+        # an update that only succeeds for a still queued job is atomic in every database, so if another worker was
+        # faster, just try the next one
+        for job_id in IngestJob.objects.filter(status=IngestJob.QUEUED).order_by('id').values_list('id', flat=True):
+            if IngestJob.objects.filter(id=job_id, status=IngestJob.QUEUED) \
+                    .update(status=IngestJob.RUNNING, started=now()) == 1:
+                return IngestJob.objects.get(id=job_id)
+        return None
+
+    def run(self):
+        """Ingest spooled file and store result."""
+        try:
+            self.basename = Frame.ingest(self.spool)
+            self.status = IngestJob.DONE
+            os.remove(self.spool)
+        except Exception as e:
+            # keep file for inspection
+            log.exception('Could not ingest %s.', self.filename)
+            self.status = IngestJob.FAILED
+            self.error = str(e)
+        self.finished = now()
+        self.save()
+
+    def get_info(self):
+        """Get status of job.
+
+        Returns:
+            Info dict for job.
+        """
+        info = {k: getattr(self, k) for k in ['id', 'filename', 'status', 'error', 'basename', 'created', 'started',
+                                               'finished']}
+
+        # position in queue, if still waiting
+        if self.status == IngestJob.QUEUED:
+            info['position'] = IngestJob.objects.filter(status=IngestJob.QUEUED, id__lt=self.id).count()
+        return info
+
+
+class Upload(models.Model):
+    """A file that is uploaded in chunks, which may arrive in any order and may be sent again after a failure."""
+    filename = models.CharField('Name of uploaded file', max_length=255)
+    spool = models.CharField('Path of spooled file', max_length=255)
+    size = models.BigIntegerField('Size of file in bytes')
+    checksum = models.CharField('SHA-256 of file for verification', max_length=64, null=True, default=None)
+    created = models.DateTimeField('Time upload was initiated', auto_now_add=True)
+    updated = models.DateTimeField('Time last chunk was received', auto_now=True)
+
+    def __str__(self):
+        return '%d: %s' % (self.id, self.filename)
+
+    @staticmethod
+    def initiate(filename, size, checksum=None):
+        """Start a new upload.
+
+        Args:
+            filename: Name of file.
+            size: Size of file in bytes.
+            checksum: Optional SHA-256 hex digest of file, which is verified on finalize().
+
+        Returns:
+            New upload.
+        """
+
+        # check
+        if size <= 0:
+            raise ValueError('Invalid file size.')
+        if checksum is not None and (len(checksum) != 64 or not all(c in '0123456789abcdef' for c in checksum)):
+            raise ValueError('Invalid checksum, must be a SHA-256 hex digest.')
+
+        # clean up abandoned uploads
+        Upload.expire()
+
+        # create empty file of full size in spool directory, chunks are written into it at their offsets
+        os.makedirs(settings.INGEST_SPOOL, exist_ok=True)
+        spool = os.path.join(settings.INGEST_SPOOL, uuid.uuid4().hex + '.part')
+        with open(spool, 'wb') as f:
+            f.truncate(size)
+
+        # create upload
+        return Upload.objects.create(filename=os.path.basename(filename), spool=spool, size=size, checksum=checksum)
+
+    @staticmethod
+    def expire():
+        """Abort uploads that haven't received any chunk for INGEST_UPLOAD_EXPIRY seconds."""
+        expired = now() - datetime.timedelta(seconds=settings.INGEST_UPLOAD_EXPIRY)
+        for upload in Upload.objects.filter(updated__lt=expired):
+            log.info('Upload %d of %s expired.', upload.id, upload.filename)
+            upload.abort()
+
+    def write(self, offset, length, stream):
+        """Write a chunk into the spooled file.
+
+        Args:
+            offset: Offset of chunk in file.
+            length: Length of chunk in bytes.
+            stream: File-like object to read chunk from.
+        """
+
+        # check
+        if offset < 0 or length <= 0 or offset + length > self.size:
+            raise ValueError('Chunk of %d bytes at offset %d is outside of file.' % (length, offset))
+
+        # copy chunk in blocks, so that it is never in memory at once
+        remaining = length
+        with open(self.spool, 'r+b') as f:
+            f.seek(offset)
+            while remaining > 0:
+                data = stream.read(min(remaining, 1 << 20))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+        if remaining > 0:
+            raise ValueError('Incomplete chunk, received %d of %d bytes.' % (length - remaining, length))
+
+        # a chunk counts as received only after it has been written completely
+        UploadChunk.objects.update_or_create(upload=self, offset=offset, defaults={'size': length})
+        self.save(update_fields=['updated'])
+
+    def received(self):
+        """Get received ranges of file.
+
+        Returns:
+            List of [start, end) ranges, sorted and merged.
+        """
+        ranges = []
+        for offset, size in self.chunks.order_by('offset').values_list('offset', 'size'):
+            if ranges and offset <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], offset + size)
+            else:
+                ranges.append([offset, offset + size])
+        return ranges
+
+    def missing(self):
+        """Get ranges of file that still need to be uploaded.
+
+        Returns:
+            List of [start, end) ranges.
+        """
+        missing = []
+        pos = 0
+        for start, end in self.received() + [[self.size, self.size]]:
+            if start > pos:
+                missing.append([pos, start])
+            pos = max(pos, end)
+        return missing
+
+    def finalize(self):
+        """Check that the upload is complete and queue the file for ingest.
+
+        Returns:
+            New ingest job.
+        """
+
+        # complete?
+        missing = self.missing()
+        if missing:
+            raise ValueError('Upload is incomplete, %d bytes are missing.' % sum(e - s for s, e in missing))
+
+        # verify checksum
+        if self.checksum is not None:
+            sha = hashlib.sha256()
+            with open(self.spool, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(block)
+            if sha.hexdigest() != self.checksum:
+                raise ValueError('Checksum of uploaded file does not match.')
+
+        # a bad file will never become a good one, so remove it
+        try:
+            Frame.validate(self.spool)
+        except ValueError:
+            self.abort()
+            raise
+
+        # hand file over to ingest queue
+        spool = os.path.splitext(self.spool)[0] + '.fits'
+        os.replace(self.spool, spool)
+        with transaction.atomic():
+            job = IngestJob.objects.create(filename=self.filename, spool=spool)
+            self.delete()
+        return job
+
+    def abort(self):
+        """Remove upload and its spooled file."""
+        if os.path.exists(self.spool):
+            os.remove(self.spool)
+        self.delete()
+
+    def get_info(self):
+        """Get status of upload.
+
+        Returns:
+            Info dict for upload.
+        """
+        info = {k: getattr(self, k) for k in ['id', 'filename', 'size', 'created', 'updated']}
+        info['received'] = self.received()
+        info['missing'] = self.missing()
+        return info
+
+
+class UploadChunk(models.Model):
+    """A chunk of an upload that has been received completely."""
+    upload = models.ForeignKey(Upload, on_delete=models.CASCADE, related_name='chunks')
+    offset = models.BigIntegerField('Offset of chunk in file')
+    size = models.BigIntegerField('Size of chunk in bytes')
+
+    class Meta:
+        unique_together = ('upload', 'offset')
+
+
+@receiver(pre_save, sender=Frame)
+def remember_facet(sender, instance, **kwargs):
+    # remember facet values of frame before update
+    instance._old_facet = None
+    if instance.pk is not None:
+        instance._old_facet = Frame.objects.filter(pk=instance.pk).values(*Facet.FIELDS).first()
+
+
+@receiver(post_save, sender=Frame)
+def update_facet(sender, instance, **kwargs):
+    new = Facet.values_of(instance)
+    old = getattr(instance, '_old_facet', None)
+
+    # move frame from old to new facet
+    if old != new:
+        if old is not None:
+            Facet.change(old, -1)
+        Facet.change(new, 1)
+
+
+@receiver(post_delete, sender=Frame)
+def remove_facet(sender, instance, **kwargs):
+    Facet.change(Facet.values_of(instance), -1)
+
+
+@receiver(post_delete, sender=Frame)
+def remove_previews(sender, instance, **kwargs):
+    thumbnails.remove(instance.path, instance.basename)
+
+
+@receiver(post_save, sender=Frame)
+@receiver(post_delete, sender=Frame)
+def invalidate_cache(sender, **kwargs):
+    # cached counts etc. are outdated now
+    bump_generation()
+
+
+@receiver(post_save, sender=Frame)
+@receiver(pre_delete, sender=Frame)
+def invalidate_frame_cache(sender, instance, **kwargs):
+    # invalidate frame itself and all frames it is related to
+    bump_frames([instance.pk] + list(Frame.objects.filter(related=instance).values_list('id', flat=True)))
+
+
+@receiver(m2m_changed, sender=Frame.related.through)
+def invalidate_related_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    # related frames of instance have changed or, if reverse, instance was added to/removed from those in pk_set
+    if action.startswith('post_'):
+        bump_frames((pk_set or []) if reverse else [instance.pk])
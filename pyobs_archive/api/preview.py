@@ -0,0 +1,172 @@
+"""Rendering of preview images and tiles.
+
+Everything works on NumPy arrays: cuts are calculated on a strided subsample of the image, the image is block-averaged
+down to the requested width, stretched, and the result is encoded as 8 bit grayscale PNG with zlib directly.
+"""
+
+import math
+import struct
+import zlib
+
+import numpy as np
+from astropy.visualization import AsinhStretch, LinearStretch, LogStretch, SqrtStretch, ZScaleInterval
+
+# methods for calculating cuts
+CUTS = ['percentile', 'zscale']
+
+# stretches applied between cuts
+STRETCHES = {'linear': LinearStretch(), 'sqrt': SqrtStretch(), 'log': LogStretch(), 'asinh': AsinhStretch()}
+
+# approximate number of pixels used for calculating cuts
+CUT_SAMPLES = 100000
+
+
+def subsample(data: np.ndarray, samples: int = CUT_SAMPLES) -> np.ndarray:
+    """Take every n-th pixel in both directions, so that roughly the given number of pixels remains.
+
+    Args:
+        data: Image.
+        samples: Number of pixels to return.
+
+    Returns:
+        Finite pixel values of subsample as flat array.
+    """
+    step = max(1, int(math.sqrt(data.size / samples)))
+    sample = np.asarray(data[::step, ::step], dtype=np.float32).ravel()
+    return sample[np.isfinite(sample)]
+
+
+def cuts(data: np.ndarray, method: str = 'percentile', percent: float = 95.) -> tuple:
+    """Calculate lower and upper cut for displaying an image.
+
+    Args:
+        data: Image.
+        method: Either "percentile" for cutting the given percentile at both ends, or "zscale" for IRAF's zscale.
+        percent: Percentile for method "percentile".
+
+    Returns:
+        Tuple of lower and upper cut.
+    """
+    sample = subsample(data)
+    if len(sample) == 0:
+        return 0., 1.
+    if method == 'zscale':
+        vmin, vmax = ZScaleInterval().get_limits(sample)
+    elif method == 'percentile':
+        vmin, vmax = np.percentile(sample, [100. - percent, percent])
+    else:
+        raise ValueError('Unknown method for cuts: %s' % method)
+    return float(vmin), float(vmax)
+
+
+def block_average(data: np.ndarray, factor: int) -> np.ndarray:
+    """Average an image over blocks of factor x factor pixels, ignoring incomplete blocks at the edges.
+
+    Args:
+        data: Image.
+        factor: Size of blocks.
+
+    Returns:
+        Averaged image as float32.
+    """
+    if factor <= 1:
+        return np.asarray(data, dtype=np.float32)
+    h, w = max(1, data.shape[0] // factor), max(1, data.shape[1] // factor)
+    fy, fx = min(factor, data.shape[0]), min(factor, data.shape[1])
+    return data[:h * fy, :w * fx].reshape(h, fy, w, fx).mean(axis=(1, 3), dtype=np.float32)
+
+
+def downsample(data: np.ndarray, width: int) -> np.ndarray:
+    """Shrink an image to the given width, keeping its aspect ratio.
+
+    The image is averaged in blocks of the largest integer factor that still leaves it at least as wide as requested,
+    and the remaining difference is done by picking the nearest rows and columns.
+
+    Args:
+        data: Image.
+        width: Width of new image.
+
+    Returns:
+        Shrunk image as float32, or the original image, if it isn't wider than requested.
+    """
+    h, w = data.shape
+    if w <= width:
+        return np.asarray(data, dtype=np.float32)
+    height = max(1, round(h * width / w))
+
+    # average over blocks
+    data = block_average(data, w // width)
+    h, w = data.shape
+
+    # nearest rows and columns for the rest
+    rows = (np.arange(height) * h / height).astype(int)
+    cols = (np.arange(width) * w / width).astype(int)
+    return np.asarray(data[rows[:, None], cols], dtype=np.float32)
+
+
+def scale(data: np.ndarray, vmin: float, vmax: float, stretch: str = 'linear') -> np.ndarray:
+    """Scale image between cuts to 8 bits.
+
+    Args:
+        data: Image.
+        vmin: Lower cut, which becomes black.
+        vmax: Upper cut, which becomes white.
+        stretch: Name of stretch in STRETCHES.
+
+    Returns:
+        Image as uint8, with non-finite pixels black.
+    """
+    scaled = np.clip((data - vmin) * (1. / (vmax - vmin) if vmax > vmin else 0.), 0., 1.)
+    if stretch != 'linear':
+        scaled = STRETCHES[stretch](scaled, clip=True)
+    return np.nan_to_num(scaled * 255., nan=0.).astype(np.uint8)
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    # length, type, data and CRC over type and data
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(image: np.ndarray, level: int = 6) -> bytes:
+    """Encode an 8 bit grayscale image as PNG.
+
+    Args:
+        image: Image as uint8, with the first row at the top.
+        level: zlib compression level.
+
+    Returns:
+        PNG file.
+    """
+    height, width = image.shape
+
+    # every row starts with its filter type, which is 0 for none
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = image
+
+    # run-length encoding compresses noisy sky as well as the default strategy, but takes half the time
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, zlib.Z_RLE)
+    idat = compressor.compress(raw.tobytes()) + compressor.flush()
+
+    # header with size, 8 bit depth and grayscale colour type, then data
+    return (b'\x89PNG\r\n\x1a\n'
+            + _chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + _chunk(b'IDAT', idat)
+            + _chunk(b'IEND', b''))
+
+
+def render(data: np.ndarray, width: int = 200, method: str = 'percentile') -> bytes:
+    """Render a preview of an image as PNG.
+
+    Args:
+        data: Image.
+        width: Width of preview.
+        method: Method for calculating cuts, see cuts().
+
+    Returns:
+        PNG file.
+    """
+    vmin, vmax = cuts(data, method)
+    return encode_png(scale(downsample(data, width), vmin, vmax))
+
+
+__all__ = ['CUTS', 'STRETCHES', 'block_average', 'cuts', 'downsample', 'encode_png', 'render', 'scale', 'subsample']
@@ -0,0 +1,123 @@
+"""Indexed substring search in OBJECT and basename of frames.
+
+On PostgreSQL, trigram GIN indexes on UPPER(field) serve Django's icontains/istartswith lookups directly. SQLite
+can't index those, so a FTS5 table with the trigram tokenizer shadows the searchable columns, kept in sync by
+triggers, and is used to preselect matching rows.
+"""
+
+import logging
+
+from django.db import connections
+from django.db.models.expressions import RawSQL
+
+log = logging.getLogger(__name__)
+
+# fields that can be searched
+SEARCH_FIELDS = ['OBJECT', 'basename']
+
+# search modes with the Django lookup for each
+SEARCH_MODES = {'contains': 'icontains', 'prefix': 'istartswith'}
+
+# name of FTS5 table on SQLite
+FTS_TABLE = 'api_frame_search'
+
+# whether FTS table exists, per database alias
+_fts_available = {}
+
+
+def install(connection):
+    """Create search indexes for the given database, if missing.
+
+    Called from the migration that introduced them and after every migrate, since SQLite drops triggers whenever
+    Django rebuilds the frames table for a schema change.
+
+    Args:
+        connection: Database connection.
+    """
+
+    # frames table not migrated yet?
+    if 'api_frame' not in connection.introspection.table_names():
+        return
+
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for field in SEARCH_FIELDS:
+                cursor.execute('CREATE INDEX IF NOT EXISTS "api_frame_%s_trgm" ON "api_frame" '
+                               'USING gin ((UPPER("%s"::text)) gin_trgm_ops)' % (field.lower(), field))
+
+    elif connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            # all there?
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name LIKE %s",
+                           [FTS_TABLE + '_%'])
+            if cursor.fetchone()[0] == 3:
+                _fts_available[connection.alias] = True
+                return
+
+            # create table, trigram tokenizer requires SQLite 3.34
+            columns = ', '.join('"%s"' % f for f in SEARCH_FIELDS)
+            old = ', '.join('old."%s"' % f for f in SEARCH_FIELDS)
+            new = ', '.join('new."%s"' % f for f in SEARCH_FIELDS)
+            try:
+                cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, content='api_frame', "
+                               "content_rowid='id', tokenize='trigram')" % (FTS_TABLE, columns))
+            except Exception:
+                log.warning('Could not create FTS5 table, substring search will not be indexed.')
+                _fts_available[connection.alias] = False
+                return
+
+            # triggers for keeping it in sync
+            cursor.execute('CREATE TRIGGER IF NOT EXISTS %s_insert AFTER INSERT ON api_frame BEGIN '
+                           'INSERT INTO %s(rowid, %s) VALUES (new.id, %s); END'
+                           % (FTS_TABLE, FTS_TABLE, columns, new))
+            cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_delete AFTER DELETE ON api_frame BEGIN "
+                           "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s); END"
+                           % (FTS_TABLE, FTS_TABLE, FTS_TABLE, columns, old))
+            cursor.execute("CREATE TRIGGER IF NOT EXISTS %s_update AFTER UPDATE OF %s ON api_frame BEGIN "
+                           "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s); "
+                           "INSERT INTO %s(rowid, %s) VALUES (new.id, %s); END"
+                           % (FTS_TABLE, columns, FTS_TABLE, FTS_TABLE, columns, old, FTS_TABLE, columns, new))
+
+            # fill it
+            cursor.execute("INSERT INTO %s(%s) VALUES ('rebuild')" % (FTS_TABLE, FTS_TABLE))
+            _fts_available[connection.alias] = True
+
+
+def install_after_migrate(sender, using='default', **kwargs):
+    """Handler for the post_migrate signal, (re-)creates search indexes."""
+    install(connections[using])
+
+
+def _has_fts(connection):
+    if connection.alias not in _fts_available:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=%s", [FTS_TABLE])
+            _fts_available[connection.alias] = cursor.fetchone()[0] > 0
+    return _fts_available[connection.alias]
+
+
+def search(data, field: str, value: str, mode: str = 'contains'):
+    """Filter frames for a case-insensitive substring or prefix in a field.
+
+    Args:
+        data: QuerySet to filter.
+        field: Field to search in, one of SEARCH_FIELDS.
+        value: String to search for.
+        mode: One of SEARCH_MODES.
+
+    Returns:
+        Filtered QuerySet.
+    """
+    # on SQLite, preselect rows from FTS table, which needs at least one trigram
+    connection = connections[data.db]
+    if connection.vendor == 'sqlite' and len(value) >= 3 and _has_fts(connection):
+        phrase = '"%s"' % value.replace('"', '""')
+        data = data.filter(id__in=RawSQL('SELECT rowid FROM %s WHERE "%s" MATCH %%s' % (FTS_TABLE, field),
+                                         [phrase]))
+
+    # exact check, which is served by the trigram index on PostgreSQL
+    return data.filter(**{field + '__' + SEARCH_MODES[mode]: value})
+
+
+__all__ = ['SEARCH_FIELDS', 'SEARCH_MODES', 'install', 'install_after_migrate', 'search']
@@ -0,0 +1,171 @@
+"""Serving files from the archive.
+
+Files are never read into memory at once: FileResponse streams them in blocks, and WSGI servers like gunicorn hand
+them to os.sendfile(). With SENDFILE_BACKEND, Django only authorizes the request and sets a header, and the web server
+in front of it sends the file. Single byte ranges are supported, so that downloads can be resumed.
+
+Responses derived from a file are validated by an ETag built from modification time, size and checksum of the file,
+so that conditional requests can be answered from a stat() alone.
+"""
+
+import datetime
+import hashlib
+import os
+import re
+from urllib.parse import quote, urljoin
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.http import content_disposition_header, parse_http_date_safe
+
+# a single range of bytes, like "bytes=0-499", "bytes=500-" or "bytes=-500"
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _RangeFile:
+    """Part of an open file, which still has a file descriptor, so that the WSGI server can use sendfile()."""
+
+    def __init__(self, fh, start: int, length: int):
+        self._fh = fh
+        self._fh.seek(start)
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._fh.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def fileno(self) -> int:
+        return self._fh.fileno()
+
+    def tell(self) -> int:
+        return self._fh.tell()
+
+    def close(self):
+        self._fh.close()
+
+
+def file_validators(filename: str, checksum: str = None):
+    """Get validators for responses derived from a file.
+
+    Args:
+        filename: Name of file.
+        checksum: Checksum of file content, if known.
+
+    Returns:
+        Tuple of strong ETag and time of last modification, or of two Nones, if file doesn't exist.
+    """
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None, None
+    tag = hashlib.sha256(b'%d:%d:%s' % (stat.st_mtime_ns, stat.st_size, (checksum or '').encode())).hexdigest()
+    return '"%s"' % tag[:32], datetime.datetime.fromtimestamp(stat.st_mtime, tz=datetime.timezone.utc)
+
+
+def parse_range(header: str, size: int):
+    """Parse a Range header.
+
+    Args:
+        header: Value of Range header.
+        size: Size of file.
+
+    Returns:
+        Tuple of first and last byte, None if the range can't be satisfied, or False if the header should be
+        ignored, e.g. for multiple ranges, so that the whole file is sent.
+    """
+    match = RANGE.match(header.strip())
+    if match is None or match.groups() == ('', ''):
+        return False
+    first, last = match.groups()
+
+    # suffix range, i.e. last bytes of file
+    if first == '':
+        length = int(last)
+        return (max(size - length, 0), size - 1) if length > 0 and size > 0 else None
+
+    # range from first byte to last byte or end of file
+    first = int(first)
+    last = size - 1 if last == '' else min(int(last), size - 1)
+    if first >= size:
+        return None
+    return (first, last) if first <= last else False
+
+
+def _if_range(value: str, etag: str, last_modified: datetime.datetime) -> bool:
+    # no If-Range or matching the current version of the file exactly?
+    if value is None:
+        return True
+    if value.startswith('"') or value.startswith('W/'):
+        return etag is not None and value == etag
+    return last_modified is not None and parse_http_date_safe(value) == int(last_modified.timestamp())
+
+
+def serve_file(request, filename: str, content_type: str, attachment: str = None, etag: str = None,
+               last_modified: datetime.datetime = None):
+    """Create response that sends a file from the archive.
+
+    Args:
+        request: Request to answer, GET or HEAD.
+        filename: Absolute name of file.
+        content_type: Content type of file.
+        attachment: If given, the file is sent as attachment with this name.
+        etag: ETag of file, see file_validators(), for checking If-Range.
+        last_modified: Time of last modification of file, for checking If-Range.
+
+    Returns:
+        Response.
+    """
+    backend = getattr(settings, 'SENDFILE_BACKEND', None)
+
+    # let the web server send the file, it handles ranges itself
+    if backend in ('nginx', 'xsendfile'):
+        response = HttpResponse(content_type=content_type)
+        if backend == 'nginx':
+            path = os.path.relpath(filename, settings.ARCHIVE_ROOT)
+            response['X-Accel-Redirect'] = urljoin(settings.SENDFILE_URL, quote(path))
+        else:
+            response['X-Sendfile'] = filename
+        if attachment:
+            response['Content-Disposition'] = content_disposition_header(True, attachment)
+        return response
+
+    # no body for HEAD
+    size = os.path.getsize(filename)
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        # requested range, ignored if it is only valid for another version of the file
+        first, last = 0, size - 1
+        byte_range = False
+        if 'Range' in request.headers and _if_range(request.headers.get('If-Range'), etag, last_modified):
+            byte_range = parse_range(request.headers['Range'], size)
+
+        # not satisfiable?
+        if byte_range is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+        # stream file or part of it
+        if byte_range:
+            first, last = byte_range
+            response = FileResponse(_RangeFile(open(filename, 'rb'), first, last - first + 1),
+                                    content_type=content_type, status=206)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+        else:
+            response = FileResponse(open(filename, 'rb'), content_type=content_type)
+        response['Content-Length'] = last - first + 1
+        response.block_size = 1024 * 1024
+
+    # headers
+    response['Accept-Ranges'] = 'bytes'
+    if attachment:
+        response['Content-Disposition'] = content_disposition_header(True, attachment)
+    return response
+
+
+__all__ = ['file_validators', 'parse_range', 'serve_file']
@@ -1,11 +1,38 @@
+import csv
+import datetime
+import importlib.util
+import io
+import json
+import os
+import signal
+import struct
 import tempfile
+import time
+import zlib
+from unittest import mock, skipUnless
 
+import numpy as np
 from astropy.io import fits
-from django.test import TestCase, RequestFactory
+from astropy.table import Table
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
 from rest_framework.exceptions import ParseError
 
-from pyobs_archive.api.models import Frame
-from pyobs_archive.api.views import filter_frames, sort_frames
+from pyobs_archive.api import htm, preview, thumbnails, tiles
+from pyobs_archive.api.ingest import bulk_ingest, create_pool, prepare
+from pyobs_archive.api.models import Frame, Facet, IngestJob, PendingLink, Upload
+from pyobs_archive.api.serve import parse_range
+from pyobs_archive.api.utils import FilenameFormatter, get_formatter, parse_date
+from pyobs_archive.api.views import filter_frames, sort_frames, frame_filters
+from pyobs_archive.api.watch import DirectoryWatcher, IngestDaemon
+from pyobs_archive.api.worker import run_pending
 
 
 def _header(**overrides):
@@ -70,6 +97,36 @@ class FrameAddFitsHeaderTests(TestCase):
             Frame().add_fits_header(header)
 
 
+class FilenameFormatterTests(TestCase):
+    def test_formats_placeholders(self):
+        header = _header(EXPNUM=12, **{'DATE-OBS': '2024-01-15T21:34:56.789'})
+        fmt = FilenameFormatter('{SITEID}{TELID}-{INSTRUME|lower}-{DATE-OBS|date:}-{DATE-OBS|time:_}-'
+                                '{EXPNUM|string:04d}{FILTER|filter}.{DATE-OBS|date}')
+        self.assertEqual(fmt(header), 'iagiag50-cam1-20240115-21_34_56-0012_clear.2024-01-15')
+
+    def test_literals_and_repeated_placeholders(self):
+        self.assertEqual(FilenameFormatter('plain')(_header()), 'plain')
+        self.assertEqual(FilenameFormatter('{SITEID}/{A B}/{SITEID}')(_header()), 'iag/{A B}/iag')
+        self.assertIsNone(FilenameFormatter(None)(_header()))
+
+    def test_errors_are_raised_when_called(self):
+        fmt = FilenameFormatter('{SITEID|unknown}')
+        with self.assertRaises(KeyError):
+            fmt(_header())
+        with self.assertRaises(KeyError):
+            FilenameFormatter('{MISSING}')(_header())
+
+    def test_formatters_are_cached(self):
+        self.assertIs(get_formatter('{SITEID}/'), get_formatter('{SITEID}/'))
+
+    def test_parse_date(self):
+        self.assertEqual(parse_date('2024-01-15T10:00:00.5'), datetime.datetime(2024, 1, 15, 10, 0, 0, 500000))
+        self.assertEqual(parse_date('2024-01-15T12:00:00+02:00'), datetime.datetime(2024, 1, 15, 10, 0, 0))
+        self.assertEqual(parse_date('2024:015:10:00:00'), datetime.datetime(2024, 1, 15, 10, 0, 0))
+        with self.assertRaises(ValueError):
+            parse_date('yesterday')
+
+
 class FilterFramesTests(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -173,6 +230,652 @@ class SortFramesTests(TestCase):
             self._sorted(order='sideways')
 
 
+class GetInfosTests(TestCase):
+    def setUp(self):
+        self.bias = Frame.objects.create(
+            basename='bias', path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+            IMAGETYP='bias', DATE_OBS='2024-01-15T09:00:00Z', night='2024-01-15',
+            OBJECT='Bias', EXPTIME=0.0, FILTER='clear', RLEVEL=1,
+            XBINNING=1, YBINNING=1, width=100, height=100,
+        )
+        self.frames = []
+        for i in range(5):
+            frame = Frame.objects.create(
+                basename='frame_%d' % i, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+                IMAGETYP='object', DATE_OBS='2024-01-15T10:0%d:00Z' % i, night='2024-01-15',
+                OBJECT='M31', EXPTIME=30.0, FILTER='clear', RLEVEL=1,
+                XBINNING=2, YBINNING=2, width=100, height=100,
+            )
+            frame.related.set([self.bias])
+            self.frames.append(frame)
+
+    def test_matches_get_info(self):
+        data = Frame.objects.order_by('DATE_OBS', 'id')
+        expected = [frame.get_info() for frame in data]
+        self.assertEqual(Frame.get_infos(data), expected)
+
+    def test_uses_constant_number_of_queries(self):
+        with self.assertNumQueries(2):
+            infos = Frame.get_infos(Frame.objects.order_by('id')[:10])
+        self.assertEqual(len(infos), 6)
+        self.assertEqual(infos[1]['related_frames'], [self.bias.id])
+
+    def test_related_view_queryset(self):
+        infos = Frame.get_infos(self.frames[0].related.all())
+        self.assertEqual(infos, [Frame.objects.get(id=self.bias.id).get_info()])
+        self.assertIsNone(infos[0]['OBJECT'])
+
+    def test_fields_restrict_columns_and_output(self):
+        with CaptureQueriesContext(connection) as ctx:
+            infos = Frame.get_infos(Frame.objects.order_by('id'), ['DATE_OBS', 'OBJECT'])
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('"EXPTIME"', ctx.captured_queries[0]['sql'])
+        self.assertEqual(list(infos[0].keys()), ['DATE_OBS', 'OBJECT'])
+        self.assertIsNone(infos[0]['OBJECT'])
+        self.assertEqual(infos[1]['OBJECT'], 'M31')
+
+    def test_fields_match_get_info(self):
+        fields = ['url', 'binning', 'related_frames']
+        data = Frame.objects.order_by('id')
+        self.assertEqual(Frame.get_infos(data, fields), [frame.get_info(fields) for frame in data])
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        for i in range(7):
+            # two frames per timestamp, so that the id tiebreaker is needed
+            Frame.objects.create(
+                basename='frame_%d' % i, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+                IMAGETYP='object', DATE_OBS='2024-01-15T10:0%d:00Z' % (i // 2), night='2024-01-15',
+                OBJECT='M31', EXPTIME=30.0, FILTER='clear', RLEVEL=0,
+                XBINNING=1, YBINNING=1, width=100, height=100,
+            )
+
+    def _get(self, **params):
+        response = self.client.get('/frames/', params)
+        return response.status_code, response.json()
+
+    def _walk(self, **params):
+        names, cursor = [], ''
+        while cursor is not None:
+            status, data = self._get(cursor=cursor, limit=3, **params)
+            self.assertEqual(status, 200)
+            names.extend(r['basename'] for r in data['results'])
+            cursor = data['next']
+            self.assertLess(len(names), 100, 'Cursor does not advance.')
+        return names
+
+    def test_walk_ascending_matches_offset_order(self):
+        _, data = self._get(limit=100)
+        self.assertEqual(self._walk(), [r['basename'] for r in data['results']])
+
+    def test_walk_descending_matches_offset_order(self):
+        _, data = self._get(limit=100, order='desc')
+        self.assertEqual(self._walk(order='desc'), [r['basename'] for r in data['results']])
+
+    def test_walk_with_filter(self):
+        Frame.objects.filter(basename='frame_3').update(IMAGETYP='bias')
+        self.assertEqual(self._walk(IMAGETYPE='object'),
+                         ['frame_0', 'frame_1', 'frame_2', 'frame_4', 'frame_5', 'frame_6'])
+
+    def test_walk_with_microseconds(self):
+        # times that differ by less than a millisecond
+        for i, frame in enumerate(Frame.objects.order_by('id')):
+            frame.DATE_OBS = datetime.datetime(2024, 1, 15, 10, 0, 0, 100 * (i // 2), tzinfo=datetime.timezone.utc)
+            frame.save()
+        _, data = self._get(limit=100)
+        self.assertEqual(self._walk(), [r['basename'] for r in data['results']])
+        self.assertEqual(len(self._walk(order='desc')), 7)
+
+    def test_invalid_cursor_is_rejected(self):
+        status, _ = self._get(cursor='garbage')
+        self.assertEqual(status, 400)
+
+    def test_cursor_with_other_sort_is_rejected(self):
+        _, data = self._get(cursor='', limit=2)
+        status, _ = self._get(cursor=data['next'], limit=2, sort='EXPTIME')
+        self.assertEqual(status, 400)
+
+    def test_nullable_sort_field_is_rejected(self):
+        status, _ = self._get(cursor='', sort='OBJECT')
+        self.assertEqual(status, 400)
+
+
+class FieldSelectionTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self.frames = []
+        for i in range(3):
+            self.frames.append(Frame.objects.create(
+                basename='frame_%d' % i, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+                IMAGETYP='object', DATE_OBS='2024-01-15T10:0%d:00Z' % i, night='2024-01-15',
+                OBJECT='M31', EXPTIME=30.0, FILTER='clear', RLEVEL=0,
+                XBINNING=1, YBINNING=1, width=100, height=100,
+            ))
+        self.frames[0].related.set(self.frames[1:])
+
+    def test_frames_with_fields(self):
+        data = self.client.get('/frames/', {'fields': 'basename,id'}).json()
+        self.assertEqual(data['results'][0], {'id': self.frames[0].id, 'basename': 'frame_0'})
+
+    def test_frames_as_columns(self):
+        data = self.client.get('/frames/', {'fields': 'id,binning', 'format': 'columns'}).json()
+        self.assertEqual(data['results'], {'id': [f.id for f in self.frames], 'binning': ['1x1'] * 3})
+
+    def test_empty_columns(self):
+        data = self.client.get('/frames/', {'fields': 'id', 'format': 'columns', 'OBJECT': 'none'}).json()
+        self.assertEqual(data['results'], {'id': []})
+
+    def test_cursor_without_id_field(self):
+        data = self.client.get('/frames/', {'fields': 'basename', 'cursor': '', 'limit': 2}).json()
+        data = self.client.get('/frames/', {'fields': 'basename', 'cursor': data['next'], 'limit': 2}).json()
+        self.assertEqual(data['results'], [{'basename': 'frame_2'}])
+
+    def test_frame_and_related_with_fields(self):
+        frame_id = self.frames[0].id
+        data = self.client.get('/frames/%d/' % frame_id, {'fields': 'related_frames'}).json()
+        self.assertEqual(data, {'related_frames': [f.id for f in self.frames[1:]]})
+        data = self.client.get('/frames/%d/related/' % frame_id, {'fields': 'basename', 'format': 'columns'}).json()
+        self.assertEqual(data, {'basename': ['frame_1', 'frame_2']})
+
+    def test_missing_frame(self):
+        self.assertEqual(self.client.get('/frames/12345/', {'fields': 'id'}).status_code, 404)
+
+    def test_invalid_fields_and_format(self):
+        self.assertEqual(self.client.get('/frames/', {'fields': 'id,path'}).status_code, 400)
+        self.assertEqual(self.client.get('/frames/', {'format': 'xml'}).status_code, 400)
+
+
+@override_settings(COUNT_CACHE_TIMEOUT=300, RESPONSE_CACHE_TIMEOUT=300)
+class CountCacheTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self._create('frame_a')
+
+    def _create(self, basename):
+        return Frame.objects.create(
+            basename=basename, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+            IMAGETYP='object', DATE_OBS='2024-01-15T10:00:00Z', night='2024-01-15',
+            OBJECT='M31', EXPTIME=30.0, FILTER='clear', RLEVEL=0,
+            XBINNING=1, YBINNING=1, width=100, height=100,
+        )
+
+    def _count_queries(self, **params):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/frames/', params).json()
+        return data['count'], len([q for q in ctx.captured_queries if 'COUNT(' in q['sql']])
+
+    def test_count_is_cached(self):
+        self.assertEqual(self._count_queries(OBJECT='m31'), (1, 1))
+        self.assertEqual(self._count_queries(OBJECT='m31'), (1, 0))
+
+    def test_equivalent_filters_share_cache(self):
+        self._count_queries(IMAGETYPE='object', SITE='ALL')
+        self.assertEqual(self._count_queries(IMAGETYPE='object', TELESCOPE=''), (1, 0))
+
+    def test_ingest_and_delete_invalidate_cache(self):
+        self._count_queries()
+        frame = self._create('frame_b')
+        self.assertEqual(self._count_queries(), (2, 1))
+        frame.delete()
+        self.assertEqual(self._count_queries(), (1, 1))
+
+    def test_estimate_falls_back_to_exact_count_on_sqlite(self):
+        data = self.client.get('/frames/', {'count': 'estimate'}).json()
+        self.assertEqual(data['count'], 1)
+        self.assertFalse(data['estimated'])
+
+    def test_invalid_count_mode(self):
+        self.assertEqual(self.client.get('/frames/', {'count': 'maybe'}).status_code, 400)
+
+    def test_frame_filters_are_normalized(self):
+        request = RequestFactory().get('/frames/', {'binning': '2x2', 'OBJECT': ' M31 ', 'SITE': 'ALL'})
+        self.assertEqual(frame_filters(request),
+                         {'XBINNING': 2.0, 'YBINNING': 2.0, 'OBJECT__icontains': 'M31'})
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self.frame_a = self._create('frame_a', IMAGETYP='object', FILTER='clear', OBJECT='M31')
+        self.frame_b = self._create('frame_b', IMAGETYP='object', FILTER='clear', OBJECT='M42')
+        self.frame_c = self._create('frame_c', IMAGETYP='bias', FILTER=None, OBJECT=None, XBINNING=2, YBINNING=2)
+
+    def _create(self, basename, **kwargs):
+        values = dict(path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1', DATE_OBS='2024-01-15T10:00:00Z',
+                      night='2024-01-15', EXPTIME=30.0, RLEVEL=0, XBINNING=1, YBINNING=1, width=100, height=100)
+        values.update(kwargs)
+        return Frame.objects.create(basename=basename, **values)
+
+    def _facets(self):
+        return {(f.IMAGETYP, f.FILTER, f.XBINNING): f.count for f in Facet.objects.all()}
+
+    def test_facets_follow_create_update_and_delete(self):
+        self.assertEqual(self._facets(), {('object', 'clear', 1): 2, ('bias', None, 2): 1})
+
+        frame = Frame.objects.get(basename='frame_a')
+        frame.FILTER = 'red'
+        frame.save()
+        self.assertEqual(self._facets(), {('object', 'clear', 1): 1, ('object', 'red', 1): 1, ('bias', None, 2): 1})
+
+        frame.delete()
+        self.assertEqual(self._facets(), {('object', 'clear', 1): 1, ('bias', None, 2): 1})
+
+    def test_rebuild(self):
+        expected = self._facets()
+        Facet.objects.all().delete()
+        Facet.rebuild()
+        self.assertEqual(self._facets(), expected)
+
+    def test_aggregate_with_counts(self):
+        data = self.client.get('/frames/aggregate/').json()
+        self.assertEqual(data['imagetypes'], ['bias', 'object'])
+        self.assertEqual(data['filters'], ['None', 'clear'])
+        self.assertEqual(data['binnings'], ['1x1', '2x2'])
+        self.assertEqual(data['counts']['imagetypes'], {'bias': 1, 'object': 2})
+        self.assertEqual(data['counts']['sites'], {'site1': 3})
+
+    def test_aggregate_is_served_from_facets(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get('/frames/aggregate/', {'IMAGETYPE': 'object'}).json()
+        self.assertEqual(data['counts']['filters'], {'clear': 2})
+        self.assertFalse([q for q in ctx.captured_queries if 'api_frame' in q['sql']])
+
+    def test_aggregate_falls_back_to_frames(self):
+        data = self.client.get('/frames/aggregate/', {'OBJECT': 'M42'}).json()
+        self.assertEqual(data['counts']['imagetypes'], {'object': 1})
+        self.assertEqual(data['binnings'], ['1x1'])
+
+
+class ConeSearchTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        for name, ra, dec in [('centre', 10.0, 41.0), ('near', 10.0, 41.0 + 5. / 60.),
+                              ('far', 10.0, 41.0 + 20. / 60.), ('pole', 123.0, 89.99)]:
+            frame = Frame()
+            frame.add_fits_header(_header(FNAME=name, **{'TEL-RA': ra, 'TEL-DEC': dec}))
+            frame.path = 'p'
+            frame.save()
+
+    def _search(self, **params):
+        data = self.client.get('/frames/', params).json()
+        return sorted(r['basename'] for r in data['results'])
+
+    def test_add_fits_header_sets_trixel(self):
+        frame = Frame.objects.get(basename='centre')
+        self.assertEqual(frame.htm, htm.lookup(10.0, 41.0))
+
+    def test_default_radius_is_ten_arcmin(self):
+        self.assertEqual(self._search(RA='10.0', DEC='41.0'), ['centre', 'near'])
+
+    def test_radius(self):
+        self.assertEqual(self._search(RA='10.0', DEC='41.0', radius='0.5'), ['centre', 'far', 'near'])
+        self.assertEqual(self._search(RA='10.0', DEC='41.0', radius='0.01'), ['centre'])
+
+    def test_cone_around_pole(self):
+        self.assertEqual(self._search(RA='300.0', DEC='90.0', radius='0.1'), ['pole'])
+
+    def test_invalid_radius(self):
+        self.assertEqual(self.client.get('/frames/', {'RA': '10', 'DEC': '41', 'radius': '120'}).status_code, 400)
+
+    def test_cover_contains_positions_in_cone(self):
+        ranges = htm.cover(10.0, 41.0, 0.2)
+        for dec in (40.81, 40.9, 41.0, 41.1, 41.19):
+            trixel = htm.lookup(10.0, dec)
+            self.assertTrue(any(first <= trixel <= last for first, last in ranges))
+        trixel = htm.lookup(10.0, 41.5)
+        self.assertFalse(any(first <= trixel <= last for first, last in ranges))
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        for basename, obj in [('frame_a', 'M31'), ('frame_b', 'NGC 224'), ('frame_c', 'HD 224801'),
+                              ('bias_d', None)]:
+            Frame.objects.create(
+                basename=basename, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+                IMAGETYP='object', DATE_OBS='2024-01-15T10:00:00Z', night='2024-01-15',
+                OBJECT=obj, EXPTIME=30.0, FILTER='clear', RLEVEL=0,
+                XBINNING=1, YBINNING=1, width=100, height=100,
+            )
+
+    def _filtered(self, **params):
+        request = self.factory.get('/frames/', params)
+        return sorted(f.basename for f in filter_frames(Frame.objects.all(), request))
+
+    def test_substring_uses_index(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._filtered(OBJECT='224'), ['frame_b', 'frame_c'])
+        if connection.vendor == 'sqlite':
+            self.assertIn('MATCH', ctx.captured_queries[-1]['sql'])
+
+    def test_short_substring(self):
+        self.assertEqual(self._filtered(OBJECT='m3'), ['frame_a'])
+
+    def test_prefix(self):
+        self.assertEqual(self._filtered(OBJECT='ngc', match='prefix'), ['frame_b'])
+        self.assertEqual(self._filtered(OBJECT='224', match='prefix'), [])
+        self.assertEqual(self._filtered(basename='frame', match='prefix'), ['frame_a', 'frame_b', 'frame_c'])
+
+    def test_index_follows_updates_and_deletes(self):
+        Frame.objects.filter(basename='frame_a').update(OBJECT='NGC 1234')
+        Frame.objects.filter(basename='frame_b').delete()
+        self.assertEqual(self._filtered(OBJECT='ngc'), ['frame_a'])
+
+    def test_quotes_in_search(self):
+        self.assertEqual(self._filtered(OBJECT='"224'), [])
+
+    def test_invalid_match(self):
+        with self.assertRaises(ParseError):
+            self._filtered(OBJECT='m31', match='fuzzy')
+
+
+@override_settings(COUNT_CACHE_TIMEOUT=300, RESPONSE_CACHE_TIMEOUT=300)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self.bias = self._create('bias', IMAGETYP='bias')
+        self.frame = self._create('frame', IMAGETYP='object')
+        self.frame.related.set([self.bias])
+
+    def _create(self, basename, **kwargs):
+        return Frame.objects.create(
+            basename=basename, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+            DATE_OBS='2024-01-15T10:00:00Z', night='2024-01-15', OBJECT='M31', EXPTIME=30.0, FILTER='clear',
+            RLEVEL=0, XBINNING=1, YBINNING=1, width=100, height=100, **kwargs
+        )
+
+    def test_list_is_cached_until_ingest(self):
+        self.assertEqual(self.client.get('/frames/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get('/frames/', {'SITE': 'ALL'})['X-Cache'], 'HIT')
+        self._create('new', IMAGETYP='object')
+        response = self.client.get('/frames/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['count'], 3)
+
+    def test_frame_is_only_invalidated_by_its_own_changes(self):
+        url = '/frames/%d/' % self.frame.id
+        self.client.get(url)
+        self._create('new', IMAGETYP='object')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        self.frame.OBJECT = 'M42'
+        self.frame.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['OBJECT'], 'M42')
+
+    def test_related_is_invalidated_by_changes_of_related_frame(self):
+        url = '/frames/%d/related/' % self.frame.id
+        self.client.get(url)
+        self.bias.EXPTIME = 1.0
+        self.bias.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()[0]['EXPTIME'], 1.0)
+
+    def test_related_is_invalidated_by_new_links(self):
+        url = '/frames/%d/' % self.frame.id
+        self.client.get(url)
+        dark = self._create('dark', IMAGETYP='dark')
+        self.frame.related.add(dark)
+        self.assertEqual(len(self.client.get(url).json()['related_frames']), 2)
+
+    def test_stats_require_admin(self):
+        self.assertEqual(self.client.get('/frames/cache/').status_code, 403)
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        self.client.get('/frames/aggregate/')
+        stats = self.client.get('/frames/cache/').json()
+        self.assertGreaterEqual(stats['aggregate']['misses'], 1)
+
+
+class DownloadTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self.archive_root = tempfile.mkdtemp()
+        self.frame = Frame.objects.create(
+            basename='frame', path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1', IMAGETYP='object',
+            DATE_OBS='2024-01-15T10:00:00Z', night='2024-01-15', EXPTIME=30.0, width=100, height=100)
+        os.makedirs(os.path.join(self.archive_root, 'p'))
+        self.data = bytes(range(256)) * 40
+        with open(os.path.join(self.archive_root, 'p', 'frame.fits.fz'), 'wb') as f:
+            f.write(self.data)
+        self.url = '/frames/%d/download/' % self.frame.id
+
+    def _get(self, method='get', **headers):
+        with self.settings(ARCHIVE_ROOT=self.archive_root):
+            return getattr(self.client, method)(self.url, headers=headers)
+
+    def test_whole_file_is_streamed(self):
+        response = self._get()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="frame.fits.fz"')
+
+    def test_range(self):
+        response = self._get(Range='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/%d' % len(self.data))
+        self.assertEqual(response['Content-Length'], '100')
+
+        # resume from offset
+        response = self._get(Range='bytes=10000-')
+        self.assertEqual(b''.join(response.streaming_content), self.data[10000:])
+
+    def test_unsatisfiable_and_ignored_ranges(self):
+        response = self._get(Range='bytes=%d-' % len(self.data))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % len(self.data))
+        self.assertEqual(self._get(Range='bytes=0-1,5-6').status_code, 200)
+        self.assertEqual(self._get(Range='bytes=0-1', **{'If-Range': '"other"'}).status_code, 200)
+
+    def test_head(self):
+        response = self._get('head')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+
+    def test_web_server_backends(self):
+        with self.settings(SENDFILE_BACKEND='nginx', SENDFILE_URL='/protected/'):
+            response = self._get()
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/p/frame.fits.fz')
+        self.assertEqual(response.content, b'')
+        with self.settings(SENDFILE_BACKEND='xsendfile'):
+            response = self._get()
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.archive_root, 'p', 'frame.fits.fz'))
+
+    def test_missing_file(self):
+        os.remove(os.path.join(self.archive_root, 'p', 'frame.fits.fz'))
+        self.assertEqual(self._get().status_code, 404)
+
+    def test_validators(self):
+        response = self._get()
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(response['Last-Modified'], http_date(os.path.getmtime(
+            os.path.join(self.archive_root, 'p', 'frame.fits.fz'))))
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+
+        # unchanged
+        response = self._get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertEqual(self._get(**{'If-Modified-Since': response['Last-Modified']}).status_code, 304)
+
+        # resume only if file is unchanged
+        self.assertEqual(self._get(Range='bytes=0-1', **{'If-Range': etag}).status_code, 206)
+        self.assertEqual(self._get(Range='bytes=0-1', **{'If-Range': response['Last-Modified']}).status_code, 206)
+
+        # new checksum, e.g. after a re-ingest
+        self.frame.checksum = 'abc'
+        self.frame.save()
+        self.assertEqual(self._get(**{'If-None-Match': etag}).status_code, 200)
+        self.assertEqual(self._get(Range='bytes=0-1', **{'If-Range': etag}).status_code, 200)
+
+    def test_not_modified_without_opening_file(self):
+        # file is no FITS file, so would fail to open
+        etag = self._get()['ETag']
+        for view in ['headers', 'preview', 'catalog']:
+            with self.settings(ARCHIVE_ROOT=self.archive_root):
+                response = self.client.get('/frames/%d/%s/' % (self.frame.id, view), headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-2000', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-2000', 1000), (0, 999))
+        self.assertIsNone(parse_range('bytes=1000-', 1000))
+        self.assertFalse(parse_range('bytes=5-1', 1000))
+        self.assertFalse(parse_range('items=0-1', 1000))
+
+
+class PreviewTests(TestCase):
+    def test_cuts(self):
+        data = np.arange(1000 * 1000, dtype=np.float32).reshape(1000, 1000)
+        vmin, vmax = preview.cuts(data)
+        self.assertAlmostEqual(vmin / data.size, 0.05, places=2)
+        self.assertAlmostEqual(vmax / data.size, 0.95, places=2)
+
+        # zscale, ignoring non-finite values
+        data[0, :] = np.nan
+        vmin, vmax = preview.cuts(data, 'zscale')
+        self.assertTrue(np.isfinite(vmin) and np.isfinite(vmax) and vmin < vmax)
+        with self.assertRaises(ValueError):
+            preview.cuts(data, 'minmax')
+
+    def test_downsample(self):
+        data = np.arange(12 * 8, dtype=np.uint16).reshape(8, 12)
+        small = preview.downsample(data, 6)
+        self.assertEqual(small.shape, (4, 6))
+        self.assertEqual(small[0, 0], data[:2, :2].mean())
+
+        # not an integer factor
+        self.assertEqual(preview.downsample(np.zeros((4096, 4000)), 200).shape, (205, 200))
+
+    def test_png(self):
+        image = np.arange(6, dtype=np.uint8).reshape(2, 3)
+        png = preview.encode_png(image)
+        self.assertTrue(png.startswith(b'\x89PNG\r\n\x1a\n'))
+        self.assertEqual(png[16:24], b'\x00\x00\x00\x03\x00\x00\x00\x02')
+        idat = png[png.index(b'IDAT') + 4:png.index(b'IEND') - 8]
+        self.assertEqual(zlib.decompress(idat), b'\x00\x00\x01\x02\x00\x03\x04\x05')
+
+    def test_view(self):
+        self.client.force_login(User.objects.create(username='user'))
+        archive_root = tempfile.mkdtemp()
+        frame = Frame.objects.create(
+            basename='frame', path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1', IMAGETYP='object',
+            DATE_OBS='2024-01-15T10:00:00Z', night='2024-01-15', EXPTIME=30.0, width=1000, height=500)
+        os.makedirs(os.path.join(archive_root, 'p'))
+        sci = fits.ImageHDU(np.random.default_rng(0).normal(1000., 10., (500, 1000)), name='SCI')
+        sci.header['TRIMSEC'] = '[1:800,1:400]'
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(os.path.join(archive_root, 'p', 'frame.fits.fz'))
+
+        with self.settings(ARCHIVE_ROOT=archive_root):
+            response = self.client.get('/frames/%d/preview/' % frame.id, {'cuts': 'zscale'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertEqual(struct.unpack('>II', response.content[16:24]), (200, 100))
+            self.assertEqual(self.client.get('/frames/%d/preview/' % frame.id, {'cuts': 'x'}).status_code, 400)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self.bias = Frame.objects.create(
+            basename='bias', path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+            IMAGETYP='bias', DATE_OBS='2024-01-15T09:00:00Z', night='2024-01-15',
+            EXPTIME=0.0, RLEVEL=1, XBINNING=1, YBINNING=1, width=100, height=100,
+        )
+        for i in range(5):
+            frame = Frame.objects.create(
+                basename='frame_%d' % i, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+                IMAGETYP='object', DATE_OBS='2024-01-15T10:0%d:00Z' % i, night='2024-01-15',
+                OBJECT='M31', EXPTIME=30.0, FILTER='clear', RLEVEL=1,
+                XBINNING=2, YBINNING=2, width=100, height=100,
+            )
+            frame.related.set([self.bias])
+
+    def test_ndjson_matches_list(self):
+        response = self.client.get('/frames/export/', {'IMAGETYPE': 'object', 'order': 'desc'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        expected = self.client.get('/frames/', {'IMAGETYPE': 'object', 'order': 'desc'}).json()['results']
+        self.assertEqual(rows, expected)
+
+    def test_ndjson_in_chunks(self):
+        infos = list(Frame.iter_infos(Frame.objects.order_by('id'), chunk_size=2))
+        self.assertEqual(infos, Frame.get_infos(Frame.objects.order_by('id')))
+
+    def test_csv(self):
+        response = self.client.get('/frames/export/', {'format': 'csv'})
+        lines = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(lines[0][:2], ['id', 'basename'])
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(lines[-1][lines[0].index('related_frames')], str(self.bias.id))
+
+    def test_invalid_format(self):
+        self.assertEqual(self.client.get('/frames/export/', {'format': 'xls'}).status_code, 400)
+
+    def _export(self, fmt, **params):
+        response = self.client.get('/frames/export/', {'format': fmt, **params})
+        self.assertEqual(response.status_code, 200)
+        return io.BytesIO(b''.join(response.streaming_content))
+
+    def test_fits_table(self):
+        with fits.open(self._export('fits', order='desc')) as hdus:
+            table = Table(hdus[1].data)
+        self.assertEqual(len(table), 6)
+        self.assertEqual(list(table['basename']), ['frame_4', 'frame_3', 'frame_2', 'frame_1', 'frame_0', 'bias'])
+        self.assertEqual(table['DATE_OBS'][0], '2024-01-15T10:04:00Z')
+        self.assertEqual(table['EXPTIME'].dtype.kind, 'f')
+        self.assertTrue(np.isnan(table['TEL_RA'][0]))
+
+    def test_fits_chunks_are_padded_to_counted_rows(self):
+        from pyobs_archive.api.export import fits_blocks
+        blocks = b''.join(fits_blocks(Frame.objects.order_by('id'), chunk_size=4))
+        self.assertEqual(len(blocks) % 2880, 0)
+        with fits.open(io.BytesIO(blocks)) as hdus:
+            self.assertEqual(list(hdus[1].data['basename'])[-2:], ['frame_3', 'frame_4'])
+
+    def test_dates_match_list(self):
+        Frame.objects.filter(basename='bias').update(DATE_OBS=datetime.datetime(2024, 1, 15, 9, 0, 0, 123456,
+                                                                                tzinfo=datetime.timezone.utc))
+        info = self.client.get('/frames/', {'IMAGETYPE': 'bias'}).json()['results'][0]
+        self.assertEqual(info['DATE_OBS'], '2024-01-15T09:00:00.123Z')
+
+        # ndjson and csv
+        lines = b''.join(self._export('ndjson', IMAGETYPE='bias')).decode().splitlines()
+        self.assertEqual(json.loads(lines[0])['DATE_OBS'], info['DATE_OBS'])
+        lines = list(csv.reader(b''.join(self._export('csv', IMAGETYPE='bias')).decode().splitlines()))
+        self.assertEqual(dict(zip(*lines))['DATE_OBS'], info['DATE_OBS'])
+
+        # fits
+        with fits.open(self._export('fits', IMAGETYPE='bias')) as hdus:
+            row = hdus[1].data[0]
+            self.assertEqual((row['DATE_OBS'], row['night']), (info['DATE_OBS'], '2024-01-15'))
+
+    @skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow not installed')
+    def test_parquet_and_arrow(self):
+        import pyarrow.ipc
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(self._export('parquet'))
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(table.column('basename')[0].as_py(), 'bias')
+        self.assertIsNone(table.column('OBJECT')[0].as_py())
+        table = pyarrow.ipc.open_stream(self._export('arrow')).read_all()
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(str(table.schema.field('DATE_OBS').type), 'timestamp[ms, tz=UTC]')
+
+
 class FrameIngestPathSafetyTests(TestCase):
     def setUp(self):
         self.archive_root = tempfile.mkdtemp()
@@ -211,3 +914,691 @@ class FrameIngestPathSafetyTests(TestCase):
                             FILENAME_FORMATTER='{FNAME}'):
             with self.assertRaises(ValueError):
                 Frame.ingest(filename)
+
+
+class FrameIngestTests(TestCase):
+    def setUp(self):
+        self.archive_root = tempfile.mkdtemp()
+        self.data = np.arange(10000, dtype=np.int16).reshape((100, 100))
+        self.filename = tempfile.NamedTemporaryFile(suffix='.fits', delete=False).name
+        self._write(self.data)
+
+    def _write(self, data, **header):
+        sci = fits.ImageHDU(data, header=_header(NAXIS1=None, NAXIS2=None, **header), name='SCI')
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(self.filename, overwrite=True)
+
+    def _fake_fpack(self, script):
+        # shell script that replaces fpack
+        filename = os.path.join(self.archive_root, 'fpack.sh')
+        with open(filename, 'w') as f:
+            f.write('#!/bin/sh\n' + script + '\n')
+        os.chmod(filename, 0o755)
+        return filename
+
+    def _ingest(self, **settings):
+        with self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                           **settings):
+            return Frame.ingest(self.filename)
+
+    def test_ingest_with_astropy(self):
+        self.assertEqual(self._ingest(COMPRESSOR='astropy'), 'test_frame')
+        with fits.open(os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz')) as f:
+            self.assertIsInstance(f['SCI'], fits.CompImageHDU)
+            self.assertEqual(f['SCI'].compression_type, 'RICE_1')
+            np.testing.assert_array_equal(f['SCI'].data, self.data)
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, 'iag')), ['test_frame.fits.fz'])
+        self.assertEqual(Frame.objects.get().path, 'iag/')
+
+    def test_compression_tiles(self):
+        self._ingest(COMPRESSOR='astropy', COMPRESSION_TILE='50,25')
+        with fits.open(os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz'),
+                       disable_image_compression=True) as f:
+            self.assertEqual((f['SCI'].header['ZTILE1'], f['SCI'].header['ZTILE2']), (50, 25))
+
+    def test_ingest_streams_through_fpack(self):
+        # "fpack" that just copies its input
+        self._ingest(COMPRESSOR='fpack', FPACK_BINARY=self._fake_fpack('cat'))
+        with fits.open(os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz')) as f:
+            np.testing.assert_array_equal(f['SCI'].data, self.data)
+
+    def test_failed_compression_leaves_nothing(self):
+        with self.assertRaises(ValueError):
+            self._ingest(COMPRESSOR='fpack', FPACK_BINARY=self._fake_fpack('cat > /dev/null; exit 1'))
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, 'iag')), [])
+        self.assertFalse(Frame.objects.exists())
+
+    def test_existing_file_is_kept_on_failure(self):
+        self._ingest(COMPRESSOR='astropy')
+        self._write(self.data + 1)
+        with self.assertRaises(ValueError):
+            self._ingest(COMPRESSOR='fpack', FPACK_BINARY=os.path.join(self.archive_root, 'missing'))
+        with self.settings(ARCHIVE_ROOT=self.archive_root):
+            self.assertTrue(Frame.objects.get().check_file())
+
+    def test_invalid_header_is_rejected_before_reading_data(self):
+        # cut off data, which would fail on reading it
+        self._write(self.data, **{'DATE-OBS': None})
+        with open(self.filename, 'r+b') as f:
+            f.truncate(2880 * 3)
+        with self.assertRaisesRegex(ValueError, 'DATE-OBS'):
+            self._ingest(COMPRESSOR='astropy')
+        self.assertFalse(os.path.exists(os.path.join(self.archive_root, 'iag')))
+        self.assertFalse(Frame.objects.exists())
+
+    def test_validate(self):
+        with self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None):
+            self.assertEqual(Frame.validate(self.filename)[:2], ('iag/', 'test_frame'))
+
+            # bad values
+            for header, error in [({'SITEID': '..'}, 'escapes'), ({'EXPTIME': None}, 'EXPTIME'),
+                                  ({'DAY-OBS': 'yesterday'}, 'night'), ({'SITEID': 'x' * 20}, 'SITEID'),
+                                  ({'SITEID': None}, 'SITEID')]:
+                self._write(self.data, **header)
+                with self.subTest(header=header), self.assertRaisesRegex(ValueError, error):
+                    Frame.validate(self.filename)
+
+            # no FITS file at all
+            with open(self.filename, 'wb') as f:
+                f.write(b'junk' * 10000)
+            with self.assertRaisesRegex(ValueError, 'Invalid FITS file'):
+                Frame.validate(self.filename)
+
+    def test_checksums_are_stored(self):
+        self._ingest(COMPRESSOR='astropy')
+        frame = Frame.objects.get()
+        self.assertEqual(len(frame.checksum), 64)
+        self.assertEqual(len(frame.header_checksum), 64)
+        self.assertEqual(frame.filesize, os.path.getsize(os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz')))
+
+    def test_unchanged_file_is_not_compressed_again(self):
+        self._ingest(COMPRESSOR='astropy')
+        mtime = os.path.getmtime(os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz'))
+
+        # a failing fpack would raise, if it was called
+        failing = self._fake_fpack('cat > /dev/null; exit 1')
+        self.assertEqual(self._ingest(COMPRESSOR='fpack', FPACK_BINARY=failing), 'test_frame')
+        self.assertEqual(os.path.getmtime(os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz')), mtime)
+
+    def test_changed_header_is_written_without_compressing(self):
+        self._ingest(COMPRESSOR='astropy')
+        old = Frame.objects.get()
+
+        # change header only and ingest with a failing fpack
+        self._write(self.data, OBJECT='M42')
+        self._ingest(COMPRESSOR='fpack', FPACK_BINARY=self._fake_fpack('cat > /dev/null; exit 1'))
+
+        # database is updated
+        frame = Frame.objects.get()
+        self.assertEqual(frame.OBJECT, 'M42')
+        self.assertEqual(frame.checksum, old.checksum)
+        self.assertNotEqual(frame.header_checksum, old.header_checksum)
+
+        # file has new header and same data
+        filename = os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz')
+        self.assertEqual(frame.filesize, os.path.getsize(filename))
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, 'iag')), ['test_frame.fits.fz'])
+        with fits.open(filename) as f:
+            self.assertIsInstance(f['SCI'], fits.CompImageHDU)
+            self.assertEqual(f['SCI'].header['OBJECT'], 'M42')
+            np.testing.assert_array_equal(f['SCI'].data, self.data)
+
+    def test_changed_header_keeps_scaling(self):
+        # unsigned and scaled integers, with a blank value
+        unsigned = (np.arange(10000, dtype=np.uint32) * 6).astype(np.uint16).reshape((100, 100))
+        scaled = fits.ImageHDU(np.arange(10000, dtype=np.float64).reshape((100, 100)) * 0.5 + 100.)
+        scaled.scale('int16', bzero=100., bscale=0.5)
+        scaled.header['BLANK'] = -32768
+        for data, header in [(unsigned, {}), (scaled.data, {'BZERO': 100., 'BSCALE': 0.5, 'BLANK': -32768})]:
+            filename = os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz')
+            hdu = fits.ImageHDU(data, header=_header(NAXIS1=None, NAXIS2=None), name='SCI',
+                                do_not_scale_image_data=True)
+            for key, value in header.items():
+                hdu.header[key] = value
+            fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(self.filename, overwrite=True)
+            self._ingest(COMPRESSOR='astropy')
+            with fits.open(filename) as f:
+                expected = f['SCI'].data.copy()
+
+            # change header only
+            hdu.header['OBJECT'] = 'M42'
+            fits.HDUList([fits.PrimaryHDU(), hdu]).writeto(self.filename, overwrite=True)
+            self._ingest(COMPRESSOR='fpack', FPACK_BINARY=self._fake_fpack('cat > /dev/null; exit 1'))
+            with fits.open(filename) as f:
+                self.assertEqual(f['SCI'].header['OBJECT'], 'M42')
+                self.assertEqual(f['SCI'].data.dtype, expected.dtype)
+                np.testing.assert_array_equal(f['SCI'].data, expected)
+
+    def test_missing_file_is_compressed_again(self):
+        self._ingest(COMPRESSOR='astropy')
+        os.remove(os.path.join(self.archive_root, 'iag', 'test_frame.fits.fz'))
+        self._ingest(COMPRESSOR='astropy')
+        with self.settings(ARCHIVE_ROOT=self.archive_root):
+            self.assertTrue(Frame.objects.get().check_file())
+
+
+class BulkIngestTests(TestCase):
+    def setUp(self):
+        self.archive_root = tempfile.mkdtemp()
+        self.input = tempfile.mkdtemp()
+
+    def _write(self, fname, **overrides):
+        header = _header(NAXIS1=None, NAXIS2=None, FNAME=fname, **overrides)
+        sci = fits.ImageHDU(np.zeros((10, 10), dtype=np.int16), header=header, name='SCI')
+        filename = os.path.join(self.input, fname + '.fits')
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(filename, overwrite=True)
+        return filename
+
+    def _ingest(self, filenames, **kwargs):
+        with self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                           COMPRESSOR='astropy'):
+            return bulk_ingest(filenames, **kwargs)
+
+    def _facets(self):
+        return sorted(Facet.objects.values_list(*Facet.FIELDS, 'count'))
+
+    def test_batches_and_links(self):
+        files = [self._write('bias', IMAGETYP='bias'), self._write('raw_0'), self._write('raw_1', FILTER='red'),
+                 self._write('red_0', RLEVEL=1, L1BIAS='bias', L1RAW='raw_0')]
+        stats = self._ingest(files, processes=1, batch_size=3)
+        self.assertEqual((stats['frames'], stats['errors']), (4, []))
+
+        # frames, files and links
+        self.assertEqual(sorted(Frame.objects.values_list('basename', flat=True)), ['bias', 'raw_0', 'raw_1', 'red_0'])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.archive_root, 'iag'))),
+                         ['bias.fits.fz', 'raw_0.fits.fz', 'raw_1.fits.fz', 'red_0.fits.fz'])
+        self.assertEqual(sorted(Frame.objects.get(basename='red_0').related.values_list('basename', flat=True)),
+                         ['bias', 'raw_0'])
+
+        # facets are the same as when rebuilding them
+        facets = self._facets()
+        Facet.rebuild()
+        self.assertEqual(facets, self._facets())
+
+    def test_reingest_updates_frames(self):
+        self._ingest([self._write('raw_0'), self._write('raw_1')], processes=1)
+        stats = self._ingest([self._write('raw_0', FILTER='red')], processes=1)
+        self.assertEqual(stats['frames'], 1)
+        self.assertEqual(Frame.objects.get(basename='raw_0').FILTER, 'red')
+        self.assertEqual(Frame.objects.count(), 2)
+        facets = self._facets()
+        Facet.rebuild()
+        self.assertEqual(facets, self._facets())
+
+    def test_errors_are_reported(self):
+        bad = self._write('bad')
+        with fits.open(bad, mode='update') as f:
+            del f['SCI'].header['DATE-OBS']
+        stats = self._ingest([bad, self._write('good')], processes=1)
+        self.assertEqual(stats['frames'], 1)
+        self.assertEqual([e[0] for e in stats['errors']], [bad])
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, 'iag')), ['good.fits.fz'])
+
+    def test_failed_prepare_removes_compressed_file(self):
+        filename = self._write('raw_0')
+        with self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                           COMPRESSOR='astropy'), mock.patch.object(thumbnails, 'replace', side_effect=OSError('full')):
+            self.assertEqual(prepare(filename), {'filename': filename, 'error': 'full'})
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, 'iag')), [])
+
+    def test_process_pool(self):
+        files = [self._write('raw_%d' % i) for i in range(6)]
+        reports = []
+        stats = self._ingest(files, processes=2, batch_size=4, report=reports.append)
+        self.assertEqual(stats['frames'], 6)
+        self.assertEqual(Frame.objects.count(), 6)
+        self.assertEqual(len(reports), 2)
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self.archive_root = tempfile.mkdtemp()
+        self.filename = tempfile.NamedTemporaryFile(suffix='.fits', delete=False).name
+        self._write(np.arange(300 * 400, dtype=np.int16).reshape((300, 400)))
+
+    def _write(self, data):
+        sci = fits.ImageHDU(data, header=_header(NAXIS1=None, NAXIS2=None), name='SCI')
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(self.filename, overwrite=True)
+
+    def _settings(self, **kwargs):
+        return self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                             COMPRESSOR='astropy', THUMBNAIL_ROOT=None, **kwargs)
+
+    def _cached(self):
+        return sorted(os.listdir(os.path.join(self.archive_root, '.thumbnails', 'iag')))
+
+    def test_rendered_at_ingest(self):
+        with self._settings():
+            Frame.ingest(self.filename)
+            self.assertEqual(self._cached(), ['test_frame.large.png', 'test_frame.medium.png', 'test_frame.small.png'])
+
+            # served from cache
+            frame = Frame.objects.get()
+            response = self.client.get('/frames/%d/preview/' % frame.id, {'size': 'medium'})
+            with open(os.path.join(self.archive_root, '.thumbnails', 'iag', 'test_frame.medium.png'), 'rb') as f:
+                self.assertEqual(response.content, f.read())
+            self.assertEqual(struct.unpack('>II', response.content[16:24]), (400, 300))
+            self.assertEqual(self.client.get('/frames/%d/preview/' % frame.id, {'size': 'huge'}).status_code, 400)
+
+    def test_lazy_and_invalidated(self):
+        with self._settings(THUMBNAIL_INGEST=False):
+            Frame.ingest(self.filename)
+            self.assertFalse(os.path.exists(os.path.join(self.archive_root, '.thumbnails')))
+
+            # rendered on first request
+            frame = Frame.objects.get()
+            self.assertEqual(self.client.get('/frames/%d/preview/' % frame.id).status_code, 200)
+            self.assertEqual(len(self._cached()), 3)
+            self.client.get('/frames/%d/preview/' % frame.id, {'cuts': 'zscale'})
+            self.assertIn('test_frame.small-zscale.png', self._cached())
+
+            # re-ingest with new data
+            self._write(np.zeros((300, 400), dtype=np.int16))
+            Frame.ingest(self.filename)
+            self.assertEqual(self._cached(), [])
+
+            # delete
+            self.client.get('/frames/%d/preview/' % frame.id)
+            Frame.objects.get().delete()
+            self.assertEqual(self._cached(), [])
+
+    def test_evict(self):
+        with self._settings():
+            Frame.ingest(self.filename)
+            files = [os.path.join(self.archive_root, '.thumbnails', 'iag', f) for f in self._cached()]
+            for i, filename in enumerate(files):
+                os.utime(filename, (1000 + i, 1000 + i))
+
+            # large is oldest
+            self.assertEqual(thumbnails.evict(max_size=2 * os.path.getsize(files[2])), 2)
+            self.assertEqual(self._cached(), ['test_frame.small.png'])
+
+    def test_evict_in_background(self):
+        cache.delete(thumbnails.EVICT_KEY)
+        with self._settings(THUMBNAIL_INGEST=False, THUMBNAIL_CACHE_SIZE=1000):
+            Frame.ingest(self.filename)
+            self.client.get('/frames/%d/preview/' % Frame.objects.get().id)
+            timeout = time.time() + 10
+            while 'test_frame.small.png' in self._cached() and time.time() < timeout:
+                time.sleep(0.01)
+            self.assertNotIn('test_frame.small.png', self._cached())
+
+            # no other eviction within the interval
+            self.assertTrue(cache.get(thumbnails.EVICT_KEY))
+
+    def test_backfill(self):
+        with self._settings(THUMBNAIL_INGEST=False):
+            Frame.ingest(self.filename)
+            call_command('thumbnails', processes=1, stdout=io.StringIO())
+            self.assertEqual(len(self._cached()), 3)
+
+
+class TileTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='user'))
+        self.archive_root = tempfile.mkdtemp()
+        self.data = np.random.default_rng(0).integers(0, 1000, (520, 610)).astype(np.int16)
+        filename = tempfile.NamedTemporaryFile(suffix='.fits', delete=False).name
+        sci = fits.ImageHDU(self.data, header=_header(NAXIS1=None, NAXIS2=None, TRIMSEC='[11:610,21:520]'), name='SCI')
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(filename)
+        with self._settings():
+            Frame.ingest(filename)
+        self.frame = Frame.objects.get()
+
+    def _settings(self):
+        return self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                             COMPRESSOR='astropy', COMPRESSION_TILE='64,64', THUMBNAIL_ROOT=None)
+
+    def _get(self, url, **params):
+        with self._settings():
+            return self.client.get('/frames/%d/tiles/%s' % (self.frame.id, url), params)
+
+    def _png(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        width, height = struct.unpack('>II', response.content[16:24])
+        idat = response.content[response.content.index(b'IDAT') + 4:response.content.index(b'IEND') - 8]
+        return np.frombuffer(zlib.decompress(idat), dtype=np.uint8).reshape(height, width + 1)[:, 1:]
+
+    def test_info(self):
+        info = self._get('').json()
+        self.assertEqual((info['width'], info['height'], info['tile_size'], info['levels']), (600, 500, 256, 3))
+        self.assertEqual(info['url'], '/frames/%d/tiles/{z}/{x}/{y}.png' % self.frame.id)
+        self.assertIn('asinh', info['stretches'])
+        self.assertEqual(len(info['cuts']['zscale']), 2)
+
+    def test_tiles(self):
+        # whole image at a quarter of the resolution
+        self.assertEqual(self._png(self._get('0/0/0.png')).shape, (125, 150))
+
+        # tile at full resolution, at the edge of the trimmed image
+        tile = self._png(self._get('2/2/1.png'))
+        vmin, vmax = self._get('').json()['cuts']['percentile']
+        expected = preview.scale(self.data[20 + 256:, 10 + 512:].astype(np.float32), vmin, vmax)
+        np.testing.assert_array_equal(tile, expected)
+
+        # stretch
+        stretched = self._png(self._get('2/2/1.png', stretch='sqrt'))
+        self.assertGreater(stretched.mean(), tile.mean())
+
+        # invalid
+        self.assertEqual(self._get('2/3/0.png').status_code, 404)
+        self.assertEqual(self._get('3/0/0.png').status_code, 404)
+        self.assertEqual(self._get('0/0/0.png', stretch='x').status_code, 400)
+
+    def test_sample(self):
+        data = np.full((512, 512), 30000, dtype=np.int16)
+        data[10:500, 20:510] = np.random.default_rng(0).integers(0, 1000, (490, 490))
+        filename = tempfile.NamedTemporaryFile(suffix='.fits.fz', delete=False).name
+        fits.HDUList([fits.PrimaryHDU(), fits.CompImageHDU(data, name='SCI', tile_shape=(64, 64))]).writeto(
+            filename, overwrite=True)
+
+        # only four tiles are decoded, without any pixels outside of the section
+        with fits.open(filename) as hdus:
+            sample = tiles.sample(hdus['SCI'], slice(10, 500), slice(20, 510), pixels=4 * 64 * 64)
+        self.assertEqual(sample.shape[0], 1)
+        self.assertLessEqual(sample.size, 4 * 64 * 64)
+        self.assertLess(sample.max(), 1000)
+
+    def test_cached_and_removed(self):
+        response = self._get('1/1/0.png', cuts='zscale')
+        directory = os.path.join(self.archive_root, '.thumbnails', 'iag', 'test_frame.tiles')
+        self.assertTrue(os.path.exists(os.path.join(directory, 'zscale-linear', '1', '1', '0.png')))
+        self.assertEqual(self._get('1/1/0.png', cuts='zscale').content, response.content)
+        with self._settings():
+            self.frame.delete()
+        self.assertFalse(os.path.exists(directory))
+
+    def test_evict(self):
+        self._get('0/0/0.png')
+        directory = os.path.join(self.archive_root, '.thumbnails', 'iag', 'test_frame.tiles')
+        info = os.path.join(directory, 'info.json')
+        os.utime(info, (1000, 1000))
+
+        # info is oldest, so it goes first
+        with self._settings():
+            self.assertEqual(thumbnails.evict(max_size=1), 5)
+        self.assertFalse(os.path.exists(info))
+
+
+class IngestJobTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        self.archive_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(
+            ARCHIVE_ROOT=self.archive_root, INGEST_SPOOL=os.path.join(self.archive_root, '.spool'), INGEST_WORKERS=0,
+            PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None, COMPRESSOR='astropy')
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+    def _upload(self, header):
+        bio = io.BytesIO()
+        sci = fits.ImageHDU(np.zeros((10, 10), dtype=np.int16), header=header, name='SCI')
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(bio)
+        upload = SimpleUploadedFile('upload.fits', bio.getvalue())
+        return self.client.post('/frames/create/', {'file': upload}).json()
+
+    def test_upload_is_queued_and_ingested(self):
+        data = self._upload(_header(NAXIS1=None, NAXIS2=None))
+        self.assertEqual(data['queued'], 1)
+        job_id = data['jobs'][0]['id']
+
+        # nothing ingested yet
+        status = self.client.get('/frames/jobs/%d/' % job_id).json()
+        self.assertEqual((status['status'], status['position']), ('queued', 0))
+        self.assertFalse(Frame.objects.exists())
+
+        # run worker
+        self.assertEqual(run_pending(), 1)
+        status = self.client.get('/frames/jobs/%d/' % job_id).json()
+        self.assertEqual((status['status'], status['basename']), ('done', 'test_frame'))
+        self.assertTrue(Frame.objects.filter(basename='test_frame').exists())
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, '.spool')), [])
+
+    def test_failed_job_reports_error(self):
+        job_id = self._upload(_header(NAXIS1=None, NAXIS2=None))['jobs'][0]['id']
+        with self.settings(COMPRESSOR='fpack', FPACK_BINARY=os.path.join(self.archive_root, 'missing')):
+            run_pending()
+        status = self.client.get('/frames/jobs/%d/' % job_id).json()
+        self.assertEqual(status['status'], 'failed')
+        self.assertIn('fpack', status['error'])
+
+    def test_invalid_upload_is_rejected(self):
+        data = self._upload(_header(NAXIS1=None, NAXIS2=None, **{'DATE-OBS': None}))
+        self.assertEqual(data['queued'], 0)
+        self.assertIn('DATE-OBS', data['errors'][0])
+        self.assertFalse(IngestJob.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, '.spool')), [])
+
+    def test_stale_jobs_are_requeued(self):
+        job = IngestJob.objects.create(filename='a.fits', spool='/nonexistent', status=IngestJob.RUNNING,
+                                       started=timezone.now() - datetime.timedelta(days=1))
+        self.assertEqual(IngestJob.claim().id, job.id)
+        self.assertIsNone(IngestJob.claim())
+
+    def test_status_requires_admin(self):
+        job = IngestJob.objects.create(filename='a.fits', spool='/nonexistent')
+        self.client.force_login(User.objects.create(username='user'))
+        self.assertEqual(self.client.get('/frames/jobs/%d/' % job.id).status_code, 403)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create(username='admin', is_staff=True))
+        self.archive_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(
+            ARCHIVE_ROOT=self.archive_root, INGEST_SPOOL=os.path.join(self.archive_root, '.spool'), INGEST_WORKERS=0,
+            PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None, COMPRESSOR='astropy')
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        # FITS file to upload
+        bio = io.BytesIO()
+        sci = fits.ImageHDU(np.arange(10000, dtype=np.int16).reshape((100, 100)),
+                            header=_header(NAXIS1=None, NAXIS2=None), name='SCI')
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(bio)
+        self.data = bio.getvalue()
+
+    def _initiate(self, **kwargs):
+        params = {'filename': 'upload.fits', 'size': len(self.data), **kwargs}
+        return self.client.post('/frames/uploads/', json.dumps(params), content_type='application/json')
+
+    def _put(self, upload_id, first, last):
+        return self.client.put('/frames/uploads/%d/' % upload_id, self.data[first:last + 1],
+                               content_type='application/octet-stream',
+                               headers={'Content-Range': 'bytes %d-%d/%d' % (first, last, len(self.data))})
+
+    def test_chunks_in_any_order_are_ingested(self):
+        upload = self._initiate().json()
+        self.assertEqual(upload['missing'], [[0, len(self.data)]])
+
+        # send second half first, then first half twice, like a retry
+        half = len(self.data) // 2
+        self.assertEqual(self._put(upload['id'], half, len(self.data) - 1).json()['missing'], [[0, half]])
+        self._put(upload['id'], 0, half - 1)
+        status = self._put(upload['id'], 0, half - 1).json()
+        self.assertEqual((status['received'], status['missing']), ([[0, len(self.data)]], []))
+
+        # finalize and run worker
+        data = self.client.post('/frames/uploads/%d/finalize/' % upload['id']).json()
+        self.assertEqual(data['queued'], 1)
+        self.assertFalse(Upload.objects.exists())
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(IngestJob.objects.get(id=data['jobs'][0]['id']).status, IngestJob.DONE)
+        self.assertTrue(Frame.objects.filter(basename='test_frame').exists())
+        self.assertEqual(os.listdir(os.path.join(self.archive_root, '.spool')), [])
+
+    def test_incomplete_upload_is_not_finalized(self):
+        upload = self._initiate().json()
+        self._put(upload['id'], 0, 99)
+        self.assertEqual(self.client.post('/frames/uploads/%d/finalize/' % upload['id']).status_code, 400)
+        self.assertFalse(IngestJob.objects.exists())
+
+    def test_checksum_is_verified(self):
+        upload = self._initiate(checksum='0' * 64).json()
+        self._put(upload['id'], 0, len(self.data) - 1)
+        response = self.client.post('/frames/uploads/%d/finalize/' % upload['id'])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Checksum', response.json()['detail'])
+
+    def test_invalid_chunks_are_rejected(self):
+        upload_id = self._initiate().json()['id']
+
+        # outside of file
+        response = self.client.put('/frames/uploads/%d/' % upload_id, b'1234', content_type='application/octet-stream',
+                                   headers={'Content-Range': 'bytes %d-%d/*' % (len(self.data), len(self.data) + 3)})
+        self.assertEqual(response.status_code, 400)
+
+        # shorter than announced
+        response = self.client.put('/frames/uploads/%d/' % upload_id, b'12', content_type='application/octet-stream',
+                                   headers={'Content-Range': 'bytes 0-3/*'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Upload.objects.get().received(), [])
+
+        # missing range
+        response = self.client.put('/frames/uploads/%d/' % upload_id, b'12', content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+
+    def test_abort_and_expire(self):
+        upload = Upload.objects.get(id=self._initiate().json()['id'])
+        self.assertEqual(self.client.delete('/frames/uploads/%d/' % upload.id).status_code, 200)
+        self.assertFalse(os.path.exists(upload.spool))
+
+        # uploads without activity are removed
+        upload = Upload.objects.get(id=self._initiate().json()['id'])
+        Upload.objects.filter(id=upload.id).update(updated=timezone.now() - datetime.timedelta(days=2))
+        Upload.expire()
+        self.assertFalse(Upload.objects.exists())
+        self.assertFalse(os.path.exists(upload.spool))
+
+
+class RelatedLinkTests(TestCase):
+    def _create(self, basename):
+        return Frame.objects.create(
+            basename=basename, path='p', SITEID='site1', TELID='tel1', INSTRUME='inst1',
+            IMAGETYP='object', DATE_OBS='2024-01-15T10:00:00Z', night='2024-01-15',
+            OBJECT='M31', EXPTIME=30.0, FILTER='clear', RLEVEL=1,
+            XBINNING=1, YBINNING=1, width=100, height=100,
+        )
+
+    def _link(self, frame, **keywords):
+        header = fits.Header()
+        for key, value in keywords.items():
+            header[key] = value
+        frame.link_related(header)
+
+    def _related(self, frame):
+        return sorted(frame.related.values_list('basename', flat=True))
+
+    def test_names_are_resolved_in_single_query(self):
+        for name in ['bias', 'dark', 'flat']:
+            self._create(name)
+        frame = self._create('red')
+        with CaptureQueriesContext(connection) as ctx:
+            self._link(frame, L1BIAS='bias', L1DARK='dark', L1FLAT='flat')
+        self.assertEqual(len([q for q in ctx.captured_queries if 'FROM "api_frame" WHERE' in q['sql']]), 1)
+        self.assertEqual(self._related(frame), ['bias', 'dark', 'flat'])
+
+    def test_missing_frames_are_linked_later(self):
+        self.client.force_login(User.objects.create(username='user'))
+        frame = self._create('red')
+        self._link(frame, L1BIAS='bias', L1RAW='raw')
+        self.assertEqual(sorted(frame.pending_links.values_list('basename', flat=True)), ['bias', 'raw'])
+        self.assertEqual(self.client.get('/frames/%d/related/' % frame.id).json(), [])
+
+        # ingest bias
+        bias = self._create('bias')
+        self._link(bias)
+        self.assertEqual(self._related(frame), ['bias'])
+        self.assertEqual(list(frame.pending_links.values_list('basename', flat=True)), ['raw'])
+        self.assertEqual([r['basename'] for r in self.client.get('/frames/%d/related/' % frame.id).json()],
+                         ['bias'])
+
+    def test_relinking_replaces_pending_links(self):
+        frame = self._create('red')
+        self._link(frame, L1BIAS='bias')
+        self._link(frame, L1BIAS='bias2')
+        self.assertEqual(list(PendingLink.objects.values_list('basename', flat=True)), ['bias2'])
+
+    def test_out_of_order_bulk_ingest(self):
+        archive_root, input_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+        files = []
+        for fname, extra in [('red', {'L1BIAS': 'bias'}), ('bias', {'IMAGETYP': 'bias'})]:
+            sci = fits.ImageHDU(np.zeros((10, 10), dtype=np.int16),
+                                header=_header(NAXIS1=None, NAXIS2=None, FNAME=fname, **extra), name='SCI')
+            files.append(os.path.join(input_dir, fname + '.fits'))
+            fits.HDUList([fits.PrimaryHDU(), sci]).writeto(files[-1])
+        with self.settings(ARCHIVE_ROOT=archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                           COMPRESSOR='astropy'):
+            bulk_ingest(files, processes=1, batch_size=1)
+        self.assertEqual(self._related(Frame.objects.get(basename='red')), ['bias'])
+        self.assertFalse(PendingLink.objects.exists())
+
+
+class IngestDaemonTests(TestCase):
+    def setUp(self):
+        self.archive_root, self.input, self.failed = tempfile.mkdtemp(), tempfile.mkdtemp(), tempfile.mkdtemp()
+
+    def _write(self, fname, **overrides):
+        sci = fits.ImageHDU(np.zeros((10, 10), dtype=np.int16),
+                            header=_header(NAXIS1=None, NAXIS2=None, FNAME=fname, **overrides), name='SCI')
+        filename = os.path.join(self.input, fname + '.fits')
+        fits.HDUList([fits.PrimaryHDU(), sci]).writeto(filename)
+        return filename
+
+    def test_files_are_taken_after_settling(self):
+        watcher = DirectoryWatcher([self.input], settle=0.2, interval=0, inotify=False)
+        path = self._write('raw_0')
+        for name in ['.hidden.fits', 'notes.txt']:
+            open(os.path.join(self.input, name), 'w').close()
+        watcher.wait(0)
+        self.assertEqual(watcher.ready(), [])
+        time.sleep(0.25)
+        self.assertEqual(watcher.ready(), [path])
+        self.assertEqual(watcher.ready(), [])
+
+    def test_inotify(self):
+        watcher = DirectoryWatcher([self.input], settle=0)
+        if not watcher.uses_inotify:
+            self.skipTest('inotify not available')
+        path = self._write('raw_0')
+        watcher.wait(1)
+        self.assertEqual(watcher.ready(), [path])
+        watcher.close()
+
+    def test_daemon_ingests_in_batches(self):
+        files = [self._write('raw_%d' % i) for i in range(3)]
+        bad = self._write('bad', **{'DATE-OBS': None})
+        watcher = DirectoryWatcher([self.input], settle=0, inotify=False)
+        daemon = IngestDaemon(watcher, processes=2, batch_size=2, failed_dir=self.failed)
+        with self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                           COMPRESSOR='astropy'):
+            daemon.start()
+            timeout = time.time() + 30
+            while os.listdir(self.input) and time.time() < timeout:
+                daemon.step(timeout=0.1)
+            daemon.finish()
+
+        self.assertEqual(Frame.objects.count(), 3)
+        self.assertFalse(any(os.path.exists(f) for f in files))
+        self.assertEqual(os.listdir(self.failed), [os.path.basename(bad)])
+
+    def test_daemon_survives_failed_move(self):
+        files = [self._write('raw_%d' % i) for i in range(2)]
+        watcher = DirectoryWatcher([self.input], settle=0, inotify=False)
+        daemon = IngestDaemon(watcher, processes=2, move_to=os.path.join(self.failed, 'missing'))
+        with self.settings(ARCHIVE_ROOT=self.archive_root, PATH_FORMATTER='{SITEID}/', FILENAME_FORMATTER=None,
+                           COMPRESSOR='astropy'):
+            daemon.start()
+            timeout = time.time() + 30
+            while Frame.objects.count() < 2 and time.time() < timeout:
+                daemon.step(timeout=0.1)
+            daemon.finish()
+
+        # frames are stored, files stay in place
+        self.assertEqual(Frame.objects.count(), 2)
+        self.assertTrue(all(os.path.exists(f) for f in files))
+
+    def test_workers_ignore_sigint(self):
+        with create_pool(1) as pool:
+            self.assertEqual(pool.apply(signal.getsignal, (signal.SIGINT,)), signal.SIG_IGN)
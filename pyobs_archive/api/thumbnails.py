@@ -0,0 +1,297 @@
+"""Persistent cache of preview images.
+
+Previews are stored as PNG files in THUMBNAIL_ROOT (.thumbnails in ARCHIVE_ROOT by default), in the same directory
+layout as the archive, with one file per size from THUMBNAIL_SIZES and method for cuts, next to the tiles of the frame,
+see tiles.py. They are written when a frame is ingested or on first request, and removed when a frame is re-ingested or
+deleted. Every hit updates the modification time of a file, so that the least recently used ones can be evicted when
+the cache grows beyond THUMBNAIL_CACHE_SIZE. Eviction walks the whole cache, so it runs in a background thread, and in
+only one process at a time, see EVICT_INTERVAL.
+"""
+
+import glob
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+from astropy.io import fits
+from django.conf import settings
+from django.core.cache import cache
+
+from pyobs_archive.api import preview
+from pyobs_archive.api.utils import fitssec
+
+log = logging.getLogger(__name__)
+
+# seconds for which an eviction in one process keeps all others from evicting, coordinated via the Django cache
+EVICT_INTERVAL = 60
+EVICT_KEY = 'pyobs_archive:thumbnails:evict'
+
+# bytes written by this process since last eviction, and thread that evicts files when woken up
+_written = 0
+_evict = threading.Event()
+_evictor = None
+_lock = threading.Lock()
+
+
+def _root() -> str:
+    # directory of cache
+    return settings.THUMBNAIL_ROOT or os.path.join(settings.ARCHIVE_ROOT, '.thumbnails')
+
+
+def tile_directory(path: str, basename: str) -> str:
+    """Get directory for the tiles of a frame.
+
+    Args:
+        path: Path of frame in archive.
+        basename: Basename of frame.
+
+    Returns:
+        Absolute name of directory.
+    """
+    return os.path.join(_root(), path, basename + '.tiles')
+
+
+def thumbnail_filename(path: str, basename: str, size: str, method: str = 'percentile') -> str:
+    """Get name of file for a preview.
+
+    Args:
+        path: Path of frame in archive.
+        basename: Basename of frame.
+        size: Name of size in THUMBNAIL_SIZES.
+        method: Method for cuts, see preview.cuts().
+
+    Returns:
+        Absolute name of file.
+    """
+    suffix = size if method == 'percentile' else size + '-' + method
+    return os.path.join(_root(), path, '%s.%s.png' % (basename, suffix))
+
+
+def load(filename: str) -> np.ndarray:
+    """Load trimmed image data from a file in the archive.
+
+    Args:
+        filename: Name of file.
+
+    Returns:
+        Image data.
+    """
+    with fits.open(filename) as hdus:
+        return fitssec(hdus['SCI'], 'TRIMSEC')
+
+
+def generate(path: str, basename: str, data: np.ndarray, sizes: list = None, method: str = 'percentile') -> dict:
+    """Render previews of an image and write them into the cache.
+
+    Args:
+        path: Path of frame in archive.
+        basename: Basename of frame.
+        data: Image data.
+        sizes: Names of sizes to render, defaults to all in THUMBNAIL_SIZES.
+        method: Method for cuts, see preview.cuts().
+
+    Returns:
+        Dict with PNG files for all sizes.
+    """
+
+    # cuts only depend on the image, so calculate them once for all sizes
+    vmin, vmax = preview.cuts(data, method)
+    pngs = {}
+    for size in sizes or settings.THUMBNAIL_SIZES.keys():
+        pngs[size] = preview.encode_png(preview.scale(preview.downsample(data, settings.THUMBNAIL_SIZES[size]),
+                                                      vmin, vmax))
+        store(thumbnail_filename(path, basename, size, method), pngs[size])
+    return pngs
+
+
+def read(filename: str) -> bytes:
+    """Read a file from the cache and mark it as used.
+
+    Args:
+        filename: Name of file.
+
+    Returns:
+        Content of file, or None, if it doesn't exist.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+        os.utime(filename)
+        return data
+    except FileNotFoundError:
+        return None
+
+
+def store(filename: str, data: bytes):
+    """Write a file into the cache.
+
+    Args:
+        filename: Name of file.
+        data: Content of file.
+    """
+    global _written
+
+    # write to temporary file first, so that nobody ever reads a partial one
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp = '%s.%s.tmp' % (filename, uuid.uuid4().hex)
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, filename)
+    _written += len(data)
+
+    # evict old files in the background, whenever about 1% of the cache has been written
+    if _written > settings.THUMBNAIL_CACHE_SIZE // 100:
+        _start_evictor()
+        _evict.set()
+
+
+def _start_evictor():
+    global _evictor
+    with _lock:
+        if _evictor is None:
+            _evictor = threading.Thread(target=_run_evictor, name='thumbnail-evictor', daemon=True)
+            _evictor.start()
+
+
+def _run_evictor():
+    global _written
+    while True:
+        _evict.wait()
+        _evict.clear()
+        try:
+            # another process might have evicted just now, which covers the files written here as well
+            if cache.add(EVICT_KEY, True, EVICT_INTERVAL):
+                evict()
+            else:
+                _written = 0
+        except Exception:
+            log.exception('Could not evict previews.')
+
+
+def get(frame, size: str, method: str = 'percentile') -> bytes:
+    """Get a preview from the cache, or render it, if it doesn't exist yet.
+
+    Args:
+        frame: Frame to get preview for.
+        size: Name of size in THUMBNAIL_SIZES.
+        method: Method for cuts, see preview.cuts().
+
+    Returns:
+        PNG file.
+    """
+
+    # cached?
+    png = read(thumbnail_filename(frame.path, frame.basename, size, method))
+    if png is not None:
+        return png
+
+    # decoding the image is the expensive part, so render all default sizes at once
+    data = load(frame.filename)
+    sizes = None if method == 'percentile' else [size]
+    return generate(frame.path, frame.basename, data, sizes, method)[size]
+
+
+def remove(path: str, basename: str):
+    """Remove all previews and tiles of a frame.
+
+    Args:
+        path: Path of frame in archive.
+        basename: Basename of frame.
+    """
+    shutil.rmtree(tile_directory(path, basename), ignore_errors=True)
+    pattern = os.path.join(_root(), path, glob.escape(basename) + '.*.png')
+    for filename in glob.glob(pattern):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+
+def replace(path: str, basename: str, hdu):
+    """Replace all previews of a frame after it has been ingested.
+
+    Args:
+        path: Path of frame in archive.
+        basename: Basename of frame.
+        hdu: SCI HDU of ingested file.
+    """
+    remove(path, basename)
+    if settings.THUMBNAIL_INGEST:
+        # the frame is in the archive already, so a failure here must not fail the ingest
+        try:
+            generate(path, basename, fitssec(hdu, 'TRIMSEC'))
+        except Exception:
+            log.exception('Could not render previews for %s.', basename)
+
+
+def evict(max_size: int = None) -> int:
+    """Remove least recently used previews, tiles and tile infos until the cache is below 90% of its maximum size.
+
+    Args:
+        max_size: Maximum size of cache in bytes, defaults to THUMBNAIL_CACHE_SIZE.
+
+    Returns:
+        Number of removed files.
+    """
+    global _written
+    _written = 0
+    max_size = settings.THUMBNAIL_CACHE_SIZE if max_size is None else max_size
+
+    # collect all files with time of last use and size
+    files = []
+    for root, _, filenames in os.walk(_root()):
+        for name in filenames:
+            # previews, tiles and tile infos, but not temporary files being written
+            if not name.endswith('.png') and name != 'info.json':
+                continue
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+    total = sum(f[1] for f in files)
+    if total <= max_size:
+        return 0
+
+    # remove oldest first
+    removed = 0
+    for _, size, filename in sorted(files):
+        if total <= max_size * 0.9:
+            break
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    log.info('Evicted %d previews from cache.', removed)
+    return removed
+
+
+def backfill(frame: tuple) -> tuple:
+    """Render all missing previews of a frame.
+
+    Runs in a worker process, so it must not access the database.
+
+    Args:
+        frame: Tuple of path, basename and name of file in archive.
+
+    Returns:
+        Tuple of basename and number of rendered previews, or error message.
+    """
+    path, basename, filename = frame
+    try:
+        missing = [size for size in settings.THUMBNAIL_SIZES
+                   if not os.path.exists(thumbnail_filename(path, basename, size))]
+        if missing:
+            generate(path, basename, load(filename), missing)
+        return basename, len(missing)
+    except Exception as e:
+        return basename, str(e)
+
+
+__all__ = ['EVICT_INTERVAL', 'EVICT_KEY', 'backfill', 'evict', 'generate', 'get', 'load', 'read', 'remove', 'replace',
+           'store', 'thumbnail_filename', 'tile_directory']
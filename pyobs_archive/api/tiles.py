@@ -0,0 +1,145 @@
+"""Tile pyramid for browsing images at full resolution.
+
+Level 0 shows the whole trimmed SCI image in a single tile of TILE_SIZE pixels, every further level doubles the
+resolution, and the last one shows the image at full resolution. Tiles are numbered by column and row from the top
+left, like the preview. They are cut from the tile-compressed file with section, so only the compression tiles in view
+are decoded, and are stored in the cache of previews, see thumbnails.py. The cuts, which must be the same for all tiles,
+are calculated from a sample of compression tiles spread over the image.
+"""
+
+import json
+import math
+import os
+
+import numpy as np
+from astropy.io import fits
+
+from pyobs_archive.api import preview, thumbnails
+from pyobs_archive.api.utils import fitssec_slices
+
+# width and height of tiles in pixels
+TILE_SIZE = 256
+
+# approximate maximum number of pixels decoded for calculating cuts
+CUT_PIXELS = 2 * 1024 ** 2
+
+
+def _indices(start: int, stop: int, size: int, count: int) -> list:
+    # indices of count compression tiles of the given size, evenly spread over the range
+    return sorted(set(np.linspace(start // size, (stop - 1) // size, count).round().astype(int).tolist()))
+
+
+def sample(hdu, rows: slice, cols: slice, pixels: int = CUT_PIXELS) -> np.ndarray:
+    """Read a sample of an image for calculating cuts, decoding only some of its compression tiles.
+
+    Args:
+        hdu: HDU to read from, either compressed or not, in which case every row counts as a tile.
+        rows: Slice of rows to sample from.
+        cols: Slice of columns to sample from.
+        pixels: Approximate maximum number of pixels to decode.
+
+    Returns:
+        Pixel values of sample as a single row, so that it can be passed to preview.cuts().
+    """
+
+    # shape of compression tiles, limited to the image
+    tile_shape = getattr(hdu, 'tile_shape', None) or (1, hdu.shape[1])
+    th, tw = min(int(tile_shape[0]), hdu.shape[0]), min(int(tile_shape[1]), hdu.shape[1])
+
+    # number of tiles in both directions, keeping the aspect ratio of the image
+    total_y = (rows.stop - 1) // th - rows.start // th + 1
+    total_x = (cols.stop - 1) // tw - cols.start // tw + 1
+    count = max(1, pixels // (th * tw))
+    nx = min(total_x, max(1, round(math.sqrt(count * total_x / total_y))))
+    ny = min(total_y, max(1, count // nx))
+
+    # read tiles
+    pieces = []
+    for i in _indices(rows.start, rows.stop, th, ny):
+        for j in _indices(cols.start, cols.stop, tw, nx):
+            pieces.append(hdu.section[max(rows.start, i * th):min(rows.stop, (i + 1) * th),
+                                      max(cols.start, j * tw):min(cols.stop, (j + 1) * tw)].ravel())
+    return np.concatenate(pieces)[np.newaxis, :]
+
+
+def info(frame) -> dict:
+    """Get size of image, number of levels and cuts of a frame, which are calculated once and then cached.
+
+    Args:
+        frame: Frame to get info for.
+
+    Returns:
+        Dict with width, height, tile_size, levels and a dict with the cuts for every method in preview.CUTS.
+    """
+
+    # cached?
+    filename = os.path.join(thumbnails.tile_directory(frame.path, frame.basename), 'info.json')
+    data = thumbnails.read(filename)
+    if data is not None:
+        return json.loads(data)
+
+    # size from header, and cuts from a sample, since they must be the same for all tiles
+    with fits.open(frame.filename) as hdus:
+        rows, cols = fitssec_slices(hdus['SCI'], 'TRIMSEC')
+        height, width = rows.stop - rows.start, cols.stop - cols.start
+        data = sample(hdus['SCI'], rows, cols)
+        cuts = {method: preview.cuts(data, method) for method in preview.CUTS}
+
+    # number of levels, so that the last one has the full resolution
+    levels = max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE))) + 1
+
+    # store it
+    result = {'width': width, 'height': height, 'tile_size': TILE_SIZE, 'levels': levels, 'cuts': cuts}
+    thumbnails.store(filename, json.dumps(result).encode())
+    return result
+
+
+def tile(frame, z: int, x: int, y: int, stretch: str = 'linear', method: str = 'percentile') -> bytes:
+    """Get a tile from the cache, or render it, if it doesn't exist yet.
+
+    Args:
+        frame: Frame to get tile for.
+        z: Level of tile, 0 for whole image.
+        x: Column of tile.
+        y: Row of tile.
+        stretch: Name of stretch in preview.STRETCHES.
+        method: Method for cuts, see preview.cuts().
+
+    Returns:
+        PNG file.
+
+    Raises:
+        ValueError: If tile doesn't exist.
+    """
+
+    # cached?
+    filename = os.path.join(thumbnails.tile_directory(frame.path, frame.basename), '%s-%s' % (method, stretch),
+                            str(z), str(x), '%d.png' % y)
+    png = thumbnails.read(filename)
+    if png is not None:
+        return png
+
+    # every pixel of the tile averages factor x factor pixels of the image
+    meta = info(frame)
+    if not 0 <= z < meta['levels']:
+        raise ValueError('Invalid level.')
+    factor = 2 ** (meta['levels'] - 1 - z)
+    span = TILE_SIZE * factor
+    if x < 0 or y < 0 or x * span >= meta['width'] or y * span >= meta['height']:
+        raise ValueError('Invalid tile.')
+
+    # decode only the part of the image in this tile
+    with fits.open(frame.filename) as hdus:
+        hdu = hdus['SCI']
+        rows, cols = fitssec_slices(hdu, 'TRIMSEC')
+        y0, x0 = rows.start + y * span, cols.start + x * span
+        data = hdu.section[y0:min(y0 + span, rows.stop), x0:min(x0 + span, cols.stop)]
+
+    # render and store it
+    vmin, vmax = meta['cuts'][method]
+    png = preview.encode_png(preview.scale(preview.block_average(data, factor), vmin, vmax, stretch))
+    thumbnails.store(filename, png)
+    return png
+
+
+__all__ = ['CUT_PIXELS', 'TILE_SIZE', 'info', 'sample', 'tile']
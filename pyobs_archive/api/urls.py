@@ -10,8 +10,16 @@ urlpatterns = [
     path('<int:frame_id>/headers/', views.headers_view, name='headers'),
     path('<int:frame_id>/preview/', views.preview_view, name='preview'),
     path('<int:frame_id>/catalog/', views.catalog_view, name='catalog'),
+    path('<int:frame_id>/tiles/', views.tiles_view, name='tiles'),
+    path('<int:frame_id>/tiles/<int:z>/<int:x>/<int:y>.png', views.tile_view, name='tile'),
     path('<int:frame_id>/delete/', views.delete_view, name='delete'),
     path('create/', views.create_view, name='create'),
+    path('jobs/<int:job_id>/', views.job_view, name='job'),
+    path('uploads/', views.uploads_view, name='uploads'),
+    path('uploads/<int:upload_id>/', views.upload_view, name='upload'),
+    path('uploads/<int:upload_id>/finalize/', views.upload_finalize_view, name='upload_finalize'),
     path('aggregate/', views.aggregate_view, name='options'),
+    path('cache/', views.cache_view, name='cache'),
+    path('export/', views.export_view, name='export'),
     path('zip/', views.zip_view, name='zip')
 ]
@@ -1,4 +1,7 @@
+import datetime
+import functools
 import logging
+import math
 import re
 from astropy.io.fits import Header
 from astropy.time import Time
@@ -9,6 +12,9 @@ log = logging.getLogger(__name__)
 
 
 class FilenameFormatter:
+    # placeholders in format, like {KEY}, {KEY|method} or {KEY|method:param}
+    PLACEHOLDER = re.compile(r'(\{[\w\d_-]+(?:\|[\w\d_-]+\:?(?:[\w\d_-]+)*)?\})')
+
     def __init__(self, fmt: str, keys: dict = None):
         """Initializes a new filename formatter.
 
@@ -28,6 +34,44 @@ class FilenameFormatter:
             'string': self._format_string
         }
 
+        # compile format into segments
+        self.segments = None if fmt is None else self._compile(fmt)
+
+    def _compile(self, fmt: str) -> list:
+        """Splits a format into literal strings and placeholders.
+
+        Args:
+            fmt: Filename format.
+
+        Returns:
+            List of segments, which are either strings or (key, method, params) tuples for placeholders, where
+            method is None for plain values.
+        """
+        segments = []
+        for i, part in enumerate(self.PLACEHOLDER.split(fmt)):
+            # every other part is a placeholder
+            if i % 2 == 0:
+                if part:
+                    segments.append(part)
+                continue
+
+            # remove curly brackets
+            key = part[1:-1]
+            method = None
+            params = []
+
+            # do we have a pipe in here?
+            if '|' in key:
+                key, method = key.split('|')
+
+            # parameters for method?
+            if method is not None and ':' in method:
+                method, *params = method.split(':')
+
+            # store it
+            segments.append((key, method, params))
+        return segments
+
     def _value(self, hdr: Header, key: str):
         """Returns value for given key.
 
@@ -59,63 +103,25 @@ class FilenameFormatter:
             KeyError: If either keyword could not be found in header or method could not be found.
         """
 
-        # make fmt a list
-        if self.format is None:
+        # no format?
+        if self.segments is None:
             return None
 
-        # create output
-        output = self.format
-
-        # find all placeholders in format
-        placeholders = re.findall('\{[\w\d_-]+(?:\|[\w\d_-]+\:?(?:[\w\d_-]+)*)?\}', self.format)
-        if len(placeholders) == 0:
-            return self.format
-
-        # loop all placeholders
-        for ph in placeholders:
-            # call method and replace
-            output = output.replace(ph, self._format_placeholder(ph, hdr))
+        # format all segments
+        output = []
+        for segment in self.segments:
+            if isinstance(segment, str):
+                output.append(segment)
+            else:
+                key, method, params = segment
+                if method is None:
+                    output.append(self._value(hdr, key))
+                else:
+                    # get function (may raise KeyError) and call it
+                    output.append(self.funcs[method](hdr, key, *params))
 
         # finished
-        return output
-
-    def _format_placeholder(self, placeholder: str, hdr: Header) -> str:
-        """Format a given placeholder.
-
-        Args:
-            placeholder: Placeholder to format.
-            hdr: FITS header to take values from.
-
-        Returns:
-            Formatted placeholder.
-
-        Raises:
-            KeyError: If method or FITS header keyword don't exist.
-        """
-
-        # remove curly brackets
-        key = placeholder[1:-1]
-        method = None
-        params = []
-
-        # do we have a pipe in here?
-        if '|' in key:
-            key, method = key.split('|')
-
-        # parameters for method?
-        if method is not None and ':' in method:
-            method, *params = method.split(':')
-
-        # if no method is given, just replace
-        if method is None:
-            return self._value(hdr, key)
-
-        else:
-            # get function (may raise KeyError)
-            func = self.funcs[method]
-
-            # call method and replace
-            return func(hdr, key, *params)
+        return ''.join(output)
 
     def _format_lower(self, hdr: Header, key: str) -> str:
         """Sets a given string to lowercase.
@@ -141,8 +147,7 @@ class FilenameFormatter:
            Formatted string.
        """
         fmt = '%H' + delimiter + '%M' + delimiter + '%S'
-        date_obs = Time(self._value(hdr, key))
-        return date_obs.datetime.strftime(fmt)
+        return parse_date(self._value(hdr, key)).strftime(fmt)
 
     def _format_date(self, hdr: Header, key: str, delimiter: str = '-') -> str:
         """Formats date using the given delimiter.
@@ -156,8 +161,7 @@ class FilenameFormatter:
             Formatted string.
         """
         fmt = '%Y' + delimiter + '%m' + delimiter + '%d'
-        date_obs = Time(self._value(hdr, key))
-        return date_obs.datetime.strftime(fmt)
+        return parse_date(self._value(hdr, key)).strftime(fmt)
 
     def _format_filter(self, hdr: Header, key: str, image_type: str = 'IMAGETYP', prefix: str = '_') -> str:
         """Formats a filter, prefixed by a given separator, only if the image type requires it.
@@ -192,21 +196,109 @@ class FilenameFormatter:
         return fmt % self._value(hdr, key)
 
 
-def fitssec(hdu, keyword: str = 'TRIMSEC') -> np.ndarray:
-    """Trim an image to TRIMSEC or BIASSEC.
+@functools.lru_cache(maxsize=32)
+def get_formatter(fmt: str) -> FilenameFormatter:
+    """Returns a formatter for the given format, which is compiled only once.
 
     Args:
-        hdu: HDU to take data from.
+        fmt: Filename format.
+
+    Returns:
+        Formatter.
+    """
+    return FilenameFormatter(fmt)
+
+
+def parse_date(value) -> datetime.datetime:
+    """Parses a date from a FITS header, e.g. DATE-OBS.
+
+    ISO 8601 strings, which should be all of them, are parsed directly, anything else is handed to astropy's Time.
+
+    Args:
+        value: Value to parse.
+
+    Returns:
+        Naive datetime in UTC.
+    """
+
+    # fast path
+    if isinstance(value, str):
+        try:
+            dt = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            pass
+        else:
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            return dt
+
+    # everything else
+    return Time(value).to_datetime()
+
+
+def read_header(filename: str, extname: str = 'SCI') -> Header:
+    """Reads the header of an extension in a FITS file without reading any data.
+
+    Only the header blocks are parsed, the data of all HDUs before the extension is skipped by its size given in their
+    headers, so this costs about the same for a tiny and a huge file.
+
+    Args:
+        filename: Name of FITS file.
+        extname: Name of extension.
+
+    Returns:
+        Header of extension.
+
+    Raises:
+        ValueError: If file is not a valid FITS file or extension was not found.
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            # check start of next header, so that junk is rejected without searching it for an END card
+            start = f.read(9)
+            if not start:
+                raise ValueError('Could not find %s extension in FITS file.' % extname)
+            if start != (b'SIMPLE  =' if f.tell() == 9 else b'XTENSION='):
+                raise ValueError('Invalid FITS file.')
+            f.seek(-9, 1)
+
+            # parse it
+            try:
+                header = Header.fromfile(f)
+            except (EOFError, OSError, ValueError) as e:
+                raise ValueError('Invalid FITS header: %s' % (str(e) or 'truncated'))
+
+            # found?
+            if str(header.get('EXTNAME', '')).strip().upper() == extname.upper():
+                return header
+
+            # skip data, see section 4.4.1 of the FITS standard, axes of random groups start at NAXIS2
+            try:
+                axes = [header['NAXIS%d' % i] for i in range(1, header['NAXIS'] + 1)]
+                if header.get('GROUPS', False) and axes and axes[0] == 0:
+                    axes = axes[1:]
+                size = abs(header['BITPIX']) // 8 * header.get('GCOUNT', 1) * \
+                    (header.get('PCOUNT', 0) + (math.prod(axes) if axes else 0))
+            except (KeyError, TypeError) as e:
+                raise ValueError('Invalid FITS header: %s' % e)
+            f.seek((size + 2879) // 2880 * 2880, 1)
+
+
+def fitssec_slices(hdu, keyword: str = 'TRIMSEC') -> tuple:
+    """Get slices for TRIMSEC or BIASSEC of an image, without reading its data.
+
+    Args:
+        hdu: HDU to take header from.
         keyword: Header keyword for section.
 
     Returns:
-        Numpy array with image data.
+        Tuple of slices for rows and columns, covering the whole image if the keyword isn't given.
     """
 
     # keyword not given?
     if keyword not in hdu.header:
-        # return whole data
-        return hdu.data
+        # whole image
+        return slice(0, hdu.shape[0]), slice(0, hdu.shape[1])
 
     # get value of section
     sec = hdu.header[keyword]
@@ -220,8 +312,28 @@ def fitssec(hdu, keyword: str = 'TRIMSEC') -> np.ndarray:
     y0 = int(y[0]) - 1
     y1 = int(y[1])
 
+    # return slices
+    return slice(y0, y1), slice(x0, x1)
+
+
+def fitssec(hdu, keyword: str = 'TRIMSEC') -> np.ndarray:
+    """Trim an image to TRIMSEC or BIASSEC.
+
+    Args:
+        hdu: HDU to take data from.
+        keyword: Header keyword for section.
+
+    Returns:
+        Numpy array with image data.
+    """
+
+    # keyword not given?
+    if keyword not in hdu.header:
+        # return whole data
+        return hdu.data
+
     # return data
-    return hdu.data[y0:y1, x0:x1]
+    return hdu.data[fitssec_slices(hdu, keyword)]
 
 
-__all__ = ['FilenameFormatter', 'fitssec']
+__all__ = ['FilenameFormatter', 'get_formatter', 'parse_date', 'read_header', 'fitssec', 'fitssec_slices']
@@ -1,24 +1,36 @@
+import base64
+import collections
 import io
 import json
 import os
 import logging
 import datetime
+import functools
 import math
+import re
 import time
 
-import numpy as np
 import zipstream
 from astropy.table import Table
 from django.http import HttpResponse, JsonResponse, StreamingHttpResponse, Http404
 from astropy.io import fits
 from django.conf import settings
-from django.db.models import F
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from rest_framework.decorators import permission_classes, api_view
 from rest_framework.exceptions import ParseError
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
-from pyobs_archive.api.models import Frame
-from pyobs_archive.api.utils import fitssec
+from pyobs_archive.api import htm, preview, thumbnails, tiles
+from pyobs_archive.api.cache import cached_count, cached_response, cache_stats
+from pyobs_archive.api.export import FORMATS, export
+from pyobs_archive.api.models import Frame, Facet, IngestJob, Upload
+from pyobs_archive.api.search import SEARCH_FIELDS, SEARCH_MODES, search
+from pyobs_archive.api.serve import file_validators, serve_file
+from pyobs_archive.api.worker import notify, start_workers
 
 log = logging.getLogger(__name__)
 
@@ -38,29 +50,149 @@ def _frame(frame_id):
     return frame, filename
 
 
+def _file_validators(request, frame_id):
+    # ETag and time of last modification of the file of a frame, only determined once per request
+    if not hasattr(request, '_file_validators'):
+        frame, filename = _frame(frame_id)
+        request._file_validators = file_validators(filename, frame.checksum)
+    return request._file_validators
+
+
+def conditional_file(view):
+    """Decorator for views, whose responses only depend on the file of a frame.
+
+    Responses get an ETag, Last-Modified and Cache-Control, and conditional requests are answered with 304 Not
+    Modified from a stat() of the file, before the view even opens it.
+    """
+    conditional = condition(
+        etag_func=lambda request, frame_id, **kwargs: _file_validators(request, frame_id)[0],
+        last_modified_func=lambda request, frame_id, **kwargs: _file_validators(request, frame_id)[1])(view)
+
+    @functools.wraps(view)
+    def wrapper(request, frame_id, **kwargs):
+        # files require authentication, so only private caches may store them
+        response = conditional(request, frame_id, **kwargs)
+        if response.status_code in (200, 206, 304):
+            patch_cache_control(response, private=True, max_age=settings.FILE_CACHE_MAX_AGE)
+        return response
+    return wrapper
+
+
 @api_view(['POST'])
 @permission_classes([IsAdminUser])
 def create_view(request):
-    # loop all incoming files
-    filenames = []
+    # spool all incoming files and queue them for ingest
+    jobs = []
     errors = []
     log.info(f"Received {len(request.FILES)} new file(s).")
     for key in request.FILES:
         try:
-            # ingest frame
-            name = Frame.ingest(request.FILES[key])
-            filenames.append(name)
+            job = IngestJob.enqueue(request.FILES[key])
+            jobs.append({'id': job.id, 'filename': job.filename})
         except Exception as e:
-            log.exception('Could not add image.')
+            log.exception('Could not queue image.')
             errors.append(str(e))
 
+    # make sure that there are workers and wake them up
+    start_workers()
+    notify()
+
     # response
-    res = {'created': len(filenames), 'filenames': filenames}
+    res = {'queued': len(jobs), 'jobs': jobs}
     if errors:
         res['errors'] = list(set(errors))
     return JsonResponse(res)
 
 
+def _upload(upload_id):
+    # get upload
+    try:
+        return Upload.objects.get(id=upload_id)
+    except Upload.DoesNotExist:
+        raise Http404()
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def uploads_view(request):
+    # get parameters
+    try:
+        filename = str(request.data['filename'])
+        size = int(request.data['size'])
+    except (KeyError, TypeError, ValueError):
+        raise ParseError('Parameters filename and size are required.')
+    checksum = request.data.get('checksum') or None
+
+    # start upload
+    try:
+        upload = Upload.initiate(filename, size, checksum.lower() if checksum else None)
+    except ValueError as e:
+        raise ParseError(str(e))
+    log.info('Started upload %d of %s with %d bytes.', upload.id, upload.filename, upload.size)
+    return JsonResponse(upload.get_info())
+
+
+# range of a chunk, like "bytes 0-1048575/52428800", total size may be "*"
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+@permission_classes([IsAdminUser])
+def upload_view(request, upload_id):
+    upload = _upload(upload_id)
+
+    # abort?
+    if request.method == 'DELETE':
+        upload.abort()
+        return HttpResponse()
+
+    # write chunk at its offset
+    if request.method == 'PUT':
+        match = CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+        if match is None:
+            raise ParseError('Content-Range header with "bytes <first>-<last>/<size>" is required.')
+        first, last = int(match.group(1)), int(match.group(2))
+        if last < first or (match.group(3) != '*' and int(match.group(3)) != upload.size):
+            raise ParseError('Invalid Content-Range.')
+        try:
+            upload.write(first, last - first + 1, request.stream)
+        except ValueError as e:
+            raise ParseError(str(e))
+
+    # return status
+    return JsonResponse(upload.get_info())
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def upload_finalize_view(request, upload_id):
+    upload = _upload(upload_id)
+
+    # queue file for ingest
+    try:
+        job = upload.finalize()
+    except ValueError as e:
+        raise ParseError(str(e))
+
+    # make sure that there are workers and wake them up
+    start_workers()
+    notify()
+    return JsonResponse({'queued': 1, 'jobs': [{'id': job.id, 'filename': job.filename}]})
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def job_view(request, job_id):
+    # get job
+    try:
+        job = IngestJob.objects.get(id=job_id)
+    except IngestJob.DoesNotExist:
+        raise Http404()
+
+    # return status
+    return JsonResponse(job.get_info())
+
+
 @api_view(['DELETE'])
 @permission_classes([IsAdminUser])
 def delete_view(request, frame_id):
@@ -91,81 +223,296 @@ def sort_frames(data, request):
     return data.order_by(sort_string, 'id')
 
 
-def filter_frames(data, request):
+def info_fields(request):
+    """Parse the keys to include in the info dicts of frames from a comma-separated fields parameter.
+
+    Args:
+        request: Request with optional fields.
+
+    Returns:
+        List of keys from Frame.INFO_KEYS or None for all.
+    """
+    value = request.GET.get('fields', '').strip()
+    if value == '':
+        return None
+    fields = [f.strip() for f in value.split(',')]
+    invalid = [f for f in fields if f not in Frame.INFO_KEYS]
+    if invalid:
+        raise ParseError('Invalid value for fields: %s.' % ', '.join(invalid))
+    return fields
+
+
+def layout_infos(infos, request):
+    """Return info dicts either as they are or, with format=columns, as one list of values per key.
+
+    Args:
+        infos: List of info dicts from Frame.get_infos().
+        request: Request with optional format.
+
+    Returns:
+        List of info dicts or dict of lists.
+    """
+    fmt = request.GET.get('format', 'rows')
+    if fmt == 'rows':
+        return infos
+    elif fmt == 'columns':
+        fields = info_fields(request)
+        keys = [k for k in Frame.INFO_KEYS if fields is None or k in fields]
+        return {k: [info[k] for info in infos] for k in keys}
+    else:
+        raise ParseError('Invalid value for format.')
+
+
+# request parameters parsed by frame_filters()
+FILTER_PARAMS = ['IMAGETYPE', 'binning', 'SITE', 'TELESCOPE', 'INSTRUMENT', 'FILTER', 'RLEVEL', 'match', 'OBJECT',
+                 'EXPTIME', 'night', 'basename', 'REQNUM', 'OBSNUM', 'start', 'end', 'RA', 'DEC', 'radius']
+
+
+def frame_filters(request):
+    """Parse the filters for a list of frames from a request.
+
+    Args:
+        request: Request to take filters from.
+
+    Returns:
+        Dict of normalized filters, which can be passed to apply_filters() and used as cache key.
+    """
+    filters = {}
+
     # filter
     f = request.GET.get('IMAGETYPE', 'ALL')
     if f not in ['', 'ALL']:
-        data = data.filter(IMAGETYP=f)
+        filters['IMAGETYP'] = f
     f = request.GET.get('binning', 'ALL')
     if f not in ['', 'ALL']:
         b = f.split('x')
-        data = data.filter(XBINNING=float(b[0]), YBINNING=float(b[1]))
+        filters['XBINNING'] = float(b[0])
+        filters['YBINNING'] = float(b[1])
     f = request.GET.get('SITE', 'ALL')
     if f not in ['', 'ALL']:
-        data = data.filter(SITEID=f)
+        filters['SITEID'] = f
     f = request.GET.get('TELESCOPE', 'ALL')
     if f not in ['', 'ALL']:
-        data = data.filter(TELID=f)
+        filters['TELID'] = f
     f = request.GET.get('INSTRUMENT', 'ALL')
     if f not in ['', 'ALL']:
-        data = data.filter(INSTRUME=f)
+        filters['INSTRUME'] = f
     f = request.GET.get('FILTER', 'ALL')
     if f not in ['', 'ALL']:
         if f == 'None':
             f = None
-        data = data.filter(FILTER=f)
+        filters['FILTER'] = f
     f = request.GET.get('RLEVEL', 'ALL')
     if f not in ['', 'ALL']:
-        data = data.filter(RLEVEL=int(f))
+        filters['RLEVEL'] = int(f)
+    match = request.GET.get('match', 'contains')
+    if match not in SEARCH_MODES:
+        raise ParseError('Invalid value for match.')
     f = request.GET.get('OBJECT', '').strip()
     if f != '':
-        data = data.filter(OBJECT__icontains=f)
+        filters['OBJECT__' + SEARCH_MODES[match]] = f
     f = request.GET.get('EXPTIME', '').strip()
     if f != '':
-        data = data.filter(EXPTIME__gte=float(f))
+        filters['EXPTIME__gte'] = float(f)
     f = request.GET.get('night', '').strip()
     if f != '':
-        data = data.filter(night=f)
+        filters['night'] = f
     f = request.GET.get('basename', '').strip()
     if f != '':
-        data = data.filter(basename__icontains=f)
+        filters['basename__' + SEARCH_MODES[match]] = f
     f = request.GET.get('REQNUM', '').strip()
     if f != '':
-        data = data.filter(REQNUM=f)
+        filters['REQNUM'] = f
     f = request.GET.get('OBSNUM', '').strip()
     if f != '':
-        data = data.filter(OBSNUM=f)
+        filters['OBSNUM'] = f
 
     # date
     start = request.GET.get('start', '').strip()
     if len(start) > 0:
-        data = data.filter(DATE_OBS__gte=start)
+        filters['DATE_OBS__gte'] = start
     end = request.GET.get('end', '').strip()
     if len(end) > 0:
-        data = data.filter(DATE_OBS__lte=end)
+        filters['DATE_OBS__lte'] = end
 
-    # position
+    # position, radius in degrees defaults to 10'
     ra, dec = request.GET.get('RA', '').strip(), request.GET.get('DEC', '').strip()
     if ra != '' and dec != '':
-        # calculate vector
-        ra = math.radians(float(ra))
-        dec = math.radians(float(dec))
-        vec_x = math.cos(dec) * math.cos(ra)
-        vec_y = math.cos(dec) * math.sin(ra)
-        vec_z = math.sin(dec)
+        try:
+            radius = float(request.GET.get('radius', '').strip() or 10. / 60.)
+        except ValueError:
+            raise ParseError('Invalid value for radius.')
+        if not 0 < radius < 90:
+            raise ParseError('Radius must be between 0 and 90 degrees.')
+        filters['cone'] = [float(ra), float(dec), radius]
 
-        # calculate dist
-        data = data.annotate(dist=(vec_x - F('vec_x')) ** 2 + (vec_y - F('vec_y')) ** 2 + (vec_z - F('vec_z')) ** 2)
+    # finished
+    return filters
+
+
+def apply_filters(data, filters):
+    """Apply filters from frame_filters() to a list of frames.
+
+    Args:
+        data: QuerySet to filter.
+        filters: Filters from frame_filters().
+
+    Returns:
+        Filtered QuerySet.
+    """
 
-        # apply filter (10' squared = 0.02778 (deg²)
-        data = data.filter(dist__lte=0.02778)
+    # simple lookups
+    lookups = {k: v for k, v in filters.items() if k != 'cone'}
+
+    # substring and prefix search
+    for field in SEARCH_FIELDS:
+        for mode, lookup in SEARCH_MODES.items():
+            if field + '__' + lookup in lookups:
+                data = search(data, field, lookups.pop(field + '__' + lookup), mode)
+
+    # all others
+    data = data.filter(**lookups)
+
+    # position
+    if 'cone' in filters:
+        ra, dec, radius = filters['cone']
+
+        # prefilter on trixels covering the cone, which uses the index on htm
+        trixels = Q()
+        for first, last in htm.cover(ra, dec, radius):
+            trixels |= Q(htm__range=(first, last))
+        data = data.filter(trixels)
+
+        # calculate squared distance between unit vectors
+        vec_x, vec_y, vec_z = htm.vector(ra, dec)
+        dx, dy, dz = vec_x - F('vec_x'), vec_y - F('vec_y'), vec_z - F('vec_z')
+        data = data.annotate(dist=dx * dx + dy * dy + dz * dz)
+
+        # and compare it to the squared chord length for the radius
+        data = data.filter(dist__lte=(2. * math.sin(math.radians(radius) / 2.)) ** 2)
 
     # finished
     return data
 
 
+def filter_frames(data, request):
+    return apply_filters(data, frame_filters(request))
+
+
+def _list_params(request, **kwargs):
+    # normalized filters plus all other parameters, e.g. for sorting and paging
+    filters = frame_filters(request)
+    others = sorted((k, v) for k, v in request.GET.lists() if k not in FILTER_PARAMS)
+    return {'filters': filters, 'others': others}
+
+
+def count_frames(data, filters, request):
+    """Count frames, either exactly using the count cache or, with count=estimate, from the query planner.
+
+    Args:
+        data: Filtered QuerySet to count.
+        filters: Filters from frame_filters() that have been applied to data.
+        request: Request with optional count mode.
+
+    Returns:
+        Tuple of number of frames and whether it is an estimate.
+    """
+
+    # get mode
+    mode = request.GET.get('count', 'exact')
+    if mode not in ('exact', 'estimate'):
+        raise ParseError('Invalid value for count.')
+
+    # estimate?
+    if mode == 'estimate':
+        count = _estimate_count(data)
+        if count is not None:
+            return count, True
+
+    # exact count, cached
+    return cached_count(data, filters), False
+
+
+def _estimate_count(data):
+    # the planner's row estimate is only available on PostgreSQL
+    if connection.vendor != 'postgresql':
+        return None
+
+    # ask the planner
+    sql, params = data.order_by().values('id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+
+    # psycopg2 may or may not have parsed the JSON already
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _encode_cursor(sort, order, value, frame_id):
+    # pack sort key of last row into an opaque string, with times at full precision, since DjangoJSONEncoder cuts
+    # them down to milliseconds, which would sort the cursor before the last row
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        value = value.isoformat()
+    raw = json.dumps([sort, order, value, frame_id], cls=DjangoJSONEncoder)
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    # unpack cursor and convert value back to type of sort field
+    try:
+        sort, order, value, frame_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        field = Frame._meta.get_field(sort)
+        return sort, order, field.to_python(value), int(frame_id)
+    except Exception:
+        raise ParseError('Invalid value for cursor.')
+
+
+def seek_frames(data, request):
+    """Apply keyset pagination to a list of frames sorted by sort_frames().
+
+    Instead of skipping rows with an offset, the cursor from the previous page stores the (sort key, id) pair
+    of its last row, and we continue directly after it, so that every page can be served from the index on the
+    sort field at the same cost.
+
+    Args:
+        data: QuerySet to seek in, sorted by sort_frames().
+        request: Request with an optional cursor.
+
+    Returns:
+        Filtered QuerySet.
+    """
+
+    # get sort field and order, which have been validated by sort_frames() already
+    sort = request.GET.get('sort', default='DATE_OBS')
+    order = request.GET.get('order', default='asc')
+
+    # a NULL in the sort field would break the seek condition
+    field = Frame._meta.get_field(sort)
+    if not getattr(field, 'concrete', False) or field.many_to_many or field.null:
+        raise ParseError('Cannot use cursor with sort field %s.' % sort)
+
+    # first page?
+    cursor = request.GET.get('cursor', '').strip()
+    if cursor == '':
+        return data
+
+    # decode cursor, which must match current sort
+    cursor_sort, cursor_order, value, frame_id = _decode_cursor(cursor)
+    if cursor_sort != sort or cursor_order != order:
+        raise ParseError('Cursor does not match sort and order.')
+
+    # sort_frames() orders by sort field and then by ascending id; the first condition is redundant, but allows
+    # the database to start the index scan at the cursor
+    op = 'gt' if order == 'asc' else 'lt'
+    data = data.filter(**{sort + '__' + op + 'e': value})
+    return data.filter(Q(**{sort + '__' + op: value}) | Q(id__gt=frame_id))
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response('frames', _list_params)
 def frames_view(request):
     # get offset and limit
     try:
@@ -178,85 +525,155 @@ def frames_view(request):
     limit = max(0, min(limit, 1000))
     offset = max(0, offset)
 
+    # get fields to return
+    fields = info_fields(request)
+
     # get response, sorted
     data = sort_frames(Frame.objects, request)
 
     # filter
-    data = filter_frames(data, request)
+    filters = frame_filters(request)
+    data = apply_filters(data, filters)
+
+    # count them
+    count, estimated = count_frames(data, filters, request)
+
+    # keyset pagination?
+    if 'cursor' in request.GET:
+        # get page after cursor
+        page = seek_frames(data, request)[:limit]
+        results = Frame.get_infos(page, fields)
+
+        # cursor for next page, if this one is full
+        next_cursor = None
+        if limit > 0 and len(results) == limit:
+            sort = request.GET.get('sort', default='DATE_OBS')
+            order = request.GET.get('order', default='asc')
+            last_id, value = page.values_list('id', sort)[limit - 1]
+            next_cursor = _encode_cursor(sort, order, value, last_id)
+
+        # return them
+        return JsonResponse({'count': count, 'estimated': estimated, 'results': layout_infos(results, request),
+                             'next': next_cursor})
 
     # get results
-    results = [frame.get_info() for frame in data[int(offset):int(offset) + int(limit)]]
+    results = Frame.get_infos(data[int(offset):int(offset) + int(limit)], fields)
 
     # return them
-    return JsonResponse({'count': data.count(), 'results': results})
+    return JsonResponse({'count': count, 'estimated': estimated, 'results': layout_infos(results, request)})
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response('aggregate', _list_params)
 def aggregate_view(request):
-    # get response
-    data = Frame.objects
+    # get filters
+    filters = frame_filters(request)
+
+    # count frames per value of each option, names of options in response and the fields they are taken from
+    options = {'imagetypes': 'IMAGETYP', 'sites': 'SITEID', 'telescopes': 'TELID', 'instruments': 'INSTRUME',
+               'filters': 'FILTER', 'binnings': ('XBINNING', 'YBINNING')}
+    counts = {name: collections.Counter() for name in options}
+
+    # can the facet table answer this?
+    if set(filters.keys()) <= set(Facet.FIELDS):
+        # sum up facets
+        for row in Facet.objects.filter(**filters).values(*Facet.FIELDS, 'count'):
+            for name, field in options.items():
+                key = tuple(row[f] for f in field) if isinstance(field, tuple) else row[field]
+                counts[name][key] += row['count']
 
-    # filter
-    data = filter_frames(data, request).all()
+    else:
+        # query frames directly
+        data = apply_filters(Frame.objects, filters)
+        for name, field in options.items():
+            fields = field if isinstance(field, tuple) else (field,)
+            for row in data.values(*fields).annotate(count=Count('id')).order_by():
+                key = tuple(row[f] for f in field) if isinstance(field, tuple) else row[field]
+                counts[name][key] += row['count']
+
+    # format binning and remove Nones
+    counts['binnings'] = collections.Counter({'%dx%d' % b: n for b, n in counts['binnings'].items()})
+    filters = collections.Counter()
+    for f, n in counts['filters'].items():
+        filters[f or 'None'] += n
+    counts['filters'] = filters
 
-    # get all options
-    image_types = list(data.values_list('IMAGETYP', flat=True).distinct())
-    sites = list(data.values_list('SITEID', flat=True).distinct())
-    telescopes = list(data.values_list('TELID', flat=True).distinct())
-    instruments = list(data.values_list('INSTRUME', flat=True).distinct())
-    filters = list(data.values_list('FILTER', flat=True).distinct())
-    binning = list(data.values_list('XBINNING', 'YBINNING').distinct())
+    # return all
+    res = {name: sorted(c.keys()) for name, c in counts.items()}
+    res['counts'] = {name: dict(sorted(c.items())) for name, c in counts.items()}
+    return JsonResponse(res)
 
-    # remove Nones
-    filters = [(x or "None") for x in filters]
 
-    # return all
-    return JsonResponse({
-        'imagetypes': sorted(image_types),
-        'sites': sorted(sites),
-        'telescopes': sorted(telescopes),
-        'instruments': sorted(instruments),
-        'filters': sorted(filters),
-        'binnings': sorted(['%dx%d' % b for b in binning])
-    })
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def cache_view(request):
+    # return statistics of response cache
+    return JsonResponse(cache_stats())
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def frame_view(request, frame_id):
-    # get data
-    frame, filename = _frame(frame_id)
-    return JsonResponse(frame.get_info())
+def export_view(request):
+    # get format
+    fmt = request.GET.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        raise ParseError('Invalid value for format.')
+
+    # get frames, sorted and filtered
+    data = filter_frames(sort_frames(Frame.objects, request), request)
+
+    # create and return response
+    content_type, extension = FORMATS[fmt]
+    filename = 'pyobsdata-' + datetime.datetime.now().strftime('%Y%m%d') + '.' + extension
+    response = StreamingHttpResponse(export(data, fmt), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
+    return response
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response('frame')
+def frame_view(request, frame_id):
+    # get data, only the requested fields
+    infos = Frame.get_infos(Frame.objects.filter(id=frame_id), info_fields(request))
+    if not infos:
+        raise Http404()
+    return JsonResponse(infos[0])
+
+
+@api_view(['GET', 'HEAD'])
+@permission_classes([IsAuthenticated])
+@conditional_file
 def download_view(request, frame_id):
     # get frame and filename
     frame, filename = _frame(frame_id)
+    etag, last_modified = _file_validators(request, frame_id)
+    if etag is None:
+        raise Http404()
 
     # send it
-    with open(filename, 'rb') as fh:
-        response = HttpResponse(fh.read(), content_type="image/fits")
-        response.set_cookie('fileDownload', 'true', path='/')
-        response['Content-Disposition'] = 'attachment; filename={}.fits.fz'.format(frame.basename)
-        return response
+    response = serve_file(request, filename, 'image/fits', attachment=frame.basename + '.fits.fz', etag=etag,
+                          last_modified=last_modified)
+    response.set_cookie('fileDownload', 'true', path='/')
+    return response
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@cached_response('related')
 def related_view(request, frame_id):
     # get frame
     frame, filename = _frame(frame_id)
 
     # get all related and return it
-    related = [f.get_info() for f in frame.related.all()]
-    return JsonResponse(related, safe=False)
+    related = Frame.get_infos(frame.related.all(), info_fields(request))
+    return JsonResponse(layout_infos(related, request), safe=False)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_file
 def headers_view(request, frame_id):
     # get frame and filename
     frame, filename = _frame(frame_id)
@@ -271,41 +688,57 @@ def headers_view(request, frame_id):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_file
 def preview_view(request, frame_id):
-    import matplotlib
-    matplotlib.use('Agg')
-    import matplotlib.pyplot as plt
+    # get size and method for cuts
+    size = request.GET.get('size', 'small')
+    if size not in settings.THUMBNAIL_SIZES:
+        raise ParseError('Invalid value for size.')
+    method = request.GET.get('cuts', 'percentile')
+    if method not in preview.CUTS:
+        raise ParseError('Invalid value for cuts.')
 
-    # get frame and filename
+    # get frame
     frame, filename = _frame(frame_id)
 
-    # load data and trim it
-    hdus = fits.open(filename)
-    data = fitssec(hdus['SCI'], 'TRIMSEC')
-    hdus.close()
+    # get preview from cache or render it
+    return HttpResponse(thumbnails.get(frame, size, method), content_type='image/png')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_file
+def tiles_view(request, frame_id):
+    # get frame
+    frame, filename = _frame(frame_id)
 
-    # calculate cuts
-    percent = 95
-    sorted_data = sorted(data.flatten())
-    n = int(len(sorted_data) * (1. - (percent / 100.)))
-    cut = sorted_data[n:-n] if n > 0 else sorted_data
-    vmin, vmax = np.min(cut), np.max(cut)
+    # get info about tile pyramid
+    info = tiles.info(frame)
+    info['url'] = request.path + '{z}/{x}/{y}.png'
+    info['stretches'] = list(preview.STRETCHES.keys())
+    return JsonResponse(info)
 
-    # size
-    width, height = 200, 200 / data.shape[1] * data.shape[0]
 
-    # create figure
-    dpi = 100
-    fig, ax = plt.subplots(figsize=(width / 100, height / 100), dpi=dpi)
-    fig.subplots_adjust(left=0, bottom=0, right=1, top=1)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_file
+def tile_view(request, frame_id, z, x, y):
+    # get stretch and method for cuts
+    stretch = request.GET.get('stretch', 'linear')
+    if stretch not in preview.STRETCHES:
+        raise ParseError('Invalid value for stretch.')
+    method = request.GET.get('cuts', 'percentile')
+    if method not in preview.CUTS:
+        raise ParseError('Invalid value for cuts.')
 
-    # draw image
-    ax.imshow(data, vmin=vmin, vmax=vmax, cmap='Greys_r')
+    # get frame
+    frame, filename = _frame(frame_id)
 
-    # write to buffer and return it
-    with io.BytesIO() as bio:
-        fig.savefig(bio, format='png')
-        return HttpResponse(bio.getvalue(), content_type="image/png")
+    # get tile from cache or render it
+    try:
+        return HttpResponse(tiles.tile(frame, z, x, y, stretch, method), content_type='image/png')
+    except ValueError:
+        raise Http404()
 
 
 @permission_classes([IsAuthenticated])
@@ -377,6 +810,7 @@ def _download_zip(request, frames):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_file
 def catalog_view(request, frame_id):
     # get frame and filename
     frame, filename = _frame(frame_id)
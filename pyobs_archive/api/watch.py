@@ -0,0 +1,356 @@
+"""Daemon that ingests files dropped into local directories.
+
+New files are detected with inotify on Linux, or by polling the directories elsewhere, and are only taken once their
+size and modification time haven't changed for a while. They are compressed on a bounded pool of worker processes
+and written to the database in batches, see pyobs_archive.api.ingest. If the pool is busy, no new files are taken,
+so they just wait in their directory.
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import shutil
+import struct
+import time
+
+from pyobs_archive.api.ingest import create_pool, prepare, store
+
+log = logging.getLogger(__name__)
+
+
+class _Inotify:
+    """Minimal wrapper for the inotify API of Linux."""
+
+    # see inotify(7)
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        # init, raises OSError, if not available
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available.')
+        self._libc = libc
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'Could not initialize inotify.')
+        self._watches = {}
+
+    def add(self, directory: str):
+        """Watch directory for files that have been written or moved into it.
+
+        Args:
+            directory: Directory to watch.
+        """
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'Could not watch %s.' % directory)
+        self._watches[wd] = directory
+
+    def read(self, timeout: float) -> list:
+        """Wait for events.
+
+        Args:
+            timeout: Maximum time to wait in seconds.
+
+        Returns:
+            List of paths of files with events.
+        """
+
+        # wait for data
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return []
+
+        # parse events
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self._watches and name:
+                paths.append(os.path.join(self._watches[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self._fd)
+
+
+class DirectoryWatcher:
+    """Watches directories for new files that have settled."""
+
+    # seconds between scans of directories when using inotify
+    RESCAN_INTERVAL = 60.
+
+    def __init__(self, directories: list, pattern: str = '*.fits', settle: float = 5., interval: float = 2.,
+                 inotify: bool = True):
+        """Create a new watcher.
+
+        Args:
+            directories: Directories to watch, not recursively.
+            pattern: Pattern for names of files to take.
+            settle: Seconds that size and modification time of a file must not change before it is taken.
+            interval: Seconds between scans of directories, if inotify is not used.
+            inotify: Whether to use inotify, if available.
+        """
+        self.directories = directories
+        self.pattern = pattern
+        self.settle = settle
+        self.interval = interval
+
+        # candidates with (size, mtime, time since which these haven't changed), and taken files
+        self._candidates = {}
+        self._taken = set()
+        self._last_scan = 0.
+
+        # try inotify
+        self._inotify = None
+        if inotify:
+            try:
+                self._inotify = _Inotify()
+                for directory in directories:
+                    self._inotify.add(directory)
+            except (OSError, AttributeError, TypeError):
+                log.warning('inotify is not available, polling directories instead.')
+                if self._inotify is not None:
+                    self._inotify.close()
+                self._inotify = None
+
+        # initial scan for existing files
+        self._scan()
+
+    @property
+    def uses_inotify(self) -> bool:
+        return self._inotify is not None
+
+    def _add(self, path: str):
+        # ignore hidden files, e.g. temporary files of uploads
+        name = os.path.basename(path)
+        if name.startswith('.') or not fnmatch.fnmatch(name, self.pattern):
+            return
+        if path not in self._taken and path not in self._candidates:
+            self._candidates[path] = None
+
+    def _scan(self):
+        self._last_scan = time.time()
+        for directory in self.directories:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file():
+                        self._add(entry.path)
+
+    def wait(self, timeout: float):
+        """Wait for new files.
+
+        Args:
+            timeout: Maximum time to wait in seconds.
+        """
+        if self._inotify is not None:
+            for path in self._inotify.read(timeout):
+                self._add(path)
+
+            # events may get lost if the queue of the kernel overflows, so scan once in a while anyway
+            if time.time() >= self._last_scan + self.RESCAN_INTERVAL:
+                self._scan()
+        else:
+            time.sleep(max(0., min(timeout, self._last_scan + self.interval - time.time())))
+            if time.time() >= self._last_scan + self.interval:
+                self._scan()
+
+    def ready(self, limit: int = None) -> list:
+        """Take files that have settled.
+
+        Args:
+            limit: Maximum number of files to take.
+
+        Returns:
+            List of paths, which will not be returned again until forget() has been called for them.
+        """
+        now = time.time()
+        ready = []
+        for path, state in list(self._candidates.items()):
+            if limit is not None and len(ready) >= limit:
+                break
+
+            # file may be gone already
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+
+            # changed?
+            if state is None or state[:2] != (stat.st_size, stat.st_mtime):
+                self._candidates[path] = state = (stat.st_size, stat.st_mtime, now)
+
+            # settled?
+            if now - state[2] >= self.settle:
+                del self._candidates[path]
+                self._taken.add(path)
+                ready.append(path)
+        return ready
+
+    def forget(self, path: str):
+        """Forget a taken file, so that it can be taken again, if it reappears.
+
+        Args:
+            path: Path of file.
+        """
+        self._taken.discard(path)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+
+class IngestDaemon:
+    """Ingests files from directories in batches."""
+
+    def __init__(self, watcher: DirectoryWatcher, processes: int = None, batch_size: int = 100,
+                 max_pending: int = None, move_to: str = None, failed_dir: str = None, shutdown_timeout: float = 60.):
+        """Create a new daemon.
+
+        Args:
+            watcher: Watcher for directories.
+            processes: Number of worker processes, defaults to number of CPUs.
+            batch_size: Maximum number of frames to write to the database at once.
+            max_pending: Maximum number of files being processed at once, defaults to twice the number of processes.
+            move_to: Directory to move ingested files to, they are deleted if not given.
+            failed_dir: Directory to move files to that could not be ingested, they stay in place if not given.
+            shutdown_timeout: Seconds to wait for files being processed on shutdown, before the pool is terminated.
+        """
+        self.watcher = watcher
+        self.processes = processes or os.cpu_count()
+        self.batch_size = batch_size
+        self.max_pending = max_pending or 2 * self.processes
+        self.move_to = move_to
+        self.failed_dir = failed_dir
+        self.shutdown_timeout = shutdown_timeout
+
+        # files being processed with their results, and prepared files waiting to be stored
+        self._pending = collections.deque()
+        self._batch = []
+        self._pool = None
+        self._running = False
+
+    def step(self, timeout: float = 1.):
+        """Take new files, collect results and store a batch, if one is complete.
+
+        Args:
+            timeout: Maximum time to wait for new files, if idle.
+        """
+
+        # wait for files, but not for long if there is something to do
+        self.watcher.wait(0.1 if self._pending or self._batch else timeout)
+
+        # take settled files as long as there is room, the rest has to wait
+        for path in self.watcher.ready(limit=self.max_pending - len(self._pending)):
+            self._pending.append((path, self._pool.apply_async(prepare, (path,))))
+
+        # collect results and store batch if full or if nothing else is coming
+        self._collect()
+        if self._batch and (len(self._batch) >= self.batch_size or not self._pending):
+            self._store()
+
+    def _collect(self):
+        # collect finished results in order
+        while self._pending and self._pending[0][1].ready():
+            path, result = self._pending.popleft()
+            prepared = result.get()
+            if 'error' in prepared:
+                self._failed(path, prepared['error'])
+            else:
+                self._batch.append(prepared)
+
+    def _store(self):
+        batch, self._batch = self._batch, []
+        start = time.time()
+        try:
+            store(batch)
+        except Exception as e:
+            log.exception('Could not store batch of %d frames.', len(batch))
+            for prepared in batch:
+                self._failed(prepared['filename'], str(e))
+            return
+        log.info('Stored %d frames in %.1fs.', len(batch), time.time() - start)
+
+        # move or delete source files, the frames are in the archive already, so a failure here is only logged
+        for prepared in batch:
+            path = prepared['filename']
+            try:
+                if self.move_to is not None:
+                    shutil.move(path, os.path.join(self.move_to, os.path.basename(path)))
+                else:
+                    os.remove(path)
+            except OSError:
+                log.exception('Could not remove ingested file %s.', path)
+                continue
+            self.watcher.forget(path)
+
+    def _failed(self, path: str, error: str):
+        log.error('Could not ingest %s: %s', path, error)
+        if self.failed_dir is not None:
+            try:
+                shutil.move(path, os.path.join(self.failed_dir, os.path.basename(path)))
+            except OSError:
+                log.exception('Could not move %s to %s.', path, self.failed_dir)
+                return
+            self.watcher.forget(path)
+
+    def start(self):
+        """Start worker pool."""
+        self._pool = create_pool(self.processes)
+        self._running = True
+
+    def stop(self):
+        """Let run() finish after the current step."""
+        self._running = False
+
+    def finish(self):
+        """Wait for all files being processed, store them and shut down worker pool.
+
+        If the files are not processed within shutdown_timeout, the pool is terminated and the remaining files stay
+        in their directory, so they are ingested again on the next start.
+        """
+        deadline = time.time() + self.shutdown_timeout
+        while self._pending:
+            self._pending[0][1].wait(max(0., deadline - time.time()))
+            if not self._pending[0][1].ready():
+                break
+            self._collect()
+        if self._batch:
+            self._store()
+
+        # shut down pool
+        if self._pending:
+            log.warning('Terminating worker pool with %d files still being processed.', len(self._pending))
+            self._pending.clear()
+            self._pool.terminate()
+        else:
+            self._pool.close()
+        self._pool.join()
+        self.watcher.close()
+
+    def run(self):
+        """Run until stop() is called."""
+        self.start()
+        try:
+            while self._running:
+                self.step()
+        finally:
+            self.finish()
+
+
+__all__ = ['DirectoryWatcher', 'IngestDaemon']
@@ -0,0 +1,90 @@
+"""Local pool of worker threads for ingesting queued files.
+
+Jobs are stored in the database as IngestJob, so no external broker is required. Workers run either in the web
+server process, started on the first upload, or in a separate process via "manage.py ingestworker", which keeps the
+load of compressing files away from the web server.
+"""
+
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from pyobs_archive.api.models import IngestJob
+
+log = logging.getLogger(__name__)
+
+# running worker threads in this process
+_workers = []
+_lock = threading.Lock()
+
+# set to wake up idle workers
+_wakeup = threading.Event()
+
+
+def run_next() -> bool:
+    """Claim and run the next job in the queue.
+
+    Returns:
+        Whether a job was run.
+    """
+    job = IngestJob.claim()
+    if job is None:
+        return False
+    log.info('Running ingest job %d for %s...', job.id, job.filename)
+    job.run()
+    return True
+
+
+def run_pending() -> int:
+    """Run jobs until the queue is empty.
+
+    Returns:
+        Number of jobs that have been run.
+    """
+    count = 0
+    while run_next():
+        count += 1
+    return count
+
+
+def _work():
+    while True:
+        try:
+            # run a job or wait for new ones
+            if not run_next():
+                _wakeup.wait(settings.INGEST_POLL_INTERVAL)
+                _wakeup.clear()
+        except Exception:
+            log.exception('Error in ingest worker.')
+            _wakeup.wait(settings.INGEST_POLL_INTERVAL)
+        finally:
+            # threads don't get the cleanup of the request cycle
+            close_old_connections()
+
+
+def start_workers(count: int = None) -> list:
+    """Start worker threads in this process, if not running already.
+
+    Args:
+        count: Number of workers, defaults to INGEST_WORKERS.
+
+    Returns:
+        List of worker threads.
+    """
+    count = settings.INGEST_WORKERS if count is None else count
+    with _lock:
+        while len(_workers) < count:
+            thread = threading.Thread(target=_work, name='ingest-%d' % len(_workers), daemon=True)
+            thread.start()
+            _workers.append(thread)
+    return list(_workers)
+
+
+def notify():
+    """Wake up idle workers in this process, e.g. after queueing new jobs."""
+    _wakeup.set()
+
+
+__all__ = ['run_next', 'run_pending', 'start_workers', 'notify']
@@ -277,14 +277,15 @@ $(function () {
         });
     }
 
-    function setOptions(select, options) {
+    function setOptions(select, options, counts) {
         select.change(function () {
             refreshTable();
         });
         select.append($("<option />").val('ALL').text('ALL'));
         $.each(options, function (i) {
             let t = options[i];
-            select.append($("<option />").val(t).text(t));
+            let label = counts && t in counts ? t + ' (' + counts[t] + ')' : t;
+            select.append($("<option />").val(t).text(label));
         });
     }
 
@@ -317,12 +318,12 @@ $(function () {
     // get options
     $.getJSON('/frames/aggregate/', function (data) {
         // set options
-        setOptions($('#imagetype'), data.imagetypes);
-        setOptions($('#binning'), data.binnings);
-        setOptions($('#site'), data.sites);
-        setOptions($('#telescope'), data.telescopes);
-        setOptions($('#instrument'), data.instruments);
-        setOptions($('#filter'), data.filters);
+        setOptions($('#imagetype'), data.imagetypes, data.counts.imagetypes);
+        setOptions($('#binning'), data.binnings, data.counts.binnings);
+        setOptions($('#site'), data.sites, data.counts.sites);
+        setOptions($('#telescope'), data.telescopes, data.counts.telescopes);
+        setOptions($('#instrument'), data.instruments, data.counts.instruments);
+        setOptions($('#filter'), data.filters, data.counts.filters);
         setOptions($('#rlevel'), ['0', '1']);
 
         // set values from url
@@ -196,6 +196,9 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'pyobs_auth.authentication.KeycloakAuthentication',  # optional: Bearer tokens from Keycloak
     ),
+    # the views return plain Django responses, so free the "format" parameter for selecting export formats
+    # instead of DRF renderers
+    'URL_FORMAT_OVERRIDE': None,
 }
 
 # Keycloak is optional: leaving SERVER_URL unset means pyobs_auth.settings.get_settings() raises
@@ -230,6 +233,55 @@ ARCHIVE_ROOT = os.environ.get('ARCHIVE_ROOT', '/data/')
 PATH_FORMATTER = os.environ.get('PATH_FORMATTER', '{SITEID}/{DAY-OBS}/')
 FILENAME_FORMATTER = os.environ.get('FILENAME_FORMATTER') or None
 
+# tile compression of ingested files, either "fpack" (external binary) or "astropy" (in-process, but needs about three
+# times the uncompressed size of an image in memory), and shape of tiles along the FITS axes, e.g. "512,512", defaults
+# to one row per tile
+COMPRESSOR = os.environ.get('COMPRESSOR', 'fpack')
+FPACK_BINARY = os.environ.get('FPACK_BINARY', '/usr/bin/fpack')
+COMPRESSION_TILE = os.environ.get('COMPRESSION_TILE', None)
+
+# queue for uploaded files: directory they are spooled to, number of worker threads started in each web server process
+# (set to 0 when running "manage.py ingestworker" instead), seconds between polling the queue and seconds after which
+# a running job is assumed to be dead and is queued again, and seconds after which an upload in chunks that didn't
+# receive anything is removed
+INGEST_SPOOL = os.environ.get('INGEST_SPOOL', os.path.join(ARCHIVE_ROOT, '.spool'))
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 1))
+INGEST_POLL_INTERVAL = float(os.environ.get('INGEST_POLL_INTERVAL', 2))
+INGEST_JOB_TIMEOUT = int(os.environ.get('INGEST_JOB_TIMEOUT', 3600))
+INGEST_UPLOAD_EXPIRY = int(os.environ.get('INGEST_UPLOAD_EXPIRY', 86400))
+
+# let the web server send files instead of Django: "nginx" for X-Accel-Redirect to SENDFILE_URL, an internal location
+# that maps to ARCHIVE_ROOT, or "xsendfile" for X-Sendfile with the absolute path (Apache, lighttpd)
+SENDFILE_BACKEND = os.environ.get('SENDFILE_BACKEND') or None
+SENDFILE_URL = os.environ.get('SENDFILE_URL', '/protected/')
+
+# seconds that clients may cache files and responses derived from them, like previews, before revalidating them
+FILE_CACHE_MAX_AGE = int(os.environ.get('FILE_CACHE_MAX_AGE', 86400))
+
+# cache for previews in several widths, .thumbnails in ARCHIVE_ROOT by default; they are rendered at ingest, if
+# THUMBNAIL_INGEST is set, or on first request, and evicted least recently used first, when the cache grows beyond
+# THUMBNAIL_CACHE_SIZE bytes
+THUMBNAIL_ROOT = os.environ.get('THUMBNAIL_ROOT') or None
+THUMBNAIL_SIZES = {'small': 200, 'medium': 600, 'large': 1200}
+THUMBNAIL_INGEST = os.environ.get('THUMBNAIL_INGEST', 'true').lower() in ('1', 'true', 'yes')
+THUMBNAIL_CACHE_SIZE = int(os.environ.get('THUMBNAIL_CACHE_SIZE', 1024**3))
+
+# cache for result counts and responses, which are invalidated by bumping counters in the cache on every change, so all
+# web server workers and ingest workers must share it, e.g. with
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache and a CACHE_LOCATION on a volume mounted by all
+# of them, or with a Redis backend; the default LocMemCache is local to each process, so counts and responses are
+# only cached with it, if the timeouts are set explicitly, e.g. for a single process
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+_CACHE_TIMEOUT = 0 if CACHE_BACKEND.endswith('.LocMemCache') else 300
+COUNT_CACHE_TIMEOUT = int(os.environ.get('COUNT_CACHE_TIMEOUT', _CACHE_TIMEOUT))
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', _CACHE_TIMEOUT))
+
 # max upload size in bytes
 DATA_UPLOAD_MAX_MEMORY_SIZE = 50*1024*1024
 
@@ -1,49 +1,123 @@
 import argparse
-from typing import List
+import concurrent.futures
+import hashlib
 import os
 from urllib.parse import urljoin
 import sys
+import threading
+import time
 import requests
 
 
-def ingest_image(filename: str, url: str, token: str):
-    # create session and define headers
-    session = requests.session()
+def _sha256(filename: str) -> str:
+    # hash file in blocks
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _chunks(missing: list, chunk_size: int) -> list:
+    # split missing ranges into chunks
+    chunks = []
+    for start, end in missing:
+        for offset in range(start, end, chunk_size):
+            chunks.append((offset, min(offset + chunk_size, end)))
+    return chunks
+
+
+def ingest_image(filename: str, url: str, token: str, timeout: float = 600, interval: float = 2,
+                 chunk_size: float = 8, streams: int = 4, retries: int = 5, upload_id: int = None):
+    # define headers, every thread gets its own session
     headers = {'Authorization': 'Token ' + token}
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.session()
+        return local.session
 
-    # do some initial GET request for getting the csrftoken
-    session.get(url, headers=headers)
+    # start new upload or continue an old one
+    size = os.path.getsize(filename)
+    if upload_id is None:
+        print("Uploading file %s..." % filename)
+        r = session().post(urljoin(url, 'frames/uploads/'), headers=headers,
+                           json={'filename': os.path.basename(filename), 'size': size, 'checksum': _sha256(filename)})
+    else:
+        print("Resuming upload %d of file %s..." % (upload_id, filename))
+        r = session().get(urljoin(url, 'frames/uploads/%d/' % upload_id), headers=headers)
+    if r.status_code != 200:
+        print('Cannot start upload, received status_code %d: %s' % (r.status_code, r.content))
+        sys.exit(1)
+    upload = r.json()
+    if upload['size'] != size:
+        print('Size of file does not match upload %d.' % upload['id'])
+        sys.exit(1)
+    upload_url = urljoin(url, 'frames/uploads/%d/' % upload['id'])
+    print('Upload ID is %d, use --upload-id to resume it.' % upload['id'])
 
-    # open file
-    img = open(filename, 'rb')
+    def send(chunk):
+        # read chunk
+        start, end = chunk
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
 
-    # remove path
-    filename = os.path.basename(filename)
+        # send it, retry with increasing delays
+        for attempt in range(retries + 1):
+            try:
+                r = session().put(upload_url, data=data, headers={
+                    **headers, 'Content-Type': 'application/octet-stream',
+                    'Content-Range': 'bytes %d-%d/%d' % (start, end - 1, size)})
+                if r.status_code == 200:
+                    return
+                error = 'status_code %d: %s' % (r.status_code, r.content)
+            except requests.RequestException as e:
+                error = str(e)
+            time.sleep(min(2 ** attempt, 30))
+        raise IOError('Could not send chunk at offset %d, %s' % (start, error))
 
-    # send file
-    print("Ingesting file %s..." % filename)
-    r = session.post(
-        urljoin(url, 'frames/create/'),
-        data={'csrfmiddlewaretoken': session.cookies['csrftoken']},
-        files={os.path.basename(filename): img},
-        headers=headers
-    )
+    # send missing chunks in parallel
+    chunks = _chunks(upload['missing'], int(chunk_size * 1024 * 1024))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=streams) as executor:
+        try:
+            for _ in executor.map(send, chunks):
+                pass
+        except IOError as e:
+            print('%s, resume with --upload-id %d.' % (e, upload['id']))
+            sys.exit(1)
 
-    # success, if status code is 200
+    # finalize
+    r = session().post(urljoin(upload_url, 'finalize/'), headers=headers)
     if r.status_code != 200:
-        print('Cannot write file, received status_code %d: %s' % (r.status_code, r.content))
+        print('Could not finalize upload, received status_code %d: %s' % (r.status_code, r.content))
         sys.exit(1)
 
-    # check json
-    json = r.json()
-    if 'created' not in json or json['created'] == 0:
-        if 'errors' in json:
-            print('Could not create file in archive: ' + str(json['errors']))
+    # wait for job to finish
+    job_id = r.json()['jobs'][0]['id']
+    start = time.time()
+    while True:
+        # get status
+        r = session().get(urljoin(url, 'frames/jobs/%d/' % job_id), headers=headers)
+        if r.status_code != 200:
+            print('Cannot get status of job, received status_code %d: %s' % (r.status_code, r.content))
             sys.exit(1)
-        else:
-            print('Could not create file in archive.')
+        job = r.json()
+
+        # finished?
+        if job['status'] == 'done':
+            break
+        elif job['status'] == 'failed':
+            print('Could not create file in archive: ' + str(job['error']))
+            sys.exit(1)
+        elif time.time() - start > timeout:
+            print('Timeout while waiting for job %d, status is %s.' % (job_id, job['status']))
             sys.exit(1)
 
+        # wait a little
+        time.sleep(interval)
+
     # success
     print('Done')
     sys.exit(0)
@@ -56,6 +130,12 @@ if __name__ == '__main__':
     parser.add_argument('-u', '--url', type=str, help='URL of archive', default=os.environ.get('ARCHIVE_URL', None))
     parser.add_argument('-t', '--token', type=str, help='Auth token for archive',
                         default=os.environ.get('ARCHIVE_TOKEN', None))
+    parser.add_argument('--timeout', type=float, help='Seconds to wait for ingest to finish', default=600)
+    parser.add_argument('--interval', type=float, help='Seconds between status requests', default=2)
+    parser.add_argument('--chunk-size', type=float, help='Size of chunks in MB', default=8)
+    parser.add_argument('--streams', type=int, help='Number of chunks sent in parallel', default=4)
+    parser.add_argument('--retries', type=int, help='Number of retries for each chunk', default=5)
+    parser.add_argument('--upload-id', type=int, help='ID of an interrupted upload to resume', default=None)
 
     # parse command line arguments
     args = parser.parse_args()